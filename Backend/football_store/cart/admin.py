@@ -18,19 +18,17 @@ class CartAdmin(admin.ModelAdmin):
         'id',
         'user',
         'created_at',
-        'display_total_price',
+        'total_price',
+        'items_count',
         'updated_at'
     )
     search_fields = ('user__username',)
+    list_select_related = ('user',)
     inlines = [CartItemInline]
-    readonly_fields = ('id', 'display_total_price',)
+    # итоги хранятся в строке корзины (cart/totals.py) — список корзин не читает позиции
+    readonly_fields = ('id', 'total_price', 'items_count')
     autocomplete_fields = ('user',)
 
-    def display_total_price(self, obj):
-        return obj.total_price
-
-    display_total_price.short_description = "Общая цена"
-
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     list_display = (
@@ -42,6 +40,7 @@ class CartItemAdmin(admin.ModelAdmin):
         'created_at'
     )
     list_filter = ('cart',)
+    list_select_related = ('cart__user', 'product')
     readonly_fields = ('id', 'display_total_price')
     search_fields = ('product__name',)
     autocomplete_fields = ('cart', 'product')
@@ -0,0 +1,225 @@
+"""
+Гостевая корзина: корзина анонимного посетителя в кэше, без строк в базе.
+
+Cart связана с пользователем, а строка Cart на каждого анонимного посетителя
+означала бы запись в базу на каждый визит. Поэтому корзина гостя — словарь
+{product_id: позиция} в кэше под случайным id на GUEST_CART_TTL секунд. Id
+выдаётся подписанным (django.core.signing) в cookie guest_cart и в заголовке
+X-Guest-Cart — мобильный клиент присылает его обратно заголовком.
+
+Те же адреса /api/cart/... отвечают гостю той же формой (GuestCartMixin):
+id позиции гостя — id товара. Остаток проверяется при добавлении, но не
+резервируется — резерв (cart/reservations.py) писал бы в базу.
+
+При входе по токену (djoser, сигнал user_logged_in) merge_guest_cart переносит
+позиции гостя в Cart пользователя одним bulk upsert (INSERT ... ON CONFLICT
+(cart_id, product_id) DO UPDATE): количество товара, который уже есть в корзине,
+складывается. Перенесённые позиции тоже не резервируются — остаток
+перепроверяет оформление заказа.
+"""
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.permissions import AllowAny
+
+from main.inventory import available_stock
+from main.models import Product
+from .models import Cart, CartItem
+from .resolver import cart_for_update
+from .totals import recalculate_cart_totals
+
+COOKIE = 'guest_cart'
+HEADER = 'X-Guest-Cart'
+_signer = signing.Signer(salt='cart.guest')
+
+
+def _key(guest_id):
+    return f'cart:guest:{guest_id}'
+
+
+def guest_id_from(request):
+    """ Id гостевой корзины из cookie или заголовка; None — нет или подпись неверна """
+    value = request.headers.get(HEADER) or request.COOKIES.get(COOKIE)
+    if not value:
+        return None
+    try:
+        return _signer.unsign(value)
+    except signing.BadSignature:
+        return None
+
+
+class GuestCart:
+    """ Корзина гостя; сериализуется CartDetailSerializer, как Cart """
+    pk = id = None
+
+    def __init__(self, guest_id=None, lines=None):
+        self.issued = guest_id is None
+        self.guest_id = guest_id or uuid.uuid4().hex
+        # product_id -> {'quantity', 'price', 'created_at', 'updated_at'}
+        self.lines = lines or {}
+        self._items = None
+
+    @classmethod
+    def load(cls, request):
+        guest_id = guest_id_from(request)
+        lines = cache.get(_key(guest_id)) if guest_id else None
+        # просроченная корзина начинается заново под тем же id
+        return cls(guest_id, lines)
+
+    def save(self):
+        cache.set(_key(self.guest_id), self.lines, settings.GUEST_CART_TTL)
+        self._items = None
+
+    def delete(self):
+        cache.delete(_key(self.guest_id))
+
+    @property
+    def signed_id(self):
+        return _signer.sign(self.guest_id)
+
+    @property
+    def items(self):
+        """ Позиции как несохранённые CartItem (id = id товара); товары — одним запросом """
+        if self._items is None:
+            products = Product.objects.filter(
+                pk__in=self.lines, is_published=True
+            ).select_related('category').in_bulk()
+            self._items = sorted(
+                (
+                    CartItem(
+                        pk=product_id, product=products[product_id], quantity=line['quantity'], price=line['price'],
+                        created_at=line['created_at'], updated_at=line['updated_at']
+                    )
+                    for product_id, line in self.lines.items() if product_id in products
+                ),
+                key=lambda item: item.created_at, reverse=True
+            )
+        return self._items
+
+    @property
+    def total_price(self):
+        return sum((item.total_price for item in self.items), start=Decimal('0.00'))
+
+    @property
+    def items_count(self):
+        return len(self.items)
+
+    @property
+    def created_at(self):
+        return min((line['created_at'] for line in self.lines.values()), default=None)
+
+    @property
+    def updated_at(self):
+        return max((line['updated_at'] for line in self.lines.values()), default=None)
+
+    @staticmethod
+    def shortages(quantities):
+        """ {товар: доступно} для товаров из {товар: количество}, которых не хватает (без резерва) """
+        shortages = {}
+        for product, quantity in quantities.items():
+            available = available_stock(product) if product.stock_shards else product.quantity - product.reserved
+            if quantity > available:
+                shortages[product] = max(available, 0)
+        return shortages
+
+    def set_quantities(self, quantities):
+        """ Новые количества {товар: количество} (0 — убрать) одной записью в кэш; остаток проверен вызывающим """
+        added = {product.pk for product, quantity in quantities.items() if quantity} - self.lines.keys()
+        removed = {product.pk for product, quantity in quantities.items() if not quantity} & self.lines.keys()
+        if added and len(self.lines) + len(added) - len(removed) > settings.GUEST_CART_MAX_LINES:
+            raise serializers.ValidationError(
+                {'product': f'В гостевой корзине не больше {settings.GUEST_CART_MAX_LINES} товаров'}
+            )
+        now = timezone.now()
+        for product, quantity in quantities.items():
+            if not quantity:
+                self.lines.pop(product.pk, None)
+                continue
+            line = self.lines.setdefault(product.pk, {'price': product.price, 'created_at': now})
+            line.update(quantity=quantity, updated_at=now)
+        self.save()
+
+    def set_quantity(self, product, quantity):
+        """ Новое количество товара с проверкой остатка (без резерва) """
+        shortages = self.shortages({product: quantity})
+        if shortages:
+            raise serializers.ValidationError({'quantity': f'На складе только {shortages[product]} шт.'})
+        self.set_quantities({product: quantity})
+
+    def add(self, product, quantity):
+        self.set_quantity(product, self.lines.get(product.pk, {}).get('quantity', 0) + quantity)
+
+    def remove(self, product_id):
+        self.lines.pop(product_id, None)
+        self.save()
+
+    def clear(self):
+        self.lines = {}
+        self.delete()
+
+
+def merge_guest_cart(user, guest_cart):
+    """ Переносит позиции гостя в корзину пользователя одним bulk upsert; возвращает число позиций """
+    if not guest_cart.lines:
+        return 0
+    with transaction.atomic():
+        cart = cart_for_update(user)
+        # блокировка корзины: параллельный вход с той же гостевой корзиной ждёт здесь,
+        # а не складывает количество дважды
+        Cart.objects.select_for_update().get(pk=cart.pk)
+        published = set(
+            Product.objects.filter(pk__in=guest_cart.lines, is_published=True).values_list('pk', flat=True)
+        )
+        existing = dict(
+            CartItem.objects.filter(cart=cart, product_id__in=published).values_list('product_id', 'quantity')
+        )
+        CartItem.objects.bulk_create(
+            [
+                CartItem(
+                    cart=cart, product_id=product_id, price=line['price'],
+                    quantity=existing.get(product_id, 0) + line['quantity'],
+                )
+                for product_id, line in guest_cart.lines.items() if product_id in published
+            ],
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity', 'updated_at'],
+        )
+        # bulk_create не вызывает сигналы позиций
+        recalculate_cart_totals([cart.pk])
+        transaction.on_commit(guest_cart.delete)
+    return len(published)
+
+
+class GuestCartMixin:
+    """
+    Анонимному посетителю отвечает метод guest_<action> с гостевой корзиной
+    (self.guest_cart) вместо обычного метода. Действия без guest_<action> требуют входа
+    """
+    def get_permissions(self):
+        if not self.request.user.is_authenticated and hasattr(self, f'guest_{self.action}'):
+            return [AllowAny()]
+        return super().get_permissions()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.guest_cart = None
+        if not request.user.is_authenticated:
+            self.guest_cart = GuestCart.load(request)
+            # обработчик DRF берёт из атрибута метода после initial()
+            setattr(self, request.method.lower(), getattr(self, f'guest_{self.action}'))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        guest_cart = getattr(self, 'guest_cart', None)
+        if guest_cart is not None and guest_cart.issued and guest_cart.lines:
+            response[HEADER] = guest_cart.signed_id
+            response.set_cookie(
+                COOKIE, guest_cart.signed_id, max_age=settings.GUEST_CART_TTL, httponly=True, samesite='Lax'
+            )
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cart.models import Cart
+from cart.purge import purge_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = (
+        "Удаляет брошенные корзины (без изменений дольше --days) пачками с паузой между ними; "
+        "прерванный запуск можно просто повторить"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=settings.CART_ABANDONED_AFTER / (24 * 60 * 60),
+                            help='Сколько дней корзина не менялась (по умолчанию CART_ABANDONED_AFTER)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Корзин в одной транзакции')
+        parser.add_argument('--sleep', type=float, default=0.5, help='Пауза между пачками, секунд')
+        parser.add_argument('--limit', type=int, default=None, help='Удалить не больше N корзин за запуск')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать брошенные корзины')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        if options['dry_run']:
+            count = Cart.objects.filter(updated_at__lt=cutoff).count()
+            self.stdout.write(f"Брошенных корзин: {count}")
+            return
+
+        totals = {'items': 0, 'seconds': 0.0}
+
+        def report(carts, items, seconds):
+            totals['items'] += items
+            totals['seconds'] += seconds
+            self.stdout.write(
+                f"Пачка: корзин {carts}, позиций {items} за {seconds:.2f} с "
+                f"({(carts + items) / seconds if seconds else 0:.0f} строк/с)"
+            )
+
+        started = time.perf_counter()
+        purged = purge_abandoned_carts(
+            cutoff, options['batch_size'], pause=options['sleep'], limit=options['limit'], report=report
+        )
+        rows = purged + totals['items']
+        self.stdout.write(self.style.SUCCESS(
+            f"Удалено корзин: {purged}, позиций: {totals['items']} за {time.perf_counter() - started:.2f} с "
+            f"({rows / totals['seconds'] if totals['seconds'] else 0:.0f} строк/с без пауз)"
+        ))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Q
+
+from cart.models import Cart
+from cart.totals import recalculate_cart_totals
+
+
+class Command(BaseCommand):
+    help = "Сверяет денормализованные итоги корзин (total_price, items_count) с позициями и исправляет расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только проверить: завершиться с ошибкой, если есть расхождения')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько корзин исправлять одним UPDATE')
+
+    def handle(self, *args, **options):
+        mismatched = list(
+            Cart.objects.annotate(calculated_total=Cart.calculated_total(), calculated_count=Cart.calculated_count())
+            .filter(~Q(total_price=F('calculated_total')) | ~Q(items_count=F('calculated_count')))
+            .values_list('pk', flat=True)
+            .iterator()
+        )
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS("Все итоги корзин совпадают"))
+            return
+
+        if options['check']:
+            raise CommandError(
+                f"Расхождения в {len(mismatched)} корзинах, например: "
+                f"{', '.join(map(str, mismatched[:10]))}"
+            )
+
+        batch_size = options['batch_size']
+        for start in range(0, len(mismatched), batch_size):
+            with transaction.atomic():
+                recalculate_cart_totals(mismatched[start:start + batch_size])
+
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано корзин: {len(mismatched)}"))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cart.reservations import resync_reserved, sweep_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Снимает просроченные резервы товаров в корзинах пачками (SKIP LOCKED — "
+        "можно запускать несколько экземпляров параллельно)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Резервов в одной транзакции')
+        parser.add_argument('--loop', type=float, default=0, help='Повторять каждые N секунд (0 — один проход)')
+        parser.add_argument('--resync', action='store_true',
+                            help='Сначала пересчитать Product.reserved по таблице резервов')
+
+    def handle(self, *args, **options):
+        if options['resync']:
+            self.stdout.write(f"Исправлено счётчиков резерва: {resync_reserved()}")
+        while True:
+            started = time.perf_counter()
+            swept = sweep_expired(options['batch_size'])
+            self.stdout.write(f"Снято резервов: {swept} за {time.perf_counter() - started:.2f} с")
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
@@ -0,0 +1,42 @@
+# Generated by Django 6.0.2 on 2026-10-17 19:40
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    Cart = apps.get_model('cart', 'Cart')
+    CartItem = apps.get_model('cart', 'CartItem')
+    money = DecimalField(max_digits=13, decimal_places=2)
+    items = CartItem.objects.filter(cart=OuterRef('pk')).values('cart')
+    Cart.objects.update(
+        total_price=Coalesce(
+            Subquery(items.annotate(total=Sum(F('price') * F('quantity'))).values('total'), output_field=money),
+            Value(Decimal('0.00')),
+            output_field=money
+        ),
+        items_count=Coalesce(Subquery(items.annotate(count=Count('pk')).values('count')), 0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0007_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Позиций'),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=13, verbose_name='Общая цена'),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
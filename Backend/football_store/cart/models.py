@@ -1,4 +1,8 @@
 from django.db import models, transaction
+from django.db.models import (
+    Count, DecimalField, F, OuterRef, Prefetch, Subquery, Sum, Value, prefetch_related_objects
+)
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from django.conf import settings
@@ -19,24 +23,67 @@ class Cart(models.Model):
         verbose_name='Создано',
         db_index=True
     )
+    # по updated_at очистка брошенных корзин (cart/purge.py) выбирает самые старые пачками
     updated_at = models.DateTimeField(
         auto_now=True,
-        verbose_name='Обновлено'
+        verbose_name='Обновлено',
+        db_index=True
+    )
+
+    # Денормализованные итоги корзины: поддерживаются позициями (cart/totals.py, signals.py)
+    # в той же транзакции, что и запись позиции; сверяются командой recompute_cart_totals
+    total_price = models.DecimalField(
+        verbose_name='Общая цена',
+        max_digits=13,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False
+    )
+    items_count = models.PositiveIntegerField(
+        verbose_name='Позиций',
+        default=0,
+        editable=False
     )
 
     def __str__(self):
         return f"Корзина {self.user.username}"
 
-    @property
-    def total_price(self) -> Decimal:
-        # Защищаемся от битых/несохранённых CartItem
-        total = Decimal('0.00')
-        for item in self.items.select_related('product'):
-            try:
-                total += item.total_price
-            except (TypeError, AttributeError):
-                pass  # пропускаем проблемные строки, чтобы админка не падала
-        return total
+    @staticmethod
+    def calculated_total():
+        """ Выражение с суммой позиций корзины (для annotate/update) """
+        return Coalesce(
+            Subquery(
+                CartItem.objects.filter(cart=OuterRef('pk'))
+                .values('cart')
+                .annotate(total=Sum(F('price') * F('quantity')))
+                .values('total'),
+                output_field=DecimalField(max_digits=13, decimal_places=2)
+            ),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=13, decimal_places=2)
+        )
+
+    @staticmethod
+    def calculated_count():
+        """ Выражение с числом позиций корзины """
+        return Coalesce(
+            Subquery(
+                CartItem.objects.filter(cart=OuterRef('pk'))
+                .values('cart')
+                .annotate(count=Count('pk'))
+                .values('count')
+            ),
+            0
+        )
+
+    def save(self, *args, **kwargs):
+        # итоги меняют только позиции — обычный save() их не перезаписывает (как у Order)
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('total_price', 'items_count')
+            ]
+        super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = "Корзина"
@@ -94,6 +141,18 @@ class CartItem(models.Model):
             return Decimal('0.00')
         return self.price * Decimal(self.quantity)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_saved_state()
+        return instance
+
+    def remember_saved_state(self):
+        """ Запоминаем, в какую корзину и на какую сумму позиция записана в базе """
+        price, quantity = self.__dict__.get('price'), self.__dict__.get('quantity')
+        total = price * quantity if price is not None and quantity is not None else None
+        self._saved_state = (self.__dict__.get('cart_id'), total)
+
     def clean(self):
         if self.quantity > self.product.quantity:
             raise ValidationError({
@@ -110,4 +169,50 @@ class CartItem(models.Model):
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return f"{self.product.name} × {self.quantity}"
\ No newline at end of file
+        return f"{self.product.name} × {self.quantity}"
+
+
+class StockReservation(models.Model):
+    """
+    Резерв товара под позицию корзины до expires_at (cart/reservations.py).
+    Сумма живых резервов товара хранится в Product.reserved.
+
+    Связь с позицией без внешнего ключа в базе и без каскада: удаление позиции
+    не ждёт резерв, который сейчас снимает чистильщик. Оставшийся «сиротой» резерв
+    снимется сам по истечении срока
+    """
+    cart_item = models.ForeignKey(
+        CartItem,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='reservations',
+        verbose_name='Позиция корзины'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='reservations',
+        verbose_name='Товар'
+    )
+    quantity = models.PositiveIntegerField(verbose_name='Количество')
+    expires_at = models.DateTimeField(verbose_name='Действует до', db_index=True)
+
+    class Meta:
+        verbose_name = "Резерв товара"
+        verbose_name_plural = "Резервы товаров"
+        db_table = 'stock_reservation'
+
+    def __str__(self):
+        return f"{self.product_id} × {self.quantity} до {self.expires_at:%H:%M}"
+
+
+def prefetch_cart_items(*carts, deferred=()):
+    """
+    Подгружает позиции корзин вместе с товарами и их категориями
+    (их читает CartDetailSerializer) — два запроса вместо N+1.
+    deferred — колонки позиций/товаров, которые не нужны ответу (см. main.fieldsets)
+    """
+    items = CartItem.objects.select_related('product__category')
+    if deferred:
+        items = items.defer(*deferred)
+    prefetch_related_objects(list(carts), Prefetch('items', queryset=items))
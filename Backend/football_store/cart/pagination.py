@@ -1,6 +1,6 @@
-from rest_framework.pagination import CursorPagination
+from main.pagination import KeysetCursorPagination
 
-class CartPaginateCursor(CursorPagination):
+class CartPaginateCursor(KeysetCursorPagination):
 
     page_size = 20  # сколько объектов на страницу
     ordering = "-created_at"  # поле сортировки
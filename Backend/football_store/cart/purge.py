@@ -0,0 +1,99 @@
+"""
+Очистка брошенных корзин.
+
+Строки Cart и CartItem раньше не удалялись, и таблица cart_item росла с каждым
+посетителем, который хоть раз что-то положил в корзину. purge_abandoned_carts
+удаляет корзины, которые не менялись с cutoff (Cart.updated_at сдвигает каждая
+запись позиции, cart/totals.py), вместе с позициями. Запускается командой
+purge_carts по расписанию.
+
+Удаление идёт пачками по batch_size корзин, каждая пачка — своя короткая
+транзакция, между пачками — пауза: блокировки держатся недолго, а реплики
+успевают догнать поток удалений. Пачка — самые старые по (updated_at, pk)
+корзины после предыдущей, так что прерванный проход просто продолжает следующий
+запуск: удалённые корзины под условие больше не попадают.
+
+Корзину, которую сейчас меняют, пачка пропускает (SKIP LOCKED), а у
+заблокированных перепроверяет updated_at. Резервы позиций (cart/reservations.py)
+снимаются в той же транзакции; порядок блокировок обычный — сначала товары
+(только те, у которых есть резервы этих корзин), потом корзины и резервы.
+Строки удаляются простыми DELETE ... WHERE cart_id IN, без ORM-каскада: тот загрузил
+бы все позиции пачки в память и послал бы post_delete на каждую. Сигналы здесь не
+нужны — итоги удаляемых корзин пересчитывать незачем, у StockReservation нет каскада
+от позиции, — а закэшированные id корзин (cart/resolver.py) сбрасываются явно.
+"""
+import time
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Q
+
+from main.models import Product
+from main.transactions import lock_products
+from .models import Cart, CartItem, StockReservation
+from .reservations import take_holds, unreserved, update_reserved
+from .resolver import forget_cart_ids
+
+
+def _purge_batch(cutoff, candidates):
+    """ Удаляет незаблокированные корзины из candidates; возвращает (корзин, позиций) """
+    with transaction.atomic():
+        lock_products(sorted(set(
+            StockReservation.objects.filter(cart_item__cart_id__in=candidates).values_list('product_id', flat=True)
+        )))
+        carts = dict(
+            Cart.objects.select_for_update(skip_locked=True)
+            .filter(pk__in=candidates, updated_at__lt=cutoff)
+            .values_list('pk', 'user_id')
+        )
+        if not carts:
+            return 0, 0
+        cart_ids = list(carts)
+
+        products = dict(CartItem.objects.filter(cart_id__in=cart_ids).values_list('pk', 'product_id'))
+        per_product = Counter()
+        for cart_item_id, quantity in take_holds(list(products)).items():
+            per_product[products[cart_item_id]] += quantity
+        if per_product:
+            update_reserved(Product.objects.filter(pk__in=per_product), unreserved(per_product))
+
+        items = CartItem.objects.filter(cart_id__in=cart_ids)
+        items_deleted = items._raw_delete(items.db)
+        purged = Cart.objects.filter(pk__in=cart_ids)
+        purged._raw_delete(purged.db)
+
+        user_ids = list(carts.values())
+        forget_cart_ids(user_ids)
+        transaction.on_commit(lambda: forget_cart_ids(user_ids))
+    return len(cart_ids), items_deleted
+
+
+def purge_abandoned_carts(cutoff, batch_size=500, pause=0, limit=None, report=None):
+    """
+    Удаляет корзины с updated_at < cutoff пачками по batch_size, с паузой pause секунд
+    между пачками, всего не больше limit. report(корзин, позиций, секунд) вызывается
+    после каждой пачки. Возвращает число удалённых корзин
+    """
+    purged = 0
+    after = None
+    while limit is None or purged < limit:
+        carts = Cart.objects.filter(updated_at__lt=cutoff)
+        if after is not None:
+            # пропущенные (заблокированные) корзины остаются следующему запуску
+            carts = carts.filter(Q(updated_at__gt=after[0]) | Q(updated_at=after[0], pk__gt=after[1]))
+        size = batch_size if limit is None else min(batch_size, limit - purged)
+        candidates = list(carts.order_by('updated_at', 'pk').values_list('updated_at', 'pk')[:size])
+        if not candidates:
+            break
+        after = candidates[-1]
+
+        started = time.perf_counter()
+        carts_deleted, items_deleted = _purge_batch(cutoff, [pk for _, pk in candidates])
+        purged += carts_deleted
+        if report is not None:
+            report(carts_deleted, items_deleted, time.perf_counter() - started)
+        if len(candidates) < size:
+            break
+        if pause:
+            time.sleep(pause)
+    return purged
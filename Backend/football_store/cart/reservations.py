@@ -0,0 +1,171 @@
+"""
+Резервы товара под позиции корзины.
+
+Добавленный в корзину товар удерживается за покупателем CART_RESERVATION_TTL
+секунд: строка StockReservation плюс счётчик Product.reserved. Другие покупатели
+видят Product.available = quantity - reserved (генерируемая колонка), так что
+оформление заказа реже падает с «недостаточно товара» после заполнения корзины,
+а чтение товара не суммирует резервы.
+
+Порядок блокировок везде один: сначала строки товаров (lock_products, по pk),
+потом резервы с SKIP LOCKED. Чистильщик (sweep_expired) берёт просроченные
+резервы пачкой с SKIP LOCKED и только потом товары, но его резервы никто не ждёт —
+все остальные их пропускают, — поэтому взаимоблокировок нет, а несколько
+чистильщиков делят просроченные резервы без пересечений.
+
+Шардированные товары (main/inventory.py) не резервируются: резерв снова
+блокировал бы строку товара, от которой шарды избавляют.
+
+Product.reserved меняет available в ответах каталога, поэтому каждое его
+изменение (update_reserved) сдвигает и updated_at товара — по нему считаются
+ETag (main/conditional.py) — и после коммита поколение кэша каталога.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from main.cache import bump_catalog_generation
+from main.models import Product
+from main.transactions import lock_products
+from .models import StockReservation
+
+
+def reservations_enabled():
+    return settings.CART_RESERVATION_TTL > 0
+
+
+def take_holds(cart_item_ids):
+    """
+    Снимает резервы позиций, которые не заняты чистильщиком.
+    Возвращает {cart_item_id: количество}; Product.reserved уменьшает вызывающий
+    """
+    rows = list(
+        StockReservation.objects.select_for_update(skip_locked=True)
+        .filter(cart_item_id__in=cart_item_ids)
+        .values_list('pk', 'cart_item_id', 'quantity')
+    )
+    if not rows:
+        return {}
+    StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+    held = Counter()
+    for _, cart_item_id, quantity in rows:
+        held[cart_item_id] += quantity
+    return held
+
+
+def unreserved(per_product):
+    """ Выражение для update(reserved=...): минус per_product[pk], не ниже нуля """
+    return Greatest(
+        Case(
+            *[When(pk=product_id, then=F('reserved') - quantity) for product_id, quantity in per_product.items()],
+            default=F('reserved'),
+            output_field=IntegerField()
+        ),
+        Value(0)
+    )
+
+
+def update_reserved(products, reserved):
+    """
+    UPDATE Product.reserved = reserved у товаров products (queryset); вместе с ним — updated_at
+    и поколение каталога, иначе кэш ответов и ETag отдавали бы прежний available
+    """
+    updated = products.update(reserved=reserved, updated_at=timezone.now())
+    if updated:
+        transaction.on_commit(bump_catalog_generation)
+    return updated
+
+
+def reserve(cart_item, product, quantity):
+    """
+    Резервирует под позицию quantity единиц (вместо прежнего резерва) и продлевает срок.
+    product должен быть заблокирован вызывающим. False — столько нет в наличии
+    """
+    held = take_holds([cart_item.pk]).get(cart_item.pk, 0)
+    if quantity - held > product.quantity - product.reserved:
+        return False
+    StockReservation.objects.create(
+        cart_item=cart_item, product=product, quantity=quantity,
+        expires_at=timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL)
+    )
+    if quantity != held:
+        update_reserved(Product.objects.filter(pk=product.pk), F('reserved') + quantity - held)
+    return True
+
+
+def reserve_many(cart_items, released):
+    """
+    reserve() для нескольких позиций: под каждую резервируется её количество одним INSERT.
+    released — {product_id: количество} резервов, снятых перед этим take_holds().
+    Product.reserved меняется одним UPDATE; товары заблокированы и остаток проверен вызывающим
+    """
+    expires_at = timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL)
+    StockReservation.objects.bulk_create([
+        StockReservation(
+            cart_item=cart_item, product_id=cart_item.product_id, quantity=cart_item.quantity, expires_at=expires_at
+        )
+        for cart_item in cart_items
+    ])
+    per_product = Counter(released)
+    for cart_item in cart_items:
+        per_product[cart_item.product_id] -= cart_item.quantity
+    per_product = {product_id: quantity for product_id, quantity in per_product.items() if quantity}
+    if per_product:
+        # unreserved вычитает: отрицательное «снятие» — это прибавка резерва
+        update_reserved(Product.objects.filter(pk__in=per_product), unreserved(per_product))
+
+
+def release(cart_items):
+    """ Снимает резервы позиций перед их удалением """
+    if not cart_items:
+        return
+    lock_products(sorted({cart_item.product_id for cart_item in cart_items}))
+    held = take_holds([cart_item.pk for cart_item in cart_items])
+    per_product = Counter()
+    for cart_item in cart_items:
+        per_product[cart_item.product_id] += held.get(cart_item.pk, 0)
+    per_product = {product_id: quantity for product_id, quantity in per_product.items() if quantity}
+    if per_product:
+        update_reserved(Product.objects.filter(pk__in=per_product), unreserved(per_product))
+
+
+def sweep_expired(batch_size=1000, now=None):
+    """
+    Снимает просроченные резервы пачками по batch_size, каждая — своя транзакция.
+    Возвращает число снятых резервов
+    """
+    now = now or timezone.now()
+    swept = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('pk', 'product_id', 'quantity')[:batch_size]
+            )
+            if not rows:
+                return swept
+            per_product = Counter()
+            for _, product_id, quantity in rows:
+                per_product[product_id] += quantity
+            lock_products(sorted(per_product))
+            StockReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+            update_reserved(Product.objects.filter(pk__in=per_product), unreserved(per_product))
+        swept += len(rows)
+
+
+@transaction.atomic
+def resync_reserved():
+    """ Пересчитывает Product.reserved по таблице резервов (после сбоев и ручных правок) """
+    live = StockReservation.objects.filter(product=OuterRef('pk')).values('product').annotate(
+        total=Sum('quantity')
+    ).values('total')
+    return update_reserved(
+        Product.objects.exclude(reserved=Coalesce(Subquery(live), 0)), Coalesce(Subquery(live), 0)
+    )
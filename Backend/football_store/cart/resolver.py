@@ -0,0 +1,64 @@
+"""
+Корзина текущего пользователя без записи в базу при чтении.
+
+Раньше каждый запрос к корзине делал Cart.objects.get_or_create(user=...), и при
+ATOMIC_REQUESTS просмотр корзины превращался в транзакцию «прочитать, а может,
+и вставить». Теперь чтение (get_cart) у пользователя без корзины отдаёт пустую
+EmptyCart — ответ той же формы, — а строка Cart создаётся только первой записью
+в корзину (cart_for_update).
+
+id корзины пользователя (или «корзины нет») кэшируется на CART_ID_CACHE_TIMEOUT:
+повторный просмотр пустой корзины не ходит в базу вовсе, а корзина читается
+по первичному ключу. Сигналы Cart (signals.py) сбрасывают запись при создании
+и удалении корзины — сразу и ещё раз после коммита, чтобы читатель, успевший
+до коммита закэшировать «корзины нет», не держал это значение.
+bulk_create сигналов не вызывает — после него нужен forget_cart_ids().
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Cart
+
+NO_CART = 0
+
+
+def _key(user_id):
+    return f'cart:id:{user_id}'
+
+
+class EmptyCart:
+    """ Корзина пользователя, у которого ещё нет строки Cart (сериализуется как обычная) """
+    pk = id = None
+    total_price = Decimal('0.00')
+    items_count = 0
+    created_at = updated_at = None
+
+    def __init__(self, user):
+        self.user = user
+        self.items = []
+
+
+def get_cart(user):
+    """ Корзина для чтения: Cart или EmptyCart, ничего не создаёт """
+    cart_id = cache.get(_key(user.pk))
+    if cart_id == NO_CART:
+        return EmptyCart(user)
+    carts = Cart.objects.filter(user=user)
+    cart = carts.filter(pk=cart_id).first() if cart_id is not None else None
+    if cart is None:
+        # промах кэша или устаревший id
+        cart = carts.first()
+        cache.set(_key(user.pk), cart.pk if cart is not None else NO_CART, settings.CART_ID_CACHE_TIMEOUT)
+    return cart if cart is not None else EmptyCart(user)
+
+
+def cart_for_update(user):
+    """ Корзина для записи: создаётся при первом изменении """
+    cart, _ = Cart.objects.get_or_create(user=user)
+    return cart
+
+
+def forget_cart_ids(user_ids):
+    cache.delete_many([_key(user_id) for user_id in user_ids])
@@ -1,11 +1,17 @@
+from django.conf import settings
 from rest_framework import serializers
-from django.db import transaction
 from .models import Cart, CartItem
+from .reservations import reservations_enabled, reserve, reserve_many, take_holds
+from .resolver import cart_for_update
+from .totals import recalculate_cart_totals, suspend_totals
 from main.models import Product
+from main.fieldsets import SparseFieldsetSerializerMixin
+from main.inventory import available_stock
+from main.transactions import lock_products, retry_transaction
 from main.serializers import ProductSerializer
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     product = serializers.SlugRelatedField(
         slug_field='slug',
         queryset=Product.objects.filter(is_published=True),
@@ -37,36 +43,72 @@ class CartItemSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'price', 'total_price', 'created_at', 'updated_at']
 
+    @retry_transaction('cart_add')
     def create(self, validated_data):
         request = self.context['request']
         user = request.user
         product = validated_data['product']
         quantity = validated_data['quantity']
 
-        with transaction.atomic():
-            product = Product.objects.select_for_update().get(pk=product.pk)
+        # Порядок блокировок тот же, что у оформления заказа: сначала товар, потом позиции корзины.
+        # Шардированный остаток (main/inventory.py) проверяем без блокировки строки товара —
+        # списывается он только при оформлении заказа
+        if not product.stock_shards:
+            product = lock_products([product.pk])[product.pk]
 
-            if product.quantity < quantity:
-                raise serializers.ValidationError(
-                    {'quantity': f'На складе только {product.quantity} шт.'}
-                )
+        # корзину передаёт add; POST /item/ создаёт её здесь при первом добавлении
+        cart = validated_data.get('cart') or cart_for_update(user)
 
-            cart, _ = Cart.objects.get_or_create(user=user)
+        # Строку позиции блокируем: шардированный товар не заблокирован, и без этого два
+        # параллельных добавления прочитали бы одно количество и одно прибавление потерялось бы
+        cart_item, created = CartItem.objects.select_for_update().get_or_create(
+            cart=cart,
+            product=product,
+            defaults={'quantity': quantity, 'price': product.price}
+        )
 
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=product,
-                defaults={'quantity': quantity, 'price': product.price}
-            )
-
-            if not created:
-                cart_item.quantity += quantity
-                cart_item.save()
+        if not created:
+            cart_item.quantity += quantity
+            cart_item.save()
 
+        self.check_stock(cart_item, product, quantity)
         return cart_item
 
+    @retry_transaction('cart_update')
+    def update(self, instance, validated_data):
+        # товар у позиции не меняется — другой товар добавляется через add
+        validated_data.pop('product', None)
+        product = instance.product
+        if not product.stock_shards:
+            product = lock_products([product.pk])[product.pk]
+        added = validated_data.get('quantity', instance.quantity) - instance.quantity
+
+        instance = super().update(instance, validated_data)
+        self.check_stock(instance, product, added)
+        return instance
+
+    def check_stock(self, cart_item, product, added):
+        """
+        Хватает ли товара на added добавленных единиц. С резервами (cart/reservations.py)
+        резерв позиции приводится к её новому количеству. Ошибка откатывает транзакцию
+        """
+        if product.stock_shards:
+            available = available_stock(product)
+            enough = available >= added
+        elif reservations_enabled():
+            available = product.quantity - product.reserved
+            enough = reserve(cart_item, product, cart_item.quantity)
+        else:
+            available = product.quantity - product.reserved
+            enough = available >= added
+
+        if not enough:
+            raise serializers.ValidationError(
+                {'quantity': f'На складе только {max(available, 0)} шт.'}
+            )
+
 
-class CartDetailSerializer(serializers.ModelSerializer):
+class CartDetailSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.DecimalField(
         max_digits=13,
@@ -76,4 +118,136 @@ class CartDetailSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Cart
-        fields = ['id', 'total_price', 'items', 'created_at', 'updated_at']
+        fields = ['id', 'total_price', 'items_count', 'items', 'created_at', 'updated_at']
+
+
+class CartOperationSerializer(serializers.Serializer):
+    """ Операция пакета: add — прибавить quantity, set — установить (0 — убрать), remove — убрать """
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product = serializers.SlugField()
+    quantity = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, attrs):
+        if attrs['op'] == 'add' and not attrs.get('quantity'):
+            raise serializers.ValidationError({'quantity': 'Для add нужно количество не меньше 1'})
+        if attrs['op'] == 'set' and 'quantity' not in attrs:
+            raise serializers.ValidationError({'quantity': 'Для set нужно количество'})
+        return attrs
+
+
+def fold_operations(operations, products, current):
+    """
+    Сворачивает операции по порядку в итоговые количества {товар: количество} (0 — убрать).
+    products — {slug: Product}, current — {product_id: количество сейчас}
+    """
+    quantities = {}
+    for operation in operations:
+        product = products[operation['product']]
+        if operation['op'] == 'add':
+            quantities[product] = quantities.get(product, current.get(product.pk, 0)) + operation['quantity']
+        elif operation['op'] == 'set':
+            quantities[product] = operation['quantity']
+        else:
+            quantities[product] = 0
+    return quantities
+
+
+def shortage_error(shortages):
+    """ Ошибка пакета: по slug товара — сколько его есть """
+    return serializers.ValidationError({
+        'operations': {product.slug: f'На складе только {available} шт.' for product, available in shortages.items()}
+    })
+
+
+class CartBatchSerializer(serializers.Serializer):
+    """
+    Пакет операций с корзиной (POST /api/cart/item/batch/), применяется целиком или никак.
+    Вместо запроса, транзакции и блокировки товара на каждую позицию — одна транзакция:
+    товары блокируются один раз по pk, остаток проверяется по заблокированным строкам,
+    позиции удаляются одним DELETE и записываются одним INSERT ... ON CONFLICT
+    """
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=settings.CART_BATCH_MAX_OPERATIONS)
+
+    def validate(self, attrs):
+        slugs = {operation['product'] for operation in attrs['operations']}
+        # товары всех операций одним запросом
+        attrs['products'] = {
+            product.slug: product for product in Product.objects.filter(slug__in=slugs, is_published=True)
+        }
+        missing = slugs - attrs['products'].keys()
+        if missing:
+            raise serializers.ValidationError({'operations': {slug: 'Товар не найден' for slug in sorted(missing)}})
+        return attrs
+
+    @retry_transaction('cart_batch')
+    def create(self, validated_data):
+        user = self.context['request'].user
+        cart = cart_for_update(user)
+
+        # Порядок блокировок тот же, что у add и оформления заказа: товары (по pk), затем корзина
+        # и резервы. Шардированные товары не блокируем (main/inventory.py)
+        products = validated_data['products']
+        locked = lock_products([product.pk for product in products.values() if not product.stock_shards])
+        products = {slug: locked.get(product.pk, product) for slug, product in products.items()}
+        # параллельный пакет той же корзины ждёт здесь и сворачивает операции от наших количеств
+        Cart.objects.select_for_update().get(pk=cart.pk)
+
+        items = {
+            cart_item.product_id: cart_item
+            for cart_item in CartItem.objects.filter(cart=cart, product__in=products.values())
+        }
+        quantities = fold_operations(
+            validated_data['operations'], products,
+            {product_id: cart_item.quantity for product_id, cart_item in items.items()}
+        )
+        reserving = reservations_enabled()
+        held = take_holds([cart_item.pk for cart_item in items.values()]) if reserving else {}
+
+        shortages = {}
+        for product, quantity in quantities.items():
+            cart_item = items.get(product.pk)
+            current = cart_item.quantity if cart_item is not None else 0
+            if not quantity:
+                continue
+            if product.stock_shards:
+                available, needed = available_stock(product), quantity - current
+            elif reserving:
+                # как reserve(): резерв позиции приводится к новому количеству
+                available = product.quantity - product.reserved
+                needed = quantity - (held.get(cart_item.pk, 0) if cart_item is not None else 0)
+            else:
+                available, needed = product.quantity - product.reserved, quantity - current
+            if needed > available:
+                shortages[product] = max(available, 0)
+        if shortages:
+            # ошибка откатывает транзакцию вместе со снятыми резервами
+            raise shortage_error(shortages)
+
+        removed = [product.pk for product, quantity in quantities.items() if not quantity and product.pk in items]
+        if removed:
+            with suspend_totals():
+                CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+        kept = [
+            CartItem(
+                cart=cart, product=product, quantity=quantity,
+                price=items[product.pk].price if product.pk in items else product.price
+            )
+            for product, quantity in quantities.items() if quantity
+        ]
+        # bulk_create не вызывает сигналы позиций; pk новых позиций возвращает RETURNING
+        CartItem.objects.bulk_create(
+            kept,
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity', 'updated_at'],
+        )
+        if reserving:
+            released = {}
+            for cart_item in items.values():
+                if held.get(cart_item.pk):
+                    released[cart_item.product_id] = held[cart_item.pk]
+            reserve_many([cart_item for cart_item in kept if not cart_item.product.stock_shards], released)
+        recalculate_cart_totals([cart.pk])
+
+        cart.refresh_from_db(fields=['total_price', 'items_count', 'updated_at'])
+        return cart
@@ -0,0 +1,66 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .guest import GuestCart, guest_id_from, merge_guest_cart
+from .models import Cart, CartItem
+from .resolver import forget_cart_ids
+from .totals import recalculate_cart_totals, shift_cart_totals, totals_suspended
+
+
+@receiver(post_save, sender=CartItem)
+def cart_item_saved(sender, instance, created, raw=False, **kwargs):
+    """ Инкрементально переносим изменение позиции в итоги корзины (cart/totals.py) """
+    if raw:
+        return
+    old_cart_id, old_total = getattr(instance, '_saved_state', (None, None))
+
+    if created:
+        shift_cart_totals(instance.cart_id, instance.total_price, 1)
+    elif old_total is None:
+        # объект собран вручную, прежняя сумма неизвестна — пересчитываем целиком
+        recalculate_cart_totals([instance.cart_id])
+    elif old_cart_id == instance.cart_id:
+        shift_cart_totals(instance.cart_id, instance.total_price - old_total)
+    else:
+        # позицию перенесли в другую корзину
+        shift_cart_totals(old_cart_id, -old_total, -1)
+        shift_cart_totals(instance.cart_id, instance.total_price, 1)
+
+    instance.remember_saved_state()
+
+
+@receiver(post_delete, sender=CartItem)
+def cart_item_deleted(sender, instance, **kwargs):
+    if totals_suspended():
+        return
+    old_cart_id, old_total = getattr(instance, '_saved_state', (None, None))
+    if old_total is None:
+        recalculate_cart_totals([instance.cart_id])
+    else:
+        shift_cart_totals(old_cart_id, -old_total, -1)
+
+
+def _forget_cart_id(user_id):
+    """ Сбрасываем закэшированный id корзины пользователя (cart/resolver.py) — сейчас и после коммита """
+    forget_cart_ids([user_id])
+    transaction.on_commit(lambda: forget_cart_ids([user_id]))
+
+
+@receiver(post_save, sender=Cart)
+def cart_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        _forget_cart_id(instance.user_id)
+
+
+@receiver(post_delete, sender=Cart)
+def cart_deleted(sender, instance, **kwargs):
+    _forget_cart_id(instance.user_id)
+
+
+@receiver(user_logged_in)
+def user_logged_in_merge_guest_cart(sender, request, user, **kwargs):
+    """ Вход по токену (djoser) или в сессию: гостевая корзина переходит в корзину пользователя """
+    if request is not None and guest_id_from(request):
+        merge_guest_cart(user, GuestCart.load(request))
@@ -1,3 +1,496 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from itertools import count
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models.signals import post_delete
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from main.inventory import enable_sharding
+from main.models import Category, Product
+from main.testing import QueryBudgetMixin
+from .models import Cart, CartItem, StockReservation
+from .purge import purge_abandoned_carts
+from .reservations import sweep_expired
+from .totals import recalculate_cart_totals
+
+
+class CartQueryBudgetTests(QueryBudgetMixin, TestCase):
+    slugs = count()
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass')
+        self.cart = Cart.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_items(self, n):
+        for _ in range(n):
+            category = Category.objects.create(title=f'Категория {next(self.slugs)}')
+            product = Product.objects.create(
+                name=f'Товар {next(self.slugs)}', price=Decimal('10.00'), quantity=5, category=category
+            )
+            CartItem.objects.create(cart=self.cart, product=product, quantity=1)
+
+    def test_cart(self):
+        self.assertQueryBudget('/api/cart/cart/', self.add_items, budget=3)
+
+    def test_cart_summary(self):
+        self.assertQueryBudget('/api/cart/cart/summary/', self.add_items, budget=1)
+
+    def test_cart_item_list(self):
+        self.assertQueryBudget('/api/cart/item/', self.add_items, budget=1)
+
+    def test_cart_item_retrieve(self):
+        self.add_items(1)
+        queries, _ = self.count_queries(f'/api/cart/item/{self.cart.items.get().pk}/')
+        self.assertLessEqual(queries, 1)
+
+
+class CartConditionalGetTests(TestCase):
+    url = '/api/cart/cart/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(title='Мячи')
+        self.product = Product.objects.create(name='Мяч Select', price=Decimal('10.00'), quantity=5, category=category)
+
+    def test_unchanged_cart_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.post('/api/cart/item/add/', {'product': self.product.slug, 'quantity': 1})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['items']), 1)
+
+        # другой пользователь с тем же ETag получает свою корзину
+        other = User.objects.create_user(username='other', password='pass')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class CartSparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(title='Мячи')
+        product = Product.objects.create(
+            name='Мяч Select', description='Очень длинное описание', price=Decimal('10.00'), quantity=5,
+            category=category
+        )
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=product, quantity=2)
+
+    def test_nested_fields_in_cart(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(
+                '/api/cart/cart/', {'fields': 'total_price,items.quantity,items.product_detail.name'}
+            )
+        self.assertEqual(response.data, {
+            'total_price': '20.00',
+            'items': [{'quantity': 2, 'product_detail': {'name': 'Мяч Select'}}],
+        })
+        self.assertFalse([q for q in ctx.captured_queries if '"description"' in q['sql']])
+
+    def test_cart_item_list_fields(self):
+        response = self.client.get('/api/cart/item/', {'omit': 'product_detail'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'quantity', 'price', 'total_price', 'created_at', 'updated_at'})
+
+
+class StockReservationTests(TestCase):
+    add_url = '/api/cart/item/add/'
+
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='Мяч', price=Decimal('10.00'), quantity=5, category=Category.objects.create(title='Мячи')
+        )
+        self.alice = self.client_for('alice')
+        self.bob = self.client_for('bob')
+
+    def client_for(self, username):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username=username))
+        return client
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.quantity, self.product.reserved, self.product.available
+
+    def test_cart_add_holds_stock_for_other_buyers(self):
+        self.assertEqual(self.alice.post(self.add_url, {'product': self.product.slug, 'quantity': 3}).status_code, 201)
+        self.assertEqual(self.stock(), (5, 3, 2))
+        self.assertEqual(self.bob.post(self.add_url, {'product': self.product.slug, 'quantity': 3}).status_code, 400)
+        self.assertEqual(self.bob.post(self.add_url, {'product': self.product.slug, 'quantity': 2}).status_code, 201)
+        self.assertEqual(self.stock(), (5, 5, 0))
+        self.assertEqual(self.alice.get(f'/api/v1/product/{self.product.slug}/').data['available'], 0)
+
+    def test_quantity_change_and_delete_release_the_hold(self):
+        self.alice.post(self.add_url, {'product': self.product.slug, 'quantity': 3})
+        item = CartItem.objects.get()
+        self.assertEqual(self.alice.patch(f'/api/cart/item/{item.pk}/', {'quantity': 1}).status_code, 200)
+        self.assertEqual(self.stock(), (5, 1, 4))
+        self.assertEqual(self.alice.patch(f'/api/cart/item/{item.pk}/', {'quantity': 6}).status_code, 400)
+        self.assertEqual(self.stock(), (5, 1, 4))
+        self.assertEqual(self.alice.delete(f'/api/cart/item/{item.pk}/').status_code, 204)
+        self.assertEqual(self.stock(), (5, 0, 5))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_checkout_consumes_own_hold(self):
+        self.alice.post(self.add_url, {'product': self.product.slug, 'quantity': 3})
+        self.bob.post(self.add_url, {'product': self.product.slug, 'quantity': 2})
+
+        self.assertEqual(self.alice.post('/api/v1/order/create-from-cart/').status_code, 201)
+        self.assertEqual(self.stock(), (2, 2, 0))
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+
+    def test_checkout_releases_hold_taken_before_sharding(self):
+        self.alice.post(self.add_url, {'product': self.product.slug, 'quantity': 3})
+        self.bob.post(self.add_url, {'product': self.product.slug, 'quantity': 1})
+        enable_sharding(self.product, 2)
+
+        self.assertEqual(self.alice.post('/api/v1/order/create-from-cart/').status_code, 201)
+        # резерв Алисы ушёл вместе с заказом, остался только резерв Боба
+        self.assertEqual(StockReservation.objects.get().quantity, 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 1)
+
+    def test_expired_holds_are_swept_in_batches(self):
+        self.alice.post(self.add_url, {'product': self.product.slug, 'quantity': 3})
+        self.bob.post(self.add_url, {'product': self.product.slug, 'quantity': 1})
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(sweep_expired(batch_size=1), 2)
+        self.assertEqual(self.stock(), (5, 0, 5))
+        # позиции остаются в корзине, при оформлении остаток проверяется заново
+        self.assertEqual(self.alice.post('/api/v1/order/create-from-cart/').status_code, 201)
+        self.assertEqual(self.stock(), (2, 0, 2))
+
+    def test_catalog_reads_see_reserved_stock(self):
+        cache.clear()
+        path = f'/api/v1/product/{self.product.slug}/'
+        response = self.bob.get(path)
+        self.assertEqual(response.data['available'], 5)
+        etag = response['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.post(self.add_url, {'product': self.product.slug, 'quantity': 2})
+        response = self.bob.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response['X-Cache'], response.data['available']), (200, 'MISS', 3))
+
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(sweep_expired(), 1)
+        response = self.bob.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((response.status_code, response.data['available']), (200, 5))
+
+    def test_resync_repairs_counter(self):
+        self.alice.post(self.add_url, {'product': self.product.slug, 'quantity': 3})
+        Product.objects.filter(pk=self.product.pk).update(reserved=0)
+        call_command('sweep_reservations', '--resync', stdout=StringIO())
+        self.assertEqual(self.stock(), (5, 3, 2))
+
+
+class IdempotentCartAddTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='Мяч', price=Decimal('10.00'), quantity=5, category=Category.objects.create(title='Мячи')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='buyer'))
+
+    def test_retried_add_does_not_add_quantity_twice(self):
+        for url in ('/api/cart/item/add/', '/api/cart/item/'):
+            data = {'product': self.product.slug, 'quantity': 2}
+            first = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=url)
+            retry = self.client.post(url, data, format='json', HTTP_IDEMPOTENCY_KEY=url)
+            self.assertEqual((first.status_code, retry.status_code), (201, 201))
+            self.assertEqual(retry.json(), first.json())
+        self.assertEqual(CartItem.objects.get().quantity, 4)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 4)
+
+
+class CartTotalsTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(title='Мячи')
+        self.ball, self.boots = Product.objects.bulk_create([
+            Product(name='Мяч', slug='myach', price=Decimal('10.00'), quantity=50, category=category),
+            Product(name='Бутсы', slug='butsy', price=Decimal('25.50'), quantity=50, category=category),
+        ])
+        self.user = User.objects.create_user(username='buyer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def totals(self):
+        cart = Cart.objects.get(user=self.user)
+        return cart.total_price, cart.items_count
+
+    def test_item_writes_keep_totals_in_sync(self):
+        response = self.client.post('/api/cart/item/add/', {'product': 'myach', 'quantity': 2})
+        self.assertEqual((response.data['total_price'], response.data['items_count']), ('20.00', 1))
+        self.client.post('/api/cart/item/add/', {'product': 'butsy', 'quantity': 1})
+        self.client.post('/api/cart/item/add/', {'product': 'myach', 'quantity': 1})
+        self.assertEqual(self.totals(), (Decimal('55.50'), 2))
+
+        ball_item = CartItem.objects.get(product=self.ball)
+        self.client.patch(f'/api/cart/item/{ball_item.pk}/', {'quantity': 5})
+        self.assertEqual(self.totals(), (Decimal('75.50'), 2))
+        self.client.delete(f'/api/cart/item/{ball_item.pk}/')
+        self.assertEqual(self.totals(), (Decimal('25.50'), 1))
+
+        response = self.client.get('/api/cart/cart/summary/')
+        self.assertEqual(response.data, {'total_price': '25.50', 'items_count': 1})
+
+        # позиции удаляются каскадом вместе с товаром
+        self.boots.delete()
+        self.assertEqual(self.totals(), (Decimal('0.00'), 0))
+
+    def test_clear_and_checkout_reset_totals(self):
+        self.client.post('/api/cart/item/add/', {'product': 'myach', 'quantity': 2})
+        self.client.post('/api/cart/cart/clear/')
+        self.assertEqual(self.totals(), (Decimal('0.00'), 0))
+
+        self.client.post('/api/cart/item/add/', {'product': 'butsy', 'quantity': 2})
+        self.assertEqual(self.client.post('/api/v1/order/create-from-cart/').status_code, 201)
+        self.assertEqual(self.totals(), (Decimal('0.00'), 0))
+
+    def test_recompute_command_fixes_bulk_writes(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=self.ball, quantity=3, price=self.ball.price),
+            CartItem(cart=cart, product=self.boots, quantity=1, price=self.boots.price),
+        ])
+        with self.assertRaises(CommandError):
+            call_command('recompute_cart_totals', '--check', stdout=StringIO())
+        call_command('recompute_cart_totals', stdout=StringIO())
+        self.assertEqual(self.totals(), (Decimal('55.50'), 2))
+
+        CartItem.objects.filter(product=self.ball).update(quantity=1)
+        self.assertEqual(recalculate_cart_totals([cart.pk]), 1)
+        self.assertEqual(self.totals(), (Decimal('35.50'), 2))
+
+
+class LazyCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(
+            name='Мяч', price=Decimal('10.00'), quantity=5, category=Category.objects.create(title='Мячи')
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='visitor'))
+
+    def cart_queries(self, method, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = getattr(self.client, method)(url)
+        return response, [query['sql'] for query in ctx.captured_queries if 'cart' in query['sql']]
+
+    def test_reads_do_not_create_cart(self):
+        response, queries = self.cart_queries('get', '/api/cart/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'id': None, 'total_price': '0.00', 'items_count': 0, 'items': [], 'created_at': None, 'updated_at': None,
+        })
+        self.assertFalse([sql for sql in queries if not sql.startswith('SELECT')])
+
+        # «корзины нет» закэшировано — повторные чтения не ходят в базу
+        response, queries = self.cart_queries('get', '/api/cart/cart/summary/')
+        self.assertEqual(response.data, {'total_price': '0.00', 'items_count': 0})
+        self.assertEqual(queries, [])
+        response, queries = self.cart_queries('post', '/api/cart/cart/clear/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(queries, [])
+        self.assertFalse(Cart.objects.exists())
+
+    def test_first_mutation_creates_cart(self):
+        self.client.get('/api/cart/cart/')
+        self.client.post('/api/cart/item/add/', {'product': self.product.slug, 'quantity': 2})
+
+        response = self.client.get('/api/cart/cart/')
+        self.assertEqual(response.data['id'], Cart.objects.get().pk)
+        self.assertEqual(response.data['items_count'], 1)
+
+
+class GuestCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(title='Мячи')
+        self.ball, self.boots = Product.objects.bulk_create([
+            Product(name='Мяч', slug='myach', price=Decimal('10.00'), quantity=5, category=category),
+            Product(name='Бутсы', slug='butsy', price=Decimal('25.50'), quantity=5, category=category),
+        ])
+        self.guest = APIClient()
+
+    def test_guest_cart_lives_in_cache_with_the_same_shape(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.guest.post('/api/cart/item/add/', {'product': 'myach', 'quantity': 2})
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertFalse([query for query in ctx.captured_queries if not query['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))])
+        self.assertIn('X-Guest-Cart', response)
+        self.assertEqual(set(response.data), {'id', 'total_price', 'items_count', 'items', 'created_at', 'updated_at'})
+        self.assertEqual((response.data['total_price'], response.data['items_count']), ('20.00', 1))
+
+        # клиент без cookie (мобильный) присылает id заголовком
+        mobile = APIClient(HTTP_X_GUEST_CART=response['X-Guest-Cart'])
+        mobile.post('/api/cart/item/', {'product': 'butsy', 'quantity': 1})
+        self.assertEqual(mobile.patch(f'/api/cart/item/{self.ball.pk}/', {'quantity': 3}).data['quantity'], 3)
+        self.assertEqual(mobile.patch(f'/api/cart/item/{self.ball.pk}/', {'quantity': 6}).status_code, 400)
+        self.assertEqual(
+            mobile.get('/api/cart/cart/summary/').data, {'total_price': '55.50', 'items_count': 2}
+        )
+        self.assertEqual(len(mobile.get('/api/cart/item/').data['results']), 2)
+        self.assertEqual(mobile.delete(f'/api/cart/item/{self.boots.pk}/').status_code, 204)
+        self.assertEqual(mobile.get('/api/cart/cart/').data['items_count'], 1)
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+
+        self.assertEqual(self.guest.post('/api/v1/order/create-from-cart/').status_code, 401)
+
+    def test_login_merges_guest_cart_in_one_upsert(self):
+        user = User.objects.create_user(username='buyer', password='pass')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.ball, quantity=1)
+        self.guest.post('/api/cart/item/add/', {'product': 'myach', 'quantity': 2})
+        self.guest.post('/api/cart/item/add/', {'product': 'butsy', 'quantity': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.guest.post('/auth/token/login/', {'username': 'buyer', 'password': 'pass'})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart=cart).values_list('product__slug', 'quantity')), {'myach': 3, 'butsy': 1}
+        )
+        cart.refresh_from_db()
+        self.assertEqual((cart.total_price, cart.items_count), (Decimal('55.50'), 2))
+        # гостевая корзина после переноса пуста
+        self.assertEqual(self.guest.get('/api/cart/cart/').data['items_count'], 0)
+
+
+class CartBatchTests(TestCase):
+    url = '/api/cart/item/batch/'
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(title='Мячи')
+        self.ball, self.boots, self.socks = Product.objects.bulk_create([
+            Product(name='Мяч', slug='myach', price=Decimal('10.00'), quantity=5, category=category),
+            Product(name='Бутсы', slug='butsy', price=Decimal('25.50'), quantity=5, category=category),
+            Product(name='Гетры', slug='getry', price=Decimal('3.00'), quantity=5, category=category),
+        ])
+        self.user = User.objects.create_user(username='buyer')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_operations_apply_in_one_transaction_with_bulk_writes(self):
+        self.client.post('/api/cart/item/add/', {'product': 'myach', 'quantity': 1})
+        self.client.post('/api/cart/item/add/', {'product': 'getry', 'quantity': 2})
+        operations = [
+            {'op': 'add', 'product': 'myach', 'quantity': 2},
+            {'op': 'add', 'product': 'butsy', 'quantity': 1},
+            {'op': 'set', 'product': 'butsy', 'quantity': 2},
+            {'op': 'remove', 'product': 'getry'},
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        writes = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith(('INSERT', 'DELETE'))]
+        self.assertEqual(len([sql for sql in writes if 'INSERT INTO "cart_item"' in sql]), 1)
+
+        self.assertEqual((response.data['total_price'], response.data['items_count']), ('81.00', 2))
+        self.assertEqual(
+            dict(CartItem.objects.values_list('product__slug', 'quantity')), {'myach': 3, 'butsy': 2}
+        )
+        self.assertEqual(
+            dict(Product.objects.values_list('slug', 'reserved')), {'myach': 3, 'butsy': 2, 'getry': 0}
+        )
+        self.assertEqual(StockReservation.objects.count(), 2)
+
+    def test_shortage_rejects_the_whole_batch(self):
+        self.client.post('/api/cart/item/add/', {'product': 'myach', 'quantity': 1})
+        response = self.client.post(self.url, {'operations': [
+            {'op': 'remove', 'product': 'myach'},
+            {'op': 'add', 'product': 'butsy', 'quantity': 6},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['operations'], {'butsy': 'На складе только 5 шт.'})
+        self.assertEqual(dict(CartItem.objects.values_list('product__slug', 'quantity')), {'myach': 1})
+        self.assertEqual(Product.objects.get(pk=self.ball.pk).reserved, 1)
+
+        response = self.client.post(self.url, {'operations': [{'op': 'add', 'product': 'nope', 'quantity': 1}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_guest_batch(self):
+        guest = APIClient()
+        response = guest.post(self.url, {'operations': [
+            {'op': 'add', 'product': 'myach', 'quantity': 2},
+            {'op': 'add', 'product': 'getry', 'quantity': 1},
+            {'op': 'set', 'product': 'getry', 'quantity': 0},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['total_price'], response.data['items_count']), ('20.00', 1))
+        self.assertIn('X-Guest-Cart', response)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class PurgeAbandonedCartsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ball = Product.objects.create(
+            name='Мяч', price=Decimal('10.00'), quantity=5, category=Category.objects.create(title='Мячи')
+        )
+        self.clients = {}
+        for username in ('old', 'older', 'fresh'):
+            self.clients[username] = APIClient()
+            self.clients[username].force_authenticate(User.objects.create_user(username=username))
+            self.clients[username].post('/api/cart/item/add/', {'product': self.ball.slug, 'quantity': 1})
+        Cart.objects.filter(user__username='old').update(updated_at=timezone.now() - timedelta(days=40))
+        Cart.objects.filter(user__username='older').update(updated_at=timezone.now() - timedelta(days=50))
+
+    def test_idle_carts_are_deleted_in_batches_with_their_holds(self):
+        # id корзины закэширован — после удаления чтение не должно его найти
+        self.assertIsNotNone(self.clients['old'].get('/api/cart/cart/').data['id'])
+        out = StringIO()
+        call_command('purge_carts', '--batch-size', '1', '--sleep', '0', stdout=out)
+
+        self.assertEqual(out.getvalue().count('Пачка:'), 2)
+        self.assertIn('Удалено корзин: 2, позиций: 2', out.getvalue())
+        self.assertEqual(list(Cart.objects.values_list('user__username', flat=True)), ['fresh'])
+        self.assertEqual(CartItem.objects.count(), 1)
+        self.assertEqual(StockReservation.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.ball.pk).reserved, 1)
+        self.assertIsNone(self.clients['old'].get('/api/cart/cart/').data['id'])
+
+    def test_delete_skips_orm_cascade(self):
+        category = self.ball.category
+        products = Product.objects.bulk_create([
+            Product(name=f'Гетры {number}', slug=f'socks-{number}', price=1, category=category) for number in range(20)
+        ])
+        cart = Cart.objects.get(user__username='old')
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=1, price=1) for product in products
+        ])
+        deleted = []
+        receiver = lambda sender, instance, **kwargs: deleted.append(instance)
+        post_delete.connect(receiver, sender=CartItem)
+        self.addCleanup(post_delete.disconnect, receiver, sender=CartItem)
+
+        self.assertEqual(purge_abandoned_carts(timezone.now() - timedelta(days=30)), 2)
+        # позиции удалены одним DELETE, без загрузки объектов и post_delete на каждую
+        self.assertEqual(deleted, [])
+        self.assertEqual(CartItem.objects.filter(cart_id=cart.pk).count(), 0)
 
-# Create your tests here.
+    def test_limit_leaves_the_rest_for_the_next_run(self):
+        call_command('purge_carts', '--limit', '1', '--sleep', '0', stdout=StringIO())
+        self.assertEqual(set(Cart.objects.values_list('user__username', flat=True)), {'old', 'fresh'})
+        out = StringIO()
+        call_command('purge_carts', '--dry-run', stdout=out)
+        self.assertIn('Брошенных корзин: 1', out.getvalue())
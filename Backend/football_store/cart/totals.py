@@ -0,0 +1,63 @@
+"""
+Денормализованные итоги корзины: Cart.total_price и Cart.items_count.
+
+Сумму и число позиций раньше считали в Python по всем позициям (а сводка ещё
+и отдельным COUNT) при каждом чтении корзины. Теперь их переносит в строку
+корзины каждая запись позиции (signals.py) — тем же UPDATE ... SET total_price =
+total_price + delta в той же транзакции, так что /api/cart/cart/summary/ читает
+одну строку по уникальному индексу user_id.
+
+bulk_create и update() позиций сигналов не вызывают — после них нужен
+recalculate_cart_totals(). Очистка всей корзины — empty_cart(): один DELETE
+и обнуление итогов вместо пересчёта по каждой позиции. Пакетные записи
+(CartBatchSerializer) удаляют позиции внутри suspend_totals() и пересчитывают
+итоги один раз.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Cart, CartItem
+
+_suspended = ContextVar('cart_totals_suspended', default=False)
+
+
+def totals_suspended():
+    """ Идёт empty_cart() или пакетная запись: итоги выставят целиком, сдвигать их не нужно """
+    return _suspended.get()
+
+
+@contextmanager
+def suspend_totals():
+    token = _suspended.set(True)
+    try:
+        yield
+    finally:
+        _suspended.reset(token)
+
+
+def shift_cart_totals(cart_id, delta, count=0):
+    if cart_id is not None and (delta or count):
+        Cart.objects.filter(pk=cart_id).update(
+            total_price=F('total_price') + delta, items_count=F('items_count') + count, updated_at=timezone.now()
+        )
+
+
+def recalculate_cart_totals(cart_ids):
+    """ Пересчитывает итоги корзин по их позициям одним UPDATE """
+    return Cart.objects.filter(pk__in=cart_ids).update(
+        total_price=Cart.calculated_total(), items_count=Cart.calculated_count(), updated_at=timezone.now()
+    )
+
+
+def empty_cart(cart):
+    """ Удаляет все позиции корзины и обнуляет её итоги """
+    with suspend_totals():
+        CartItem.objects.filter(cart=cart).delete()
+    Cart.objects.filter(pk=cart.pk).update(
+        total_price=Decimal('0.00'), items_count=0, updated_at=timezone.now()
+    )
+    cart.total_price, cart.items_count = Decimal('0.00'), 0
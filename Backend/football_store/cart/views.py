@@ -1,57 +1,113 @@
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 from rest_framework.mixins import ListModelMixin, RetrieveModelMixin, DestroyModelMixin
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.db import transaction
 from django.db.models import F
-from .models import Cart, CartItem
-from .serializers import CartDetailSerializer, CartItemSerializer
+from django.utils.functional import cached_property
+from .models import CartItem, prefetch_cart_items
+from .reservations import release
+from .guest import GuestCartMixin
+from .resolver import cart_for_update, get_cart
+from .totals import empty_cart
+from .serializers import CartBatchSerializer, CartDetailSerializer, CartItemSerializer, fold_operations, shortage_error
 from main.models import Product
+from main.conditional import ConditionalGetMixin
+from main.idempotency import idempotent
+from main.fieldsets import SparseFieldsetMixin
 from .pagination import CartPaginateCursor
 
 
-class CartViewSet(RetrieveModelMixin, GenericViewSet):
+class CartViewSet(GuestCartMixin, ConditionalGetMixin, SparseFieldsetMixin, RetrieveModelMixin, GenericViewSet):
     """
-    Корзина пользователя (одна на пользователя)
+    Корзина пользователя (одна на пользователя); анонимному посетителю — гостевая (cart/guest.py)
     """
     serializer_class = CartDetailSerializer
     permission_classes = [IsAuthenticated]
+    # в ответе позиции и вложенные товары — ETag меняется при изменении любых из них
+    conditional_fields = ('updated_at', 'product__updated_at')
+    conditional_private = True
+
+    @cached_property
+    def cart(self):
+        # Чтение корзину не создаёт: у пользователя без корзины — пустая EmptyCart (cart/resolver.py)
+        return get_cart(self.request.user)
+
+    def get_conditional_queryset(self):
+        if self.cart.pk is None:
+            return CartItem.objects.none()
+        return CartItem.objects.filter(cart_id=self.cart.pk)
 
     def get_object(self):
-        # Создаём корзину автоматически, если её нет
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
+        cart = self.cart
+        fieldset = self.fieldset
+        if cart.pk is None:
+            return cart
+        if fieldset is None:
+            prefetch_cart_items(cart)
+        elif fieldset.includes('items'):
+            # ?fields= / ?omit=: колонки товаров, которых нет в ответе, не читаем
+            items = fieldset.nested.get('items')
+            prefetch_cart_items(cart, deferred=items.deferred if items is not None else ())
         return cart
 
     # list перенаправляем на retrieve (чтобы /api/cart/ возвращал корзину)
     def list(self, request, *args, **kwargs):
+        return self.conditional_response(self.cart_response, request, *args, **kwargs)
+
+    def cart_response(self, request, *args, **kwargs):
         cart = self.get_object()
         serializer = self.get_serializer(cart)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
     def summary(self, request):
-        cart = self.get_object()
+        # итоги хранятся в строке корзины (cart/totals.py) — позиции не читаем
+        cart = self.cart
         return Response({
             'total_price': str(cart.total_price),
-            'items_count': cart.items.count(),
+            'items_count': cart.items_count,
         })
 
     @action(detail=False, methods=['post', 'delete'], url_path='clear')
+    @idempotent
+    @transaction.atomic
     def clear(self, request):
-        cart = self.get_object()
-        cart.items.all().delete()
+        cart = self.cart
+        if cart.pk is not None:
+            # резервы позиций возвращаем в доступный остаток (cart/reservations.py)
+            release(list(cart.items.all()))
+            empty_cart(cart)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def guest_list(self, request, *args, **kwargs):
+        return Response(self.get_serializer(self.guest_cart).data)
+
+    guest_retrieve = guest_list
+
+    def guest_summary(self, request):
+        return Response({
+            'total_price': str(self.guest_cart.total_price),
+            'items_count': self.guest_cart.items_count,
+        })
+
+    def guest_clear(self, request):
+        self.guest_cart.clear()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class CartItemViewSet(ModelViewSet):
+class CartItemViewSet(GuestCartMixin, SparseFieldsetMixin, ModelViewSet):
     """
     Управление отдельными позициями в корзине:
     - добавление (POST /item/add/)
     - изменение количества (PATCH /item/<id>/)
     - удаление (DELETE /item/<id>/)
     - список (GET /item/)
+    - несколько операций одним запросом (POST /item/batch/)
+    Гость работает с позициями гостевой корзины (cart/guest.py): id позиции — id товара
     """
     serializer_class = CartItemSerializer
     permission_classes = [IsAuthenticated]
@@ -60,7 +116,12 @@ class CartItemViewSet(ModelViewSet):
     def get_queryset(self):
         return CartItem.objects.filter(
             cart__user=self.request.user
-        ).select_related('product')
+        ).select_related('product__category')
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        # повтор POST /item/ после таймаута не прибавляет количество ещё раз
+        return super().create(request, *args, **kwargs)
 
     def perform_destroy(self, instance):
         """ При удалении позиции — опционально вернуть товар на склад """
@@ -70,20 +131,90 @@ class CartItemViewSet(ModelViewSet):
             # product.quantity = F('quantity') + instance.quantity
             # product.save(update_fields=['quantity'])
 
+            release([instance])
             instance.delete()
 
     @action(detail=False, methods=['post'], url_path='add')
+    @idempotent
     def add(self, request):
         """ Добавление товара в корзину """
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        # Явно создаём корзину, если её нет
-        cart, created = Cart.objects.get_or_create(user=request.user)
+        # Корзина создаётся первым добавлением товара
+        cart = cart_for_update(request.user)
 
         # Передаём корзину в serializer (чтобы не было конфликта)
         serializer.save(cart=cart)
 
-        # Возвращаем всю корзину
+        # Возвращаем всю корзину (итоги в памяти устарели — их сдвинула запись позиции)
+        cart.refresh_from_db(fields=['total_price', 'items_count', 'updated_at'])
+        prefetch_cart_items(cart)
         cart_serializer = CartDetailSerializer(cart, context={'request': request})
-        return Response(cart_serializer.data, status=status.HTTP_201_CREATED)
\ No newline at end of file
+        return Response(cart_serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    @idempotent
+    def batch(self, request):
+        """ Пакет операций add / set / remove одной транзакцией; в ответе — корзина целиком """
+        serializer = CartBatchSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        cart = serializer.save()
+        prefetch_cart_items(cart)
+        return Response(CartDetailSerializer(cart, context={'request': request}).data)
+
+    def guest_item(self):
+        for item in self.guest_cart.items:
+            if str(item.pk) == self.kwargs['pk']:
+                return item
+        raise NotFound()
+
+    def guest_list(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.guest_cart.items, many=True)
+        # та же форма, что у курсорной пагинации; гостевая корзина помещается на одну страницу
+        return Response({'next': None, 'previous': None, 'results': serializer.data})
+
+    def guest_create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product = serializer.validated_data['product']
+        self.guest_cart.add(product, serializer.validated_data['quantity'])
+        item = next(item for item in self.guest_cart.items if item.pk == product.pk)
+        return Response(self.get_serializer(item).data, status=status.HTTP_201_CREATED)
+
+    def guest_add(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.guest_cart.add(serializer.validated_data['product'], serializer.validated_data['quantity'])
+        cart_serializer = CartDetailSerializer(self.guest_cart, context={'request': request})
+        return Response(cart_serializer.data, status=status.HTTP_201_CREATED)
+
+    def guest_batch(self, request):
+        serializer = CartBatchSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        quantities = fold_operations(
+            serializer.validated_data['operations'], serializer.validated_data['products'],
+            {product_id: line['quantity'] for product_id, line in self.guest_cart.lines.items()}
+        )
+        shortages = self.guest_cart.shortages(quantities)
+        if shortages:
+            raise shortage_error(shortages)
+        self.guest_cart.set_quantities(quantities)
+        return Response(CartDetailSerializer(self.guest_cart, context={'request': request}).data)
+
+    def guest_retrieve(self, request, *args, **kwargs):
+        return Response(self.get_serializer(self.guest_item()).data)
+
+    def guest_update(self, request, *args, **kwargs):
+        item = self.guest_item()
+        serializer = self.get_serializer(item, data=request.data, partial=kwargs.get('partial', False))
+        serializer.is_valid(raise_exception=True)
+        self.guest_cart.set_quantity(item.product, serializer.validated_data.get('quantity', item.quantity))
+        return Response(self.get_serializer(self.guest_item()).data)
+
+    def guest_partial_update(self, request, *args, **kwargs):
+        return self.guest_update(request, *args, partial=True, **kwargs)
+
+    def guest_destroy(self, request, *args, **kwargs):
+        self.guest_cart.remove(self.guest_item().pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
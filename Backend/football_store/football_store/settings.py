@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 
 load_dotenv()
 
@@ -162,6 +163,72 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CORS_ALLOW_ALL_ORIGINS = True
+# Idempotency-Key — повторы POST после таймаута (main/idempotency.py),
+# X-Guest-Cart — id гостевой корзины (cart/guest.py)
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key', 'x-guest-cart')
+# фронтенд сравнивает ETag, чтобы не перерисовывать неизменившиеся данные;
+# Idempotent-Replayed — ответ взят из сохранённого по Idempotency-Key
+CORS_EXPOSE_HEADERS = ['ETag', 'Idempotent-Replayed', 'X-Guest-Cart']
+
+# Конфигурация полнотекстового поиска PostgreSQL для каталога
+# (russian стеммит и русские, и латинские слова)
+PRODUCT_SEARCH_CONFIG = 'russian'
+
+# Движок поиска по каталогу: 'database' (PostgreSQL FTS / icontains)
+# или 'inverted_index' — встроенный индекс в памяти процесса (main/search_index.py;
+# нужен общий кэш, см. ниже, а снимок пишет команда build_search_index)
+PRODUCT_SEARCH_BACKEND = os.getenv('PRODUCT_SEARCH_BACKEND', 'database')
+PRODUCT_SEARCH_INDEX_PATH = BASE_DIR / 'search_index.bin'
+
+# Кэш. Поколение каталога (main/cache.py) должно быть общим для всех воркеров,
+# поэтому в продакшене задайте REDIS_URL; без него — кэш в памяти процесса
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
+# Границы ценовых диапазонов для /api/v1/product/facets/ и время жизни кэша фасетов
+CATALOG_PRICE_BUCKETS = [1000, 3000, 5000, 10000]
+CATALOG_FACETS_TIMEOUT = 300
+
+# Кэш ответов каталога (main/cache.py: CachedResponseMixin): время жизни записи,
+# сколько ещё отдавать устаревшую запись во время пересборки и таймаут блокировки пересборки
+CATALOG_CACHE_TIMEOUT = 60
+CATALOG_CACHE_STALE_TIMEOUT = 30
+CATALOG_CACHE_LOCK_TIMEOUT = 10
+
+# Сколько секунд хранится запись журнала изменений товаров (main/cache.py), по которому
+# воркеры догоняют свои индексы поиска и подсказок; воркер, отставший сильнее, строит индекс заново
+CATALOG_CHANGES_TIMEOUT = 24 * 60 * 60
+
+# Повтор транзакций, оборванных из-за deadlock / ошибки сериализации (main/transactions.py):
+# число попыток и границы паузы между ними в секундах
+TRANSACTION_RETRY_ATTEMPTS = 3
+TRANSACTION_RETRY_BASE_DELAY = 0.02
+TRANSACTION_RETRY_MAX_DELAY = 0.2
+
+# Сколько секунд товар в корзине зарезервирован за покупателем (cart/reservations.py);
+# 0 — без резервов: остаток проверяется при добавлении и списывается при оформлении
+CART_RESERVATION_TTL = 15 * 60
+
+# Сколько секунд кэшируется id корзины пользователя (или «корзины нет») — cart/resolver.py
+CART_ID_CACHE_TIMEOUT = 60 * 60
+
+# Гостевая корзина в кэше (cart/guest.py): сколько секунд хранится и сколько товаров вмещает
+GUEST_CART_TTL = 7 * 24 * 60 * 60
+GUEST_CART_MAX_LINES = 100
+
+# Через сколько секунд без изменений корзина считается брошенной и удаляется (cart/purge.py)
+CART_ABANDONED_AFTER = 30 * 24 * 60 * 60
+
+# Сколько операций принимает POST /api/cart/item/batch/ за один запрос (CartBatchSerializer)
+CART_BATCH_MAX_OPERATIONS = 100
+
+# Сколько секунд хранится ответ на запрос с заголовком Idempotency-Key (main/idempotency.py)
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = r'D:\Photo_Pet_Project'
\ No newline at end of file
@@ -46,6 +46,7 @@ class ProductAdmin(admin.ModelAdmin):
         'name',
         'description'
     )
+    list_select_related = ('category',)
     prepopulated_fields = {'slug': ('name',)}
     autocomplete_fields = ('category',)
 
@@ -55,22 +56,18 @@ class OrderAdmin(admin.ModelAdmin):
         'id',
         'user',
         'status',
-        'display_total_price',
+        'total_price',
         'created_at',
         'updated_at'
     )
     list_editable = ('status',)
-    readonly_fields = ('id',)
+    list_select_related = ('user',)
+    readonly_fields = ('id', 'total_price')
     list_filter = ('status', 'created_at')
     search_fields = ('user__username', 'id')
     inlines = [OrderItemInline]
     autocomplete_fields = ('user',)
 
-    def display_total_price(self, obj):
-        return obj.total_price
-
-    display_total_price.short_description = "Общая цена"
-
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = (
@@ -82,6 +79,7 @@ class OrderItemAdmin(admin.ModelAdmin):
         'price'
     )
     list_filter = ('order',)
+    list_select_related = ('order__user', 'product')
     readonly_fields = ('id', 'price')
     search_fields = ('product__name',)
     autocomplete_fields = ('order', 'product')
@@ -0,0 +1,180 @@
+"""
+Кэширование ответов каталога поверх Django cache framework.
+
+Ключи включают «поколение» каталога — счётчик, который сигналы Product/Category
+увеличивают после каждого изменения (bump_catalog_generation). Старые записи
+никто не удаляет: они просто перестают совпадать по ключу и истекают по таймауту.
+Чтобы поколение видели все воркеры, в продакшене нужен общий кэш (Redis, Memcached).
+
+CachedResponseMixin кэширует готовые данные ответов list/retrieve, так что при попадании
+не выполняются ни запрос к базе, ни сериализация.
+
+Индексы в памяти процесса (search_index.py, suggest.py) по поколению не
+перестроить — оно сдвигается при любом изменении каталога, вплоть до резерва.
+Для них сигналы после коммита пишут журнал: pk изменённых товаров под очередной
+версией (record_product_changes). Индекс помнит позицию журнала, до которой он актуален,
+и дочитывает pk новых версий (product_changes_since) — так изменения из другого
+воркера доходят до всех. Позиция — (метка журнала, версия): метка случайная и
+меняется, когда счётчик версий начат заново, поэтому версия из другого кэша
+(например, из снимка, построенного процессом с собственным locmem-кэшем) не
+принимается за свою. Если журнал прервался (записи истекли или вытеснены, метка
+другая), индекс строится заново.
+"""
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+CATALOG_GENERATION_KEY = 'catalog:generation'
+CHANGES_VERSION_KEY = 'catalog:changes:version'
+CHANGES_EPOCH_KEY = 'catalog:changes:epoch'
+# отставание больше этого числа версий дешевле догнать перестройкой индекса
+MAX_REPLAYED_CHANGES = 1000
+
+
+def catalog_generation():
+    generation = cache.get(CATALOG_GENERATION_KEY)
+    if generation is None:
+        cache.add(CATALOG_GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(CATALOG_GENERATION_KEY, 1)
+    return generation
+
+
+def bump_catalog_generation():
+    try:
+        cache.incr(CATALOG_GENERATION_KEY)
+    except ValueError:
+        # ключа ещё нет (или его вытеснили) — начинаем заново, старые записи всё равно не совпадут
+        cache.add(CATALOG_GENERATION_KEY, 1, timeout=None)
+
+
+def _changes_key(version):
+    return f'catalog:changes:{version}'
+
+
+def catalog_changes_version():
+    """ Текущая позиция журнала: (метка, версия) """
+    version = cache.get(CHANGES_VERSION_KEY)
+    if version is None:
+        if cache.add(CHANGES_VERSION_KEY, 0, timeout=None):
+            # счётчик начат заново — позиции прежнего счётчика не должны с ним совпасть
+            cache.set(CHANGES_EPOCH_KEY, uuid.uuid4().hex, timeout=None)
+        version = cache.get(CHANGES_VERSION_KEY, 0)
+    epoch = cache.get(CHANGES_EPOCH_KEY)
+    if epoch is None:
+        cache.add(CHANGES_EPOCH_KEY, uuid.uuid4().hex, timeout=None)
+        epoch = cache.get(CHANGES_EPOCH_KEY)
+    return epoch, version
+
+
+def record_product_changes(pks):
+    """ Записывает в журнал pk товаров, которые изменились или удалены (вызывать после коммита) """
+    pks = list(pks)
+    if not pks:
+        return
+    try:
+        version = cache.incr(CHANGES_VERSION_KEY)
+    except ValueError:
+        # счётчика нет (кэш очищен, ключ вытеснен) — заводим его вместе с новой меткой
+        catalog_changes_version()
+        version = cache.incr(CHANGES_VERSION_KEY)
+    cache.set(_changes_key(version), pks, settings.CATALOG_CHANGES_TIMEOUT)
+
+
+def product_changes_since(position):
+    """
+    (текущая позиция, pk товаров, изменившихся после position).
+    Вместо pk — None, если журнал с position не восстановить: индекс нужно строить заново
+    """
+    current = catalog_changes_version()
+    if current == position:
+        return current, set()
+    if position is None or position[0] != current[0]:
+        # позиция из другого кэша или журнал начат заново
+        return current, None
+    version, latest = position[1], current[1]
+    if latest < version or latest - version > MAX_REPLAYED_CHANGES:
+        return current, None
+    entries = cache.get_many([_changes_key(number) for number in range(version + 1, latest + 1)])
+    if len(entries) != latest - version:
+        return current, None
+    return current, set().union(*entries.values())
+
+
+def catalog_cache_key(prefix, params):
+    """ Ключ из поколения и нормализованных параметров запроса """
+    normalized = '&'.join(f'{key}={value}' for key, value in sorted(params.items()) if value)
+    digest = hashlib.md5(normalized.encode(), usedforsecurity=False).hexdigest()
+    return f'catalog:{prefix}:{catalog_generation()}:{digest}'
+
+
+class CachedResponseMixin:
+    """
+    Кэширует ответы list/retrieve публичных эндпоинтов каталога.
+
+    - ключ: путь, хост, формат ответа и отсортированные параметры запроса (включая cursor);
+    - запись свежая, пока совпадает поколение каталога и не истёк CATALOG_CACHE_TIMEOUT;
+    - устаревшую запись ещё CATALOG_CACHE_STALE_TIMEOUT секунд отдают другим запросам,
+      пока один из них пересобирает ответ (stale-while-revalidate);
+    - пересборку выполняет только запрос, захвативший блокировку cache.add (single-flight);
+      остальные без устаревшей записи ждут его результат до CATALOG_CACHE_LOCK_TIMEOUT.
+    """
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def response_cache_key(self, request):
+        params = {key: ','.join(request.query_params.getlist(key)) for key in request.query_params}
+        params.update(path=request.path, host=request.get_host(), format=request.accepted_renderer.format)
+        normalized = '&'.join(f'{key}={value}' for key, value in sorted(params.items()))
+        return 'catalog:response:' + hashlib.md5(normalized.encode(), usedforsecurity=False).hexdigest()
+
+    def cached_response(self, build, request, *args, **kwargs):
+        timeout = settings.CATALOG_CACHE_TIMEOUT
+        stale_timeout = settings.CATALOG_CACHE_STALE_TIMEOUT
+        lock_timeout = settings.CATALOG_CACHE_LOCK_TIMEOUT
+
+        key = self.response_cache_key(request)
+        generation = catalog_generation()
+        entry = cache.get(key)
+        if entry is not None and entry['generation'] == generation and time.time() - entry['created'] < timeout:
+            return self.response_from_entry(entry, 'HIT')
+
+        stale = entry if entry is not None and time.time() - entry['created'] < timeout + stale_timeout else None
+        lock_key = f'{key}:lock'
+        locked = cache.add(lock_key, 1, lock_timeout)
+        if not locked:
+            if stale is not None:
+                return self.response_from_entry(stale, 'STALE')
+            # ответ уже собирает другой запрос — ждём его, а не нагружаем базу
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                entry = cache.get(key)
+                if entry is not None and entry['generation'] == generation:
+                    return self.response_from_entry(entry, 'HIT')
+
+        try:
+            response = build(request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, {
+                    'generation': generation,
+                    'created': time.time(),
+                    'data': response.data,
+                }, timeout + stale_timeout)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    @staticmethod
+    def response_from_entry(entry, status):
+        response = Response(entry['data'])
+        response['X-Cache'] = status
+        return response
@@ -0,0 +1,243 @@
+"""
+Потоковый импорт и экспорт каталога в CSV / JSONL (команды import_catalog, export_catalog).
+
+Импорт читает файл пачками по batch_size строк: категории и slug разрешаются в памяти
+(все slug товаров загружаются одним запросом в SlugAllocator), каждая пачка пишется
+одним bulk_create с ON CONFLICT (slug) в своей транзакции. Память ограничена пачкой
+и множеством slug. Slug, выданные SlugAllocator, проверены только по снимку на старте,
+поэтому перед записью пачки они сверяются с базой, а вставляются с ON CONFLICT DO NOTHING:
+товар, созданный за время импорта кем-то другим, импорт не перезапишет. Product.save() и сигналы не вызываются, поэтому search_vector
+пересчитывается одним UPDATE на пачку, а кэш каталога сбрасывается в конце — в том числе после ошибки, ведь
+записанные к тому моменту пачки уже закоммичены.
+Встроенные индексы поиска и подсказок в работающих воркерах импорт не обновляет —
+после импорта пересоберите снимок командой build_search_index.
+
+Экспорт идёт через iterator(): на PostgreSQL это серверный курсор, в памяти только
+chunk_size строк.
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .cache import bump_catalog_generation
+from .models import Category, Product
+from .search import update_search_vectors
+from .slugs import SlugAllocator
+from .validators import validate_price, validate_quantity
+
+FORMATS = ('csv', 'jsonl')
+COLUMNS = [
+    'name', 'slug', 'description', 'price', 'quantity',
+    'category', 'category_title', 'image', 'is_published',
+]
+# что меняет повторный импорт товара с тем же slug
+UPDATE_FIELDS = ['name', 'description', 'price', 'quantity', 'category', 'image', 'is_published', 'updated_at']
+TRUE_VALUES = {'1', 'true', 'yes', 'да'}
+FALSE_VALUES = {'0', 'false', 'no', 'нет'}
+CENTS = Decimal('0.01')
+
+
+class CatalogImportError(Exception):
+    """ Ошибка в строке файла (для CSV строки считаются вместе с заголовком) """
+    def __init__(self, line, message):
+        super().__init__(f'строка {line}: {message}')
+        self.line = line
+
+
+def detect_format(path, fmt=None):
+    fmt = fmt or str(path).rsplit('.', 1)[-1].lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат '{fmt}', ожидается один из: {', '.join(FORMATS)}")
+    return fmt
+
+
+def read_rows(file, fmt):
+    """ (номер строки, dict) из открытого текстового файла """
+    if fmt == 'csv':
+        reader = csv.DictReader(file)
+        missing = {'name', 'price'} - set(reader.fieldnames or ())
+        if missing:
+            raise CatalogImportError(1, f"нет колонок: {', '.join(sorted(missing))}")
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as error:
+            raise CatalogImportError(line, f'некорректный JSON ({error})')
+        if not isinstance(row, dict):
+            raise CatalogImportError(line, 'ожидается JSON-объект')
+        yield line, row
+
+
+def _text(row, key):
+    value = row.get(key)
+    return '' if value is None else str(value).strip()
+
+
+def _parse_bool(value, line):
+    if isinstance(value, bool):
+        return value
+    value = '' if value is None else str(value).strip().lower()
+    if not value:
+        return True
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise CatalogImportError(line, f"is_published: ожидается true/false, получено '{value}'")
+
+
+class CatalogImporter:
+    """
+    on_conflict='update' — товар с уже существующим slug обновляется (UPDATE_FIELDS),
+    on_conflict='skip' — остаётся как есть. Товары без slug всегда создаются
+    с новым slug по названию.
+    """
+    def __init__(self, on_conflict='update', batch_size=2000):
+        self.on_conflict = on_conflict
+        self.batch_size = batch_size
+        self.slugs = SlugAllocator(Product.objects.values_list('slug', flat=True).iterator(chunk_size=10000))
+        categories = list(Category.objects.all())
+        self.categories_by_slug = {category.slug: category for category in categories}
+        self.categories_by_title = {category.title: category for category in categories}
+        self.category_slugs = SlugAllocator(self.categories_by_slug)
+        self.stats = {'created': 0, 'updated': 0, 'skipped': 0, 'categories': 0}
+
+    def run(self, rows):
+        rows = iter(rows)
+        try:
+            while batch := list(islice(rows, self.batch_size)):
+                self.import_batch(batch)
+        finally:
+            bump_catalog_generation()
+        return self.stats
+
+    def import_batch(self, batch):
+        with transaction.atomic():
+            products = {}
+            allocated = []
+            for line, row in batch:
+                product, existed = self.build_product(line, row)
+                if existed and self.on_conflict == 'skip':
+                    self.stats['skipped'] += 1
+                    continue
+                self.stats['updated' if existed else 'created'] += 1
+                if not _text(row, 'slug'):
+                    allocated.append(product)
+                    continue
+                # повтор slug в одной пачке — побеждает последняя строка
+                products[product.slug] = product
+
+            self.reallocate_taken(allocated)
+            Product.objects.bulk_create(allocated, ignore_conflicts=True)
+            if self.on_conflict == 'update':
+                Product.objects.bulk_create(
+                    products.values(), update_conflicts=True,
+                    unique_fields=['slug'], update_fields=UPDATE_FIELDS
+                )
+            else:
+                # товар мог появиться после загрузки slug — его тоже не трогаем
+                Product.objects.bulk_create(products.values(), ignore_conflicts=True)
+            update_search_vectors(Product.objects.filter(
+                slug__in=[*products, *(product.slug for product in allocated)]
+            ))
+
+    def reallocate_taken(self, products):
+        """ Выдаёт новые slug товарам, чей выделенный slug успели занять в базе после старта импорта """
+        while products:
+            taken = set(Product.objects.filter(
+                slug__in=[product.slug for product in products]
+            ).values_list('slug', flat=True))
+            if not taken:
+                return
+            for product in products:
+                if product.slug in taken:
+                    product.slug = self.slugs.allocate(product.name)
+
+    def build_product(self, line, row):
+        name = _text(row, 'name')
+        if not name:
+            raise CatalogImportError(line, 'пустое название')
+        try:
+            price = Decimal(_text(row, 'price')).quantize(CENTS)
+            validate_price(price)
+            quantity = int(_text(row, 'quantity') or 0)
+            validate_quantity(quantity)
+        except (InvalidOperation, ValueError):
+            raise CatalogImportError(line, 'некорректная цена или количество')
+        except ValidationError as error:
+            raise CatalogImportError(line, '; '.join(error.messages))
+
+        slug = _text(row, 'slug')
+        existed = bool(slug) and slug in self.slugs.taken
+        if slug:
+            self.slugs.claim(slug)
+        else:
+            slug = self.slugs.allocate(name)
+
+        return Product(
+            name=name,
+            slug=slug,
+            description=_text(row, 'description'),
+            price=price,
+            quantity=quantity,
+            category=self.resolve_category(line, row),
+            image=_text(row, 'image'),
+            is_published=_parse_bool(row.get('is_published'), line),
+        ), existed
+
+    def resolve_category(self, line, row):
+        slug, title = _text(row, 'category'), _text(row, 'category_title')
+        category = self.categories_by_slug.get(slug) or self.categories_by_title.get(title)
+        if category is not None:
+            return category
+        if not (slug or title):
+            raise CatalogImportError(line, 'не указана категория (category или category_title)')
+
+        slug = slug or self.category_slugs.allocate(title)
+        self.category_slugs.claim(slug)
+        category = Category.objects.create(title=title or slug, slug=slug)
+        self.categories_by_slug[category.slug] = category
+        self.categories_by_title[category.title] = category
+        self.stats['categories'] += 1
+        return category
+
+
+def export_rows(queryset=None, chunk_size=2000):
+    """ Строки каталога (dict по COLUMNS) через серверный курсор """
+    queryset = Product.objects.all() if queryset is None else queryset
+    values = queryset.order_by('pk').values_list(
+        'name', 'slug', 'description', 'price', 'quantity',
+        'category__slug', 'category__title', 'image', 'is_published',
+    )
+    for row in values.iterator(chunk_size=chunk_size):
+        row = dict(zip(COLUMNS, row))
+        row['price'] = str(row['price'])
+        row['image'] = row['image'] or ''
+        yield row
+
+
+def write_rows(file, rows, fmt):
+    """ Пишет строки в открытый текстовый файл; возвращает их число """
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, 'is_published': 'true' if row['is_published'] else 'false'})
+            count += 1
+        return count
+
+    for row in rows:
+        file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count += 1
+    return count
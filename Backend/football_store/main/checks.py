@@ -0,0 +1,27 @@
+"""
+Системные проверки настроек (manage.py check, запуск сервера).
+"""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# кэши, которые живут в памяти одного процесса
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register()
+def check_search_index_cache(app_configs, **kwargs):
+    """ Журнал изменений встроенного индекса (main/cache.py) должен быть общим для воркеров """
+    if getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'database') != 'inverted_index':
+        return []
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        'PRODUCT_SEARCH_BACKEND = "inverted_index" с кэшем в памяти процесса: '
+        'изменения каталога из других воркеров не дойдут до их индексов поиска и подсказок, '
+        'а снимок build_search_index каждый воркер будет перестраивать заново.',
+        hint='Задайте REDIS_URL (общий кэш) или используйте PRODUCT_SEARCH_BACKEND = "database".',
+        id='main.W001',
+    )]
@@ -0,0 +1,172 @@
+"""
+Быстрая сериализация списков без ModelSerializer.to_representation.
+
+compile_serializer() один раз разбирает поля сериализатора: какие колонки взять
+через values() и как превратить значение из базы в то же, что вернуло бы поле DRF.
+Дальше строка ответа собирается из dict без создания моделей и обхода полей DRF.
+Поддерживаются простые поля (числа, строки, bool, Decimal, datetime, файлы, FK по pk
+и slug); если в сериализаторе есть что-то другое, compile_serializer вернёт None
+и список отдаётся обычным путём.
+"""
+from decimal import Decimal, getcontext
+from functools import lru_cache
+
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+from rest_framework import serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .renderers import FastJSONRenderer
+
+# Поля, которые отдают значение из базы как есть (values() уже вернул int/str/bool/pk).
+# Сравниваем to_representation, а не класс: SlugField и т.п. наследуют вывод CharField
+PLAIN_REPRESENTATIONS = {
+    field_class.to_representation for field_class in (
+        serializers.IntegerField, serializers.CharField, serializers.BooleanField,
+        serializers.FloatField, serializers.PrimaryKeyRelatedField,
+    )
+}
+
+
+def _decimal_converter(field):
+    if not getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING) or field.localize:
+        return None
+    if field.normalize_output or field.decimal_places is None:
+        return None
+    quantum = Decimal('.1') ** field.decimal_places
+    max_digits, rounding = field.max_digits, field.rounding
+
+    def make(request):
+        context = getcontext().copy()
+        if max_digits is not None:
+            context.prec = max_digits
+        return lambda value: f'{value.quantize(quantum, rounding=rounding, context=context):f}'
+    return make
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != 'iso-8601' or hasattr(field, 'timezone'):
+        return None
+
+    def make(request):
+        current = field.default_timezone()
+
+        def convert(value):
+            if current is not None:
+                value = value.astimezone(current) if timezone.is_aware(value) else timezone.make_aware(value, current)
+            value = value.isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return convert
+    return make
+
+
+def _file_converter(field, model_field):
+    if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+        return lambda request: lambda name: name or None
+    storage = model_field.storage
+    base_url = getattr(storage, 'base_url', None)
+    if base_url is None or not base_url.startswith('/') or base_url.startswith('//'):
+        return None  # внешний storage сам строит url — считаем обычным путём
+
+    def make(request):
+        # request.build_absolute_uri один раз на страницу, а не на каждую строку
+        prefix = request.build_absolute_uri(base_url) if request is not None else base_url
+        return lambda name: prefix + filepath_to_uri(name).lstrip('/') if name else None
+    return make
+
+
+def _as_is(request):
+    return None  # конвертер не нужен — значение из базы уже в нужном виде
+
+
+def _as_string(request):
+    return lambda value: '' if value is None else str(value)
+
+
+class CompiledSerializer:
+    def __init__(self, columns, required=()):
+        # (имя в ответе, колонка values(), фабрика конвертера по запросу)
+        self.columns = columns
+        # required — колонки, которых может не быть в ответе, но по ним строится курсор
+        self.lookups = tuple(dict.fromkeys([*(lookup for _, lookup, _ in columns), *required]))
+
+    def values(self, queryset):
+        """ values() с колонками ответа и аннотациями (нужны для сортировки и курсора) """
+        return queryset.values(*self.lookups, *queryset.query.annotations)
+
+    def to_representation(self, rows, request=None):
+        converters = [(name, lookup, make(request)) for name, lookup, make in self.columns]
+        result = []
+        for row in rows:
+            item = {}
+            for name, lookup, convert in converters:
+                value = row[lookup]
+                item[name] = value if value is None or convert is None else convert(value)
+            result.append(item)
+        return result
+
+
+@lru_cache(maxsize=256)
+def compile_serializer(serializer_class, fieldset=None, required=()):
+    """
+    CompiledSerializer для ModelSerializer или None, если поля не поддерживаются.
+    fieldset (main.fieldsets) оставляет только выбранные поля
+    """
+    serializer = serializer_class() if fieldset is None else serializer_class(fieldset=fieldset)
+    model = serializer.Meta.model
+    columns = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if field.source == '*' or '.' in field.source:
+            return None
+        try:
+            model_field = model._meta.get_field(field.source)
+        except Exception:
+            return None  # свойство или метод модели — в values() его нет
+
+        if isinstance(field, serializers.SlugRelatedField):
+            columns.append((name, f'{field.source}__{field.slug_field}', _as_is))
+            continue
+        if isinstance(field, serializers.FileField):
+            make = _file_converter(field, model_field)
+        elif isinstance(field, serializers.DecimalField):
+            make = _decimal_converter(field)
+        elif isinstance(field, serializers.DateTimeField):
+            make = _datetime_converter(field)
+        elif isinstance(field, serializers.BigIntegerField):
+            # BigAutoField-ключи: DRF отдаёт их строкой только с COERCE_BIGINT_TO_STRING
+            coerce = getattr(field, 'coerce_to_string', api_settings.COERCE_BIGINT_TO_STRING)
+            make = _as_string if coerce else _as_is
+        elif type(field).to_representation in PLAIN_REPRESENTATIONS and getattr(field, 'pk_field', None) is None:
+            make = _as_is
+        else:
+            return None
+        if make is None:
+            return None
+        columns.append((name, field.source, make))
+    return CompiledSerializer(columns, required)
+
+
+class CompiledListMixin:
+    """
+    list через compile_serializer, когда content negotiation выбрал FastJSONRenderer
+    (Accept: application/json; fast=true). Тело ответа то же, что у обычного list.
+    Учитывает ?fields= / ?omit=, если вьюсет использует SparseFieldsetMixin.
+    """
+    def list(self, request, *args, **kwargs):
+        compiled = None
+        if isinstance(request.accepted_renderer, FastJSONRenderer):
+            fieldset = getattr(self, 'fieldset', None)
+            required = self.fieldset_required_columns() if fieldset is not None else ()
+            compiled = compile_serializer(self.get_serializer_class(), fieldset, required)
+        if compiled is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = compiled.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(compiled.to_representation(page, request))
+        return Response(compiled.to_representation(queryset, request))
@@ -0,0 +1,102 @@
+"""
+Условные GET-запросы (ETag / Last-Modified / 304 Not Modified) для list/retrieve.
+
+Валидаторы считаются одним агрегирующим запросом — число строк и max(updated_at)
+по тем же фильтрам, что и сам ответ. Если клиент прислал совпадающий
+If-None-Match / If-Modified-Since, отвечаем 304 до выборки и сериализации.
+Число строк нужно, чтобы заметить удаление: max(updated_at) от него не меняется.
+
+Публичному каталогу (conditional_generation) агрегат не нужен: любое его изменение
+сдвигает поколение каталога (main/cache.py), так что ETag — хэш поколения и
+запроса, без обращения к базе. Иначе попадание в кэш ответов не было бы
+бесплатным: агрегат по всему отфильтрованному каталогу выполнялся бы каждый раз.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.core.exceptions import ValidationError
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from .cache import catalog_generation
+
+
+class ConditionalGetMixin:
+    """
+    conditional_fields — поля, изменение которых меняет ответ (можно через FK: 'category__updated_at');
+    conditional_private — ответ зависит от пользователя: ETag включает его id, кэш только в браузере;
+    conditional_generation — ETag из поколения каталога, без запроса к базе (и без Last-Modified).
+    Ставится перед CachedResponseMixin, чтобы 304 отдавался, не заглядывая в кэш ответов.
+    """
+    conditional_fields = ('updated_at',)
+    conditional_private = False
+    conditional_generation = False
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_conditional_queryset(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return queryset
+
+    def get_validators(self, request):
+        """ (etag, last_modified) или None, если проверять нечего """
+        if self.conditional_generation:
+            return self.get_generation_validators(request)
+        stamps = {f'stamp_{number}': Max(field) for number, field in enumerate(self.conditional_fields)}
+        try:
+            row = self.get_conditional_queryset().order_by().aggregate(count=Count('pk'), **stamps)
+        except (TypeError, ValueError, ValidationError):
+            return None  # кривой lookup — пусть обычный путь ответит 404
+        if self.action == 'retrieve' and not row['count']:
+            return None
+
+        modified = [row[key] for key in stamps if row[key] is not None]
+        last_modified = int(max(modified).timestamp()) if modified else None
+        parts = [
+            request.get_full_path(),
+            request.accepted_renderer.format,
+            str(row['count']),
+            *(row[key].isoformat() if row[key] else '' for key in stamps),
+        ]
+        if self.conditional_private:
+            parts.append(str(request.user.pk))
+        digest = hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest()
+        return f'"{digest}"', last_modified
+
+    def get_generation_validators(self, request):
+        # If-None-Match: * совпал бы и с несуществующим объектом — пусть обычный путь ответит 404
+        if request.headers.get('If-None-Match', '').strip() == '*':
+            return None
+        parts = [str(catalog_generation()), request.get_full_path(), request.accepted_renderer.format]
+        digest = hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest()
+        return f'"{digest}"', None
+
+    def conditional_response(self, build, request, *args, **kwargs):
+        validators = self.get_validators(request)
+        if validators is None:
+            return build(request, *args, **kwargs)
+
+        etag, last_modified = validators
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = build(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # no-cache: хранить можно, но перед использованием — перепроверить (дешёвый 304)
+        if self.conditional_private:
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ['Authorization'])
+        else:
+            patch_cache_control(response, public=True, no_cache=True)
+        return response
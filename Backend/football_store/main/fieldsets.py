@@ -0,0 +1,206 @@
+"""
+Разреженные наборы полей: ?fields=... и ?omit=... в list/retrieve.
+
+    /api/v1/product/?fields=name,slug,price,image
+    /api/v1/order/?omit=items
+    /api/cart/cart/?fields=total_price,items.quantity,items.product_detail.name
+
+Вложенные сериализаторы указываются через точку. parse_fieldset() проверяет строку
+по полям сериализатора и заранее считает, какие колонки модели ответу не нужны;
+результат кэшируется на (класс сериализатора, fields, omit). SparseFieldsetMixin
+откладывает эти колонки через defer() (например, description товара), так что
+меньше читается из базы и меньше уходит клиенту. Запись (POST/PATCH/...) всегда
+работает со всеми полями.
+"""
+from functools import lru_cache
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+
+class Fieldset:
+    """
+    Набор полей одного уровня сериализатора.
+
+    keep — имена, которые остаются в ответе (None — все), omit — имена, которые убираются,
+    nested — наборы для вложенных сериализаторов, deferred — колонки модели (с учётом
+    вложенных по прямому FK: 'product__description'), которые можно не читать из базы.
+    Объекты общие для всех запросов (кэш parse_fieldset) — не изменяйте их.
+    """
+    def __init__(self, keep=None, omit=frozenset(), nested=None):
+        self.keep = keep
+        self.omit = omit
+        self.nested = nested or {}
+        self.deferred = ()
+
+    def includes(self, name):
+        return (self.keep is None or name in self.keep) and name not in self.omit
+
+    def apply(self, fields):
+        """ Убирает лишние поля из результата get_fields() и передаёт наборы вложенным """
+        for name in [name for name in fields if not self.includes(name)]:
+            del fields[name]
+        for name, fieldset in self.nested.items():
+            if name in fields:
+                _serializer_of(fields[name]).fieldset = fieldset
+        return fields
+
+
+class SparseFieldsetSerializerMixin:
+    """ Сериализатор, который принимает fieldset=Fieldset и отдаёт только выбранные поля """
+    def __init__(self, *args, fieldset=None, **kwargs):
+        # many=True передаёт fieldset дочернему сериализатору (ListSerializer.many_init)
+        self.fieldset = fieldset
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.fieldset is None:
+            return fields
+        return self.fieldset.apply(fields)
+
+
+def _serializer_of(field):
+    return getattr(field, 'child', field)
+
+
+def _split(value, param):
+    paths = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        path = item.split('.')
+        if not all(path):
+            raise serializers.ValidationError({param: f'Некорректное имя поля: {item}'})
+        paths.append(path)
+    return paths
+
+
+@lru_cache(maxsize=256)
+def parse_fieldset(serializer_class, fields='', omit=''):
+    """ Fieldset по значениям ?fields= и ?omit=; неизвестное поле — ValidationError (400) """
+    return _build(serializer_class(), _split(fields, FIELDS_PARAM), _split(omit, OMIT_PARAM))
+
+
+def _build(serializer, keep_paths, omit_paths, prefix=''):
+    readable = {name: field for name, field in serializer.fields.items() if not field.write_only}
+    nested_paths = {}
+    for param, paths in ((FIELDS_PARAM, keep_paths), (OMIT_PARAM, omit_paths)):
+        for name, *rest in paths:
+            if name not in readable:
+                raise serializers.ValidationError({param: f'Неизвестное поле: {prefix}{name}'})
+            if not rest:
+                continue
+            if not isinstance(_serializer_of(readable[name]), SparseFieldsetSerializerMixin):
+                raise serializers.ValidationError({param: f'У поля {prefix}{name} нет вложенных полей'})
+            nested_paths.setdefault(name, ([], []))[param == OMIT_PARAM].append(rest)
+
+    whole = {path[0] for path in keep_paths if len(path) == 1}
+    fieldset = Fieldset(
+        keep=frozenset(path[0] for path in keep_paths) or None,
+        omit=frozenset(path[0] for path in omit_paths if len(path) == 1),
+    )
+    for name, (keep_rest, omit_rest) in nested_paths.items():
+        if not fieldset.includes(name):
+            continue
+        if name in whole:
+            keep_rest = []  # поле целиком перекрывает выбор его вложенных полей
+        if keep_rest or omit_rest:
+            fieldset.nested[name] = _build(
+                _serializer_of(readable[name]), keep_rest, omit_rest, f'{prefix}{name}.'
+            )
+    fieldset.deferred = tuple(_deferred_columns(serializer, readable, fieldset))
+    return fieldset
+
+
+def _deferred_columns(serializer, readable, fieldset, prefix=''):
+    """
+    Колонки модели сериализатора, которые не нужны выбранным полям.
+    Если какое-то поле читает свойство или метод модели (source='*', total_price и т.п.),
+    колонки этого уровня не откладываем: неизвестно, что свойство читает.
+    """
+    model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+    if model is None:
+        return []
+
+    columns, used, deferred, opaque = set(), set(), [], False
+    for model_field in model._meta.concrete_fields:
+        if not model_field.primary_key and not model_field.is_relation:
+            columns.add(model_field.name)
+
+    for name, field in readable.items():
+        source = field.source.split('.')[0]
+        try:
+            model_field = model._meta.get_field(source)
+        except FieldDoesNotExist:
+            opaque = True
+            continue
+        if not fieldset.includes(name):
+            continue
+        used.add(source)
+        nested = _serializer_of(field)
+        # вложенный сериализатор по прямому FK читается тем же запросом (select_related)
+        if (isinstance(nested, serializers.Serializer) and nested is field
+                and (model_field.many_to_one or model_field.one_to_one) and model_field.concrete):
+            nested_readable = {
+                key: value for key, value in nested.fields.items() if not value.write_only
+            }
+            deferred += _deferred_columns(
+                nested, nested_readable, fieldset.nested.get(name) or Fieldset(), f'{prefix}{source}__'
+            )
+
+    if not opaque:
+        deferred += [prefix + column for column in sorted(columns - used)]
+    return deferred
+
+
+class SparseFieldsetMixin:
+    """
+    Примесь к вьюсету: разбирает ?fields= / ?omit= для fieldset_actions, передаёт набор
+    сериализатору и откладывает ненужные колонки в filter_queryset().
+    Колонки сортировки не откладываются — по ним курсорная пагинация строит курсор.
+    """
+    fieldset_actions = ('list', 'retrieve')
+    fieldset = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.fieldset = self.get_fieldset(request)
+
+    def get_fieldset(self, request):
+        if request.method not in SAFE_METHODS or self.action not in self.fieldset_actions:
+            return None
+        fields = request.query_params.get(FIELDS_PARAM, '')
+        omit = request.query_params.get(OMIT_PARAM, '')
+        if not fields and not omit:
+            return None
+        return parse_fieldset(self.get_serializer_class(), fields, omit)
+
+    def fieldset_required_columns(self):
+        """ Колонки, которые нужны помимо полей ответа: сортировка и курсор пагинации """
+        ordering = [*(getattr(self, 'ordering_fields', None) or ()), *(getattr(self, 'ordering', None) or ())]
+        paginator_ordering = getattr(self.pagination_class, 'ordering', None) or ()
+        if isinstance(paginator_ordering, str):
+            paginator_ordering = (paginator_ordering,)
+        # tiebreaker — последнее поле ключа курсора (main.pagination.KeysetCursorPagination)
+        tiebreaker = getattr(self.pagination_class, 'tiebreaker', None)
+        ordering = [*ordering, *paginator_ordering, *([tiebreaker] if tiebreaker else [])]
+        return tuple(dict.fromkeys(field.lstrip('-') for field in ordering))
+
+    def get_serializer(self, *args, **kwargs):
+        if self.fieldset is not None:
+            kwargs.setdefault('fieldset', self.fieldset)
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.fieldset is None:
+            return queryset
+        required = set(self.fieldset_required_columns())
+        deferred = [column for column in self.fieldset.deferred if column not in required]
+        return queryset.defer(*deferred) if deferred else queryset
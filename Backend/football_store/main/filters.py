@@ -0,0 +1,64 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField, Case, When, Value
+from django.db.models.functions import Cast
+from rest_framework import filters
+
+from .search import SEARCH_CONFIG, full_text_search_supported
+from .search_index import MAX_HITS, get_product_index, search_backend
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    На PostgreSQL ищет по Product.search_vector (GIN-индекс) и добавляет
+    аннотацию search_rank для сортировки по релевантности.
+    При PRODUCT_SEARCH_BACKEND = 'inverted_index' ищет во встроенном индексе
+    (search_index.py) и берёт из базы только найденные строки по первичному ключу.
+    На остальных СУБД работает как обычный SearchFilter (icontains по search_fields).
+    """
+    rank_annotation = 'search_rank'
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if search_terms and search_backend() == 'inverted_index':
+            return self.filter_by_index(queryset, search_terms)
+        if not search_terms or not full_text_search_supported(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+
+        query = SearchQuery(' '.join(search_terms), search_type='websearch', config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=query).annotate(**{
+            # ts_rank возвращает real; double precision нужен, чтобы позиция
+            # курсора без потерь переживала round-trip через строку
+            self.rank_annotation: Cast(SearchRank(F('search_vector'), query), FloatField())
+        })
+
+    def filter_by_index(self, queryset, search_terms):
+        hits = get_product_index().search(' '.join(search_terms), limit=None)
+        if not hits:
+            return queryset.none()
+        if len(hits) > MAX_HITS:
+            hits = self.filter_hits(queryset, hits)
+            if not hits:
+                return queryset.none()
+        return queryset.filter(pk__in=[pk for pk, _ in hits]).annotate(**{
+            self.rank_annotation: Case(
+                *[When(pk=pk, then=Value(score)) for pk, score in hits],
+                output_field=FloatField()
+            )
+        })
+
+    @staticmethod
+    def filter_hits(queryset, hits):
+        """
+        Первые MAX_HITS совпадений, прошедших фильтры queryset (категория, цена, ...).
+        Фильтры применяются до отсечения, иначе лучшие MAX_HITS совпадений могли бы
+        целиком отсеяться и выдача опустела бы. В базу совпадения уходят страницами
+        по MAX_HITS pk, а не все сразу: число параметров запроса ограничено
+        """
+        kept = []
+        for start in range(0, len(hits), MAX_HITS):
+            page = hits[start:start + MAX_HITS]
+            allowed = set(queryset.filter(pk__in=[pk for pk, _ in page]).values_list('pk', flat=True))
+            kept.extend(hit for hit in page if hit[0] in allowed)
+            if len(kept) >= MAX_HITS:
+                break
+        return kept[:MAX_HITS]
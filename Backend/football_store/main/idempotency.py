@@ -0,0 +1,127 @@
+"""
+Идемпотентные POST-запросы: заголовок Idempotency-Key.
+
+Мобильный клиент повторяет запрос после таймаута, не зная, выполнился ли первый.
+Без ключа повтор оформления заказа создаёт второй заказ, а повтор добавления
+в корзину ещё раз прибавляет количество. С ключом первый запрос сохраняет свой
+ответ (IdempotencyKey) в той же транзакции, что и заказ, а повтор с тем же
+ключом получает этот ответ с заголовком Idempotent-Replayed, не выполняя view
+и не блокируя товары.
+
+Ключ действует IDEMPOTENCY_KEY_TTL секунд в пределах пользователя. Тот же ключ
+с другим запросом (метод, путь, тело) — ошибка клиента, ответ 422. Повтор, который
+пришёл, пока первый запрос ещё выполняется, ждёт на уникальном индексе (user, key)
+и после фиксации первого получает его ответ. Запрос, закончившийся исключением
+или ответом 5xx, ключ не занимает — его можно повторить с тем же ключом.
+Просроченные ключи удаляет sweep_expired_keys (команда sweep_idempotency_keys).
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+KEY_MAX_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = 422
+    default_detail = 'Ключ Idempotency-Key уже использован для другого запроса'
+    default_code = 'idempotency_key_reused'
+
+
+def request_fingerprint(request):
+    """ sha256 метода, пути и тела запроса (ключи JSON — в каноническом порядке) """
+    data = request.data
+    if hasattr(data, 'lists'):
+        # QueryDict (form / multipart): все значения каждого поля
+        data = dict(data.lists())
+    payload = json.dumps(
+        [request.method, request.path, data], sort_keys=True, ensure_ascii=False, cls=DjangoJSONEncoder
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _replay(stored, fingerprint):
+    if stored.fingerprint != fingerprint:
+        raise IdempotencyKeyReused()
+    return Response(stored.response, status=stored.status_code, headers={REPLAYED_HEADER: 'true'})
+
+
+def _claim(user, key, fingerprint):
+    """
+    Занимает ключ внутри текущей транзакции. Возвращает (занятый ключ, None)
+    или (None, сохранённый ключ), если запрос с этим ключом уже выполнен
+    """
+    now = timezone.now()
+    while True:
+        stored = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if stored is not None and stored.expires_at > now:
+            return None, stored
+        if stored is not None:
+            stored.delete()
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    user=user, key=key, fingerprint=fingerprint,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+                ), None
+        except IntegrityError:
+            # тот же ключ занял параллельный запрос: INSERT дождался его фиксации,
+            # следующая итерация прочитает сохранённый ответ
+            continue
+
+
+def idempotent(view):
+    """
+    Декоратор метода ViewSet: запрос с заголовком Idempotency-Key выполняется один раз.
+    Ставится под @action и над @retry_transaction — повтор не доходит до блокировок
+    """
+    @wraps(view)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None or not request.user.is_authenticated:
+            return view(self, request, *args, **kwargs)
+        if not key or len(key) > KEY_MAX_LENGTH:
+            raise ValidationError({HEADER: f'Ключ должен быть непустой строкой до {KEY_MAX_LENGTH} символов'})
+
+        fingerprint = request_fingerprint(request)
+        with transaction.atomic():
+            claimed, stored = _claim(request.user, key, fingerprint)
+            if stored is not None:
+                return _replay(stored, fingerprint)
+            response = view(self, request, *args, **kwargs)
+            if response.status_code >= 500:
+                claimed.delete()
+            else:
+                IdempotencyKey.objects.filter(pk=claimed.pk).update(
+                    status_code=response.status_code, response=response.data
+                )
+        return response
+    return wrapper
+
+
+def sweep_expired_keys(batch_size=1000, now=None):
+    """ Удаляет просроченные ключи пачками по batch_size, каждая — своя транзакция; возвращает число """
+    now = now or timezone.now()
+    swept = 0
+    while True:
+        with transaction.atomic():
+            pks = list(
+                IdempotencyKey.objects.filter(expires_at__lte=now)
+                .order_by('expires_at').values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                return swept
+            IdempotencyKey.objects.filter(pk__in=pks).delete()
+        swept += len(pks)
@@ -0,0 +1,151 @@
+"""
+Шардированные остатки для товаров, которые покупают одновременно сотни людей.
+
+Обычно остаток — Product.quantity, и каждое оформление заказа блокирует строку
+товара (SELECT ... FOR UPDATE). У популярного товара все покупки выстраиваются
+в очередь на эту одну строку. Для такого товара остаток можно разделить на
+K строк StockShard (enable_sharding): take_stock() списывает из случайного
+незаблокированного шарда, где хватает остатка (FOR UPDATE SKIP LOCKED), так что
+одновременные покупки почти не ждут друг друга.
+
+Перепродажи нет: списание идёт только из заблокированной строки, в которой
+quantity >= нужного (PostgreSQL перепроверяет условие на заблокированной версии
+строки), а CHECK quantity >= 0 у PositiveIntegerField — последняя страховка.
+Если ни в одном свободном шарде не хватает остатка, take_stock блокирует все
+шарды товара по порядку и списывает из нескольких.
+
+Product.quantity у шардированного товара — копия суммы шардов для витрины
+(каталог, фильтр «в наличии»). Её и равномерное распределение остатка по шардам
+обновляет rebalance_shards (команда rebalance_stock, запускается по расписанию).
+Менять остаток такого товара нужно через set_stock(), а не правкой quantity.
+"""
+import random
+
+from django.db import transaction
+from django.db.models import Case, F, Sum, When, PositiveIntegerField
+from django.utils import timezone
+
+from .cache import bump_catalog_generation
+from .models import Product, StockShard
+
+DEFAULT_SHARDS = 8
+
+
+def _split(total, shards):
+    """ total поровну на shards частей (первые части на единицу больше) """
+    base, extra = divmod(total, shards)
+    return [base + (index < extra) for index in range(shards)]
+
+
+def _lock_shards(product_id):
+    return list(StockShard.objects.select_for_update().filter(product_id=product_id).order_by('index'))
+
+
+def _write_shards(shards, quantities):
+    StockShard.objects.filter(pk__in=[shard.pk for shard in shards]).update(quantity=Case(
+        *[When(pk=shard.pk, then=quantity) for shard, quantity in zip(shards, quantities)],
+        output_field=PositiveIntegerField()
+    ))
+
+
+def _publish_total(product_id, total):
+    # витринная копия остатка; updated_at — чтобы сменились ETag и кэш каталога
+    Product.objects.filter(pk=product_id).update(quantity=total, updated_at=timezone.now())
+    transaction.on_commit(bump_catalog_generation)
+
+
+@transaction.atomic
+def enable_sharding(product, shards=DEFAULT_SHARDS):
+    """ Делит текущий остаток товара на shards шардов """
+    if shards < 1:
+        raise ValueError('Нужен хотя бы один шард')
+    # блокировка строки товара ждёт заказы, которые списывают quantity прямо сейчас
+    product = Product.objects.select_for_update().get(pk=product.pk)
+    total = product.quantity if not product.stock_shards else sum(
+        shard.quantity for shard in _lock_shards(product.pk)
+    )
+    StockShard.objects.filter(product=product).delete()
+    StockShard.objects.bulk_create([
+        StockShard(product=product, index=index, quantity=quantity)
+        for index, quantity in enumerate(_split(total, shards))
+    ])
+    Product.objects.filter(pk=product.pk).update(stock_shards=shards, quantity=total)
+    return total
+
+
+@transaction.atomic
+def disable_sharding(product):
+    """ Возвращает остаток в Product.quantity и удаляет шарды """
+    product = Product.objects.select_for_update().get(pk=product.pk)
+    total = sum(shard.quantity for shard in _lock_shards(product.pk))
+    StockShard.objects.filter(product=product).delete()
+    Product.objects.filter(pk=product.pk).update(stock_shards=0, quantity=total, updated_at=timezone.now())
+    transaction.on_commit(bump_catalog_generation)
+    return total
+
+
+def available_stock(product):
+    """ Остаток товара без блокировок: сумма шардов или quantity """
+    if not product.stock_shards:
+        return product.quantity
+    return StockShard.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+
+
+def take_stock(product_id, quantity):
+    """
+    Списывает quantity из шардов товара внутри текущей транзакции.
+    False — в сумме не хватает (ничего не списано)
+    """
+    shard = (
+        StockShard.objects.select_for_update(skip_locked=True)
+        .filter(product_id=product_id, quantity__gte=quantity)
+        .order_by('?')
+        .first()
+    )
+    if shard is not None:
+        StockShard.objects.filter(pk=shard.pk).update(quantity=F('quantity') - quantity)
+        return True
+
+    # ни в одном свободном шарде не хватает: ждём все шарды и списываем из нескольких
+    shards = _lock_shards(product_id)
+    if sum(shard.quantity for shard in shards) < quantity:
+        return False
+    left = quantity
+    remaining = []
+    for shard in shards:
+        taken = min(shard.quantity, left)
+        left -= taken
+        remaining.append(shard.quantity - taken)
+    _write_shards(shards, remaining)
+    return True
+
+
+@transaction.atomic
+def set_stock(product, total):
+    """ Новый остаток товара (поступление, инвентаризация) — с шардами или без """
+    shards = _lock_shards(product.pk)
+    if shards:
+        _write_shards(shards, _split(total, len(shards)))
+    _publish_total(product.pk, total)
+
+
+@transaction.atomic
+def rebalance_shards(product_id):
+    """
+    Выравнивает остаток между шардами и обновляет Product.quantity.
+    Без этого шарды по одному пустеют, и списания всё чаще уходят в медленную
+    ветку take_stock, которая ждёт все шарды
+    """
+    shards = _lock_shards(product_id)
+    if not shards:
+        return None
+    total = sum(shard.quantity for shard in shards)
+    quantities = _split(total, len(shards))
+    if sorted(quantities) != sorted(shard.quantity for shard in shards):
+        # порядок шардов при равных долях не важен — перемешиваем, чтобы «лишние» единицы
+        # не доставались всегда первым шардам
+        random.shuffle(quantities)
+        _write_shards(shards, quantities)
+    if Product.objects.filter(pk=product_id).exclude(quantity=total).exists():
+        _publish_total(product_id, total)
+    return total
@@ -0,0 +1,52 @@
+"""
+Общие помощники для бенчмарков (management-команды bench_*).
+Файл начинается с подчёркивания, поэтому Django не считает его командой.
+"""
+import time
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+
+class Rollback(Exception):
+    """ Служебное исключение для отката данных бенчмарка """
+
+
+@contextmanager
+def rollback_after():
+    """
+    Всё, что создано внутри блока, откатывается после выхода,
+    чтобы бенчмарк не оставлял мусор в базе
+    """
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+def percentile(values, pct):
+    """ Перцентиль по методу ближайшего ранга (values не пустой) """
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(func, repeat, setup=None):
+    """
+    Вызывает func() repeat раз (setup(), если передан, — перед каждым вызовом, вне замера).
+    Возвращает (список длительностей в мс, число запросов к БД за один вызов)
+    """
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = len(ctx.captured_queries)
+    return timings, queries
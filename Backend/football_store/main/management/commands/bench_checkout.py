@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from cart.models import Cart, CartItem
+from main.models import Category, Product
+from main.views import OrderViewSet
+from ._bench import rollback_after, measure, percentile
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк оформления заказа из корзины (create-from-cart) для корзин разного размера"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, nargs='+', default=[1, 10, 100],
+                            help='Размеры корзины (число позиций)')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Сколько раз оформлять заказ для каждого размера')
+
+    def handle(self, *args, **options):
+        view = OrderViewSet.as_view({'post': 'create_from_cart'})
+        factory = APIRequestFactory()
+
+        self.stdout.write(f"{'lines':>6} {'queries':>8} {'p50, ms':>9} {'p99, ms':>9}")
+        for lines in options['lines']:
+            with rollback_after():
+                user = User.objects.create_user(username=f'bench-checkout-{lines}')
+                category = Category.objects.create(title=f'bench-checkout-{lines}')
+                products = Product.objects.bulk_create([
+                    Product(
+                        name=f'bench {i}',
+                        slug=f'bench-checkout-{lines}-{i}',
+                        price=Decimal('100.00'),
+                        quantity=10 ** 6,
+                        category=category,
+                    )
+                    for i in range(lines)
+                ])
+                cart = Cart.objects.create(user=user)
+
+                def fill_cart():
+                    CartItem.objects.bulk_create([
+                        CartItem(cart=cart, product=product, quantity=1, price=product.price)
+                        for product in products
+                    ])
+
+                def checkout():
+                    request = factory.post('/api/v1/order/create-from-cart/')
+                    force_authenticate(request, user=user)
+                    response = view(request)
+                    assert response.status_code == 201, response.data
+
+                timings, queries = measure(checkout, options['repeat'], setup=fill_cart)
+
+            self.stdout.write(
+                f"{lines:>6} {queries:>8} "
+                f"{percentile(timings, 50):>9.2f} {percentile(timings, 99):>9.2f}"
+            )
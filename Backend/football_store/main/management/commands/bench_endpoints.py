@@ -0,0 +1,261 @@
+import json
+import platform
+import random
+import tracemalloc
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+import cart.urls
+import main.urls
+from cart.models import Cart, CartItem
+from cart.totals import empty_cart, recalculate_cart_totals
+from main.models import Product, Order
+from ._bench import rollback_after, measure, percentile
+from .seed_store import seed_store
+
+
+class Scenario:
+    """
+    Один запрос к маршруту: route — имя из main/urls.py или cart/urls.py,
+    path может быть функцией (адрес известен только после setup)
+    """
+    def __init__(self, route, method, path, user=None, data=None, setup=None, expect=200, label=None, headers=None):
+        self.route = route
+        self.method = method
+        self.path = path
+        self.user = user
+        self.data = data
+        self.setup = setup
+        self.expect = expect
+        self.label = label or f'{method} {route}'
+        self.headers = headers or {}
+
+
+def router_routes():
+    """ Имена всех маршрутов API (кроме корня DefaultRouter) """
+    return {
+        pattern.name
+        for urls in (main.urls, cart.urls)
+        for pattern in urls.urlpatterns
+        if pattern.name != 'api-root'
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Бенчмарк всех маршрутов API через тестовый клиент на данных seed_store: "
+        "p50/p95/p99, число запросов к БД и пик выделенной памяти на запрос"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=30, help='Сколько раз выполнять каждый запрос')
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--only', default='', help='Только сценарии, в названии которых есть подстрока')
+        parser.add_argument('--cold', action='store_true', help='Очищать кэш перед каждым запросом')
+        parser.add_argument('--json', dest='json_path', help='Записать результаты в JSON-файл')
+        parser.add_argument('--baseline', help='JSON прошлого запуска — вывести разницу с ним')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)['results']
+
+        # тестовый клиент ходит на testserver, которого нет в ALLOWED_HOSTS
+        with override_settings(ALLOWED_HOSTS=['testserver', *settings.ALLOWED_HOSTS]), rollback_after():
+            seed_store(
+                random.Random(options['seed']), categories=12, products=options['products'],
+                users=50, carts=20, orders=options['orders'],
+            )
+            scenarios = self.scenarios()
+            missing = router_routes() - {scenario.route for scenario in scenarios}
+            if missing:
+                self.stderr.write(f"Маршруты без сценария: {', '.join(sorted(missing))}")
+
+            results = {}
+            self.stdout.write(
+                f"{'scenario':<40} {'queries':>8} {'p50, ms':>9} {'p95, ms':>9} {'p99, ms':>9} {'alloc, KB':>10}"
+            )
+            for scenario in scenarios:
+                if options['only'] not in scenario.label:
+                    continue
+                result = self.run_scenario(scenario, options['repeat'], options['cold'])
+                results[scenario.label] = result
+                self.stdout.write(
+                    f"{scenario.label:<40} {result['queries']:>8} {result['p50_ms']:>9.2f} "
+                    f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['alloc_kb']:>10.1f}"
+                )
+
+        if options['json_path']:
+            report = {
+                'meta': {
+                    'repeat': options['repeat'],
+                    'products': options['products'],
+                    'orders': options['orders'],
+                    'cold': options['cold'],
+                    'database': connection.vendor,
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                },
+                'results': results,
+            }
+            with open(options['json_path'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+
+        if baseline is not None:
+            self.print_diff(baseline, results)
+
+    def scenarios(self):
+        user = User.objects.create_user(username='bench-endpoints-user')
+        staff = User.objects.create_user(username='bench-endpoints-staff', is_staff=True)
+        products = list(Product.objects.filter(is_published=True, slug__startswith='seed-')[:3])
+        if len(products) < 3:
+            raise CommandError("Слишком мало товаров: увеличьте --products")
+        # товары, которые кладём в корзину, не должны закончиться за время замера
+        Product.objects.filter(pk__in=[product.pk for product in products]).update(quantity=10 ** 9)
+        product = products[0]
+        category = product.category
+        cart = Cart.objects.create(user=user)
+        order = Order.objects.create(user=user, status='completed', total_price=Decimal('0'))
+        state = {}
+
+        def fill_cart():
+            empty_cart(cart)
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=item, quantity=1, price=item.price) for item in products
+            ])
+            recalculate_cart_totals([cart.pk])
+
+        def new_item():
+            fill_cart()
+            state['item'] = cart.items.first()
+
+        def new_order():
+            state['order'] = Order.objects.create(user=user, status='new', total_price=Decimal('0'))
+
+        def item_path():
+            return f"/api/cart/item/{state['item'].pk}/"
+
+        return [
+            Scenario('category-list', 'get', '/api/v1/category/'),
+            Scenario('category-list', 'post', '/api/v1/category/', user=staff,
+                     data={'title': 'bench category'}, expect=201),
+            Scenario('category-detail', 'get', f'/api/v1/category/{category.slug}/'),
+            Scenario('category-detail', 'patch', f'/api/v1/category/{category.slug}/', user=staff,
+                     data={'title': category.title}),
+
+            Scenario('product-list', 'get', '/api/v1/product/'),
+            Scenario('product-list', 'get', '/api/v1/product/', headers={'HTTP_ACCEPT': 'application/json; fast=true'},
+                     label='get product-list fast'),
+            Scenario('product-list', 'get', '/api/v1/product/?fields=name,slug,price,image',
+                     label='get product-list ?fields='),
+            Scenario('product-list', 'get', f'/api/v1/product/?category={category.slug}&ordering=price',
+                     label='get product-list ?category&ordering'),
+            Scenario('product-list', 'get', '/api/v1/product/?search=мяч', label='get product-list ?search='),
+            Scenario('product-list', 'post', '/api/v1/product/', user=staff, expect=201, data={
+                'name': 'bench product', 'price': '100.00', 'quantity': 1, 'category': category.pk,
+            }),
+            Scenario('product-detail', 'get', f'/api/v1/product/{product.slug}/'),
+            Scenario('product-detail', 'patch', f'/api/v1/product/{product.slug}/', user=staff,
+                     data={'price': str(product.price)}),
+            Scenario('product-facets', 'get', '/api/v1/product/facets/'),
+            Scenario('product-suggest', 'get', '/api/v1/product/suggest/?q=мя'),
+
+            Scenario('order-list', 'get', '/api/v1/order/', user=user),
+            Scenario('order-list', 'get', '/api/v1/order/', user=staff, label='get order-list staff'),
+            Scenario('order-detail', 'get', f'/api/v1/order/{order.pk}/', user=user),
+            Scenario('order-create-from-cart', 'post', '/api/v1/order/create-from-cart/', user=user,
+                     setup=fill_cart, expect=201),
+            Scenario('order-cancel', 'post', lambda: f"/api/v1/order/{state['order'].pk}/cancel/", user=user,
+                     setup=new_order),
+
+            Scenario('cart-list', 'get', '/api/cart/cart/', user=user, setup=fill_cart),
+            Scenario('cart-detail', 'get', f'/api/cart/cart/{cart.pk}/', user=user),
+            Scenario('cart-summary', 'get', '/api/cart/cart/summary/', user=user),
+            Scenario('cart-clear', 'post', '/api/cart/cart/clear/', user=user, setup=fill_cart, expect=204),
+
+            Scenario('cart_item-list', 'get', '/api/cart/item/', user=user, setup=fill_cart),
+            Scenario('cart_item-list', 'post', '/api/cart/item/', user=user, expect=201,
+                     data={'product': product.slug, 'quantity': 1}),
+            Scenario('cart_item-add', 'post', '/api/cart/item/add/', user=user, expect=201,
+                     data={'product': product.slug, 'quantity': 1}),
+            Scenario('cart_item-batch', 'post', '/api/cart/item/batch/', user=user, setup=fill_cart, data={
+                'operations': [
+                    {'op': 'add', 'product': products[0].slug, 'quantity': 1},
+                    {'op': 'set', 'product': products[1].slug, 'quantity': 3},
+                    {'op': 'remove', 'product': products[2].slug},
+                ],
+            }),
+            Scenario('cart_item-detail', 'get', item_path, user=user, setup=new_item),
+            Scenario('cart_item-detail', 'patch', item_path, user=user, setup=new_item, data={'quantity': 2}),
+            Scenario('cart_item-detail', 'delete', item_path, user=user, setup=new_item, expect=204),
+        ]
+
+    def run_scenario(self, scenario, repeat, cold):
+        client = APIClient()
+        client.force_authenticate(scenario.user)
+        request = getattr(client, scenario.method)
+
+        def setup():
+            if cold:
+                cache.clear()
+            if scenario.setup is not None:
+                scenario.setup()
+
+        def call():
+            path = scenario.path() if callable(scenario.path) else scenario.path
+            response = request(path, scenario.data, format='json', **scenario.headers)
+            if response.status_code != scenario.expect:
+                raise CommandError(
+                    f"{scenario.label}: ожидался статус {scenario.expect}, получен {response.status_code}: "
+                    f"{getattr(response, 'data', response.content)!r}"
+                )
+
+        # прогрев: первый запрос заполняет кэши (каталог, индексы подсказок) и не попадает в замер
+        setup()
+        call()
+        timings, queries = measure(call, repeat, setup=setup)
+
+        # память — отдельным прогоном: tracemalloc сильно замедляет код и исказил бы время
+        setup()
+        tracemalloc.start()
+        try:
+            call()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'route': scenario.route,
+            'method': scenario.method.upper(),
+            'queries': queries,
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'alloc_kb': round(peak / 1024, 1),
+        }
+
+    def print_diff(self, baseline, results):
+        self.stdout.write('')
+        self.stdout.write(f"{'scenario':<40} {'p50, ms':>19} {'queries':>9} {'alloc, KB':>19}")
+        for label, result in results.items():
+            old = baseline.get(label)
+            if old is None:
+                self.stdout.write(f"{label:<40} {'(новый)':>19}")
+                continue
+            change = (result['p50_ms'] / old['p50_ms'] - 1) * 100 if old['p50_ms'] else 0
+            self.stdout.write(
+                f"{label:<40} {old['p50_ms']:>8.2f} → {result['p50_ms']:>8.2f} "
+                f"{result['queries'] - old['queries']:>+9} "
+                f"{old['alloc_kb']:>8.1f} → {result['alloc_kb']:>8.1f}  ({change:+.0f}%)"
+            )
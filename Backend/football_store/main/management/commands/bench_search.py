@@ -0,0 +1,82 @@
+import random
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework import filters
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from main.filters import ProductSearchFilter
+from main.models import Category, Product
+from main.search import full_text_search_supported, update_search_vectors
+from main.views import ProductViewSet
+from ._bench import rollback_after, measure, percentile
+
+WORDS = [
+    'футболка', 'бутсы', 'мяч', 'гетры', 'щитки', 'перчатки', 'шорты', 'куртка',
+    'вратарские', 'игровая', 'тренировочная', 'домашняя', 'выездная', 'детская',
+    'nike', 'adidas', 'puma', 'jersey', 'boots', 'ball', 'home', 'away', 'kit', 'pro',
+    'спартак', 'зенит', 'цска', 'динамо', 'локомотив', 'real', 'barcelona', 'milan',
+]
+QUERIES = ['бутсы', 'футболка зенит', 'adidas ball', 'вратарские перчатки', 'детская выездная форма']
+
+
+class Command(BaseCommand):
+    help = "Сравнивает задержку поиска по каталогу: SearchFilter (icontains) и полнотекстовый поиск PostgreSQL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500_000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if not full_text_search_supported():
+            raise CommandError("Полнотекстовый поиск доступен только на PostgreSQL")
+
+        rnd = random.Random(options['seed'])
+        factory = APIRequestFactory()
+        view = ProductViewSet()
+
+        with rollback_after():
+            self.seed(rnd, options['products'], options['batch_size'])
+
+            self.stdout.write(f"{'engine':>10} {'query':>26} {'p50, ms':>9} {'p99, ms':>9}")
+            for name, backend in (('icontains', filters.SearchFilter()), ('fts', ProductSearchFilter())):
+                for query in QUERIES:
+                    request = Request(factory.get('/api/v1/product/', {'search': query}))
+                    view.request = request
+
+                    def search():
+                        qs = backend.filter_queryset(request, Product.objects.filter(is_published=True), view)
+                        ordering = '-search_rank' if 'search_rank' in qs.query.annotations else '-created_at'
+                        list(qs.order_by(ordering)[:20])
+
+                    timings, _ = measure(search, options['repeat'])
+                    self.stdout.write(
+                        f"{name:>10} {query:>26} "
+                        f"{percentile(timings, 50):>9.2f} {percentile(timings, 99):>9.2f}"
+                    )
+
+    def seed(self, rnd, total, batch_size):
+        categories = Category.objects.bulk_create([
+            Category(title=f'bench {word}', slug=f'bench-search-{word}') for word in WORDS[:8]
+        ])
+        for start in range(0, total, batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    name=' '.join(rnd.sample(WORDS, 3)),
+                    slug=f'bench-search-{i}',
+                    description=' '.join(rnd.choices(WORDS, k=30)),
+                    price=Decimal(rnd.randint(100, 20000)),
+                    quantity=rnd.randint(0, 100),
+                    category=rnd.choice(categories),
+                )
+                for i in range(start, min(start + batch_size, total))
+            ])
+            self.stdout.write(f"создано товаров: {min(start + batch_size, total)}", ending='\r')
+        self.stdout.write('')
+        update_search_vectors(Product.objects.filter(slug__startswith='bench-search-'))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE product')
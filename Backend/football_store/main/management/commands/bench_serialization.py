@@ -0,0 +1,80 @@
+import random
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from main.compiled import compile_serializer
+from main.models import Category, Product
+from main.renderers import FastJSONRenderer, orjson
+from main.serializers import ProductSerializer
+from ._bench import rollback_after, measure, percentile
+from .bench_search import WORDS
+
+
+class Command(BaseCommand):
+    help = (
+        "Пропускная способность сериализации страницы товаров: ProductSerializer + JSONRenderer "
+        "против values() + compile_serializer + FastJSONRenderer (без времени запроса к БД)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 1000])
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        sizes = options['sizes']
+        # абсолютные url картинок строятся от хоста запроса
+        request = Request(APIRequestFactory().get('/api/v1/product/', HTTP_HOST='localhost'))
+        compiled = compile_serializer(ProductSerializer)
+        self.stdout.write(f"orjson: {'да' if orjson is not None else 'нет (рендер через json)'}")
+
+        with rollback_after():
+            self.seed(rnd, max(sizes))
+            queryset = Product.objects.filter(slug__startswith='bench-ser-').select_related('category')
+
+            self.stdout.write(
+                f"{'rows':>6} {'path':>10} {'p50, ms':>9} {'p99, ms':>9} {'rows/s':>10}"
+            )
+            for size in sizes:
+                instances = list(queryset[:size])
+                rows = list(compiled.values(queryset)[:size])
+
+                def drf():
+                    data = ProductSerializer(instances, many=True, context={'request': request}).data
+                    return JSONRenderer().render(data)
+
+                def fast():
+                    return FastJSONRenderer().render(compiled.to_representation(rows, request))
+
+                if drf() != fast():
+                    raise CommandError(f"Ответы различаются на странице из {size} строк")
+
+                for name, func in (('serializer', drf), ('fast', fast)):
+                    timings, _ = measure(func, options['repeat'])
+                    p50 = percentile(timings, 50)
+                    self.stdout.write(
+                        f"{size:>6} {name:>10} {p50:>9.2f} {percentile(timings, 99):>9.2f} "
+                        f"{size / p50 * 1000:>10.0f}"
+                    )
+
+    def seed(self, rnd, total):
+        categories = Category.objects.bulk_create([
+            Category(title=f'bench {word}', slug=f'bench-ser-{word}') for word in WORDS[:8]
+        ])
+        Product.objects.bulk_create([
+            Product(
+                name=' '.join(rnd.sample(WORDS, 3)),
+                slug=f'bench-ser-{i}',
+                description=' '.join(rnd.choices(WORDS, k=30)),
+                price=Decimal(rnd.randint(10000, 2000000)) / 100,
+                quantity=rnd.randint(0, 100),
+                category=rnd.choice(categories),
+                image=f'products/bench-{i}.jpg',
+            )
+            for i in range(total)
+        ])
@@ -0,0 +1,22 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from main.search_index import build_product_index
+
+
+class Command(BaseCommand):
+    help = "Строит встроенный поисковый индекс по каталогу и сохраняет снимок для mmap-загрузки воркерами"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.PRODUCT_SEARCH_INDEX_PATH,
+                            help='Куда сохранить снимок (по умолчанию PRODUCT_SEARCH_INDEX_PATH)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        index = build_product_index()
+        index.save(options['path'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Проиндексировано товаров: {len(index)} за {time.perf_counter() - started:.1f} с → {options['path']}"
+        ))
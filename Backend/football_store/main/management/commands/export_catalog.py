@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.catalog_io import detect_format, export_rows, write_rows
+from main.models import Product
+
+
+class Command(BaseCommand):
+    help = "Выгружает каталог в CSV / JSONL потоком (серверный курсор, память не растёт с числом товаров)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help="Файл .csv или .jsonl ('-' — stdout)")
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help='Сколько строк забирать из курсора за раз')
+        parser.add_argument('--published-only', action='store_true')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        try:
+            fmt = detect_format(output, options['format'] or ('csv' if output == '-' else None))
+        except ValueError as error:
+            raise CommandError(error)
+
+        queryset = Product.objects.all()
+        if options['published_only']:
+            queryset = queryset.filter(is_published=True)
+
+        if output == '-':
+            write_rows(sys.stdout, export_rows(queryset, options['batch_size']), fmt)
+            return
+        with open(output, 'w', encoding='utf-8', newline='') as file:
+            count = write_rows(file, export_rows(queryset, options['batch_size']), fmt)
+        self.stdout.write(self.style.SUCCESS(f"Выгружено товаров: {count} → {output}"))
@@ -0,0 +1,239 @@
+import random
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction, DatabaseError
+from django.db.models import Sum
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from cart.models import Cart, CartItem
+from cart.resolver import forget_cart_ids
+from cart.totals import recalculate_cart_totals
+from main.inventory import enable_sharding, rebalance_shards
+from main.models import Category, Product, OrderItem, StockShard
+from main.transactions import TRANSIENT_SQLSTATES, retry_counters, sqlstate
+from main.views import OrderViewSet
+from ._bench import percentile
+
+PREFIX = 'load-checkout-'
+
+
+class LockTimer:
+    """
+    execute_wrapper: суммирует время запросов SELECT ... FOR UPDATE текущего потока —
+    почти всё это время транзакция ждёт блокировки строк товаров
+    """
+    def __init__(self):
+        self.waits = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if 'FOR UPDATE' not in sql:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.waits.append((time.perf_counter() - started) * 1000)
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест оформления заказа: N пользователей одновременно оформляют корзины "
+        "с общими «горячими» товарами. Проверяет, что остатки не ушли в минус и не потерялись"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Число потоков (одновременных покупателей)')
+        parser.add_argument('--users', type=int, default=200, help='Сколько корзин оформить')
+        parser.add_argument('--hot', type=int, default=3, help='Товары, которые есть почти в каждой корзине')
+        parser.add_argument('--hot-stock', type=int, default=100, help='Остаток каждого горячего товара')
+        parser.add_argument('--cold', type=int, default=50, help='Товары с большим остатком')
+        parser.add_argument('--lines', type=int, default=5, help='Позиций в корзине')
+        parser.add_argument('--shards', type=int, default=0,
+                            help='Разделить остаток горячих товаров на K шардов (main/inventory.py)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Не удалять созданные данные')
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            raise CommandError("Нужна СУБД с блокировками строк (PostgreSQL): SQLite блокирует всю базу")
+        if options['hot'] + options['cold'] < options['lines']:
+            raise CommandError("--lines больше, чем товаров (--hot + --cold)")
+
+        self.cleanup()
+        try:
+            users, initial, sharded = self.prepare(random.Random(options['seed']), options)
+            retries_before = retry_counters('checkout')
+            report = self.run_load(users, options['workers'], sharded)
+            retries_after = retry_counters('checkout')
+            report['retries'] = {event: retries_after[event] - retries_before[event] for event in retries_after}
+            self.print_report(report, options['workers'])
+            self.check_stock(initial)
+        finally:
+            if not options['keep']:
+                self.cleanup()
+
+    def prepare(self, rnd, options):
+        """ Пользователи с корзинами, которые пересекаются по горячим товарам; возвращает начальные остатки """
+        category = Category.objects.create(title=f'{PREFIX}category', slug=f'{PREFIX}category')
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'{PREFIX}{number}', slug=f'{PREFIX}{number}', price=Decimal('100.00'),
+                quantity=options['hot_stock'] if number < options['hot'] else 10 ** 6,
+                category=category,
+            )
+            for number in range(options['hot'] + options['cold'])
+        ])
+        hot, cold = products[:options['hot']], products[options['hot']:]
+        if options['shards']:
+            for product in hot:
+                enable_sharding(product, options['shards'])
+
+        users = User.objects.bulk_create([
+            User(username=f'{PREFIX}{number}') for number in range(options['users'])
+        ])
+        carts = Cart.objects.bulk_create([Cart(user=user) for user in users])
+        items = []
+        for cart in carts:
+            # один-два горячих товара в каждой корзине, остальное — из длинного хвоста
+            chosen = rnd.sample(hot, min(len(hot), rnd.randint(1, 2)))
+            chosen += rnd.sample(cold, min(len(cold), options['lines'] - len(chosen)))
+            rnd.shuffle(chosen)
+            items += [
+                CartItem(cart=cart, product=product, quantity=rnd.randint(1, 3), price=product.price)
+                for product in chosen
+            ]
+        CartItem.objects.bulk_create(items)
+        recalculate_cart_totals([cart.pk for cart in carts])
+        forget_cart_ids([user.pk for user in users])
+        sharded = [product.pk for product in hot] if options['shards'] else []
+        return users, {product.pk: product.quantity for product in products}, sharded
+
+    def run_load(self, users, workers, sharded=()):
+        view = OrderViewSet.as_view({'post': 'create_from_cart'})
+        factory = APIRequestFactory()
+        queue = list(users)
+        queue_lock = threading.Lock()
+        start = threading.Barrier(workers + 1)
+        statuses = Counter()
+        errors = Counter()
+        latencies = []
+        lock_waits = []
+        result_lock = threading.Lock()
+
+        def worker():
+            timer = LockTimer()
+            local_statuses, local_errors, local_latencies = Counter(), Counter(), []
+            try:
+                with connection.execute_wrapper(timer):
+                    start.wait()
+                    while True:
+                        with queue_lock:
+                            if not queue:
+                                break
+                            user = queue.pop()
+                        request = factory.post('/api/v1/order/create-from-cart/')
+                        force_authenticate(request, user=user)
+                        started = time.perf_counter()
+                        try:
+                            # as_view() мимо обработчика запросов: транзакцию ATOMIC_REQUESTS открываем сами
+                            with transaction.atomic():
+                                response = view(request)
+                            local_statuses[response.status_code] += 1
+                        except DatabaseError as error:
+                            local_errors[TRANSIENT_SQLSTATES.get(sqlstate(error), type(error).__name__)] += 1
+                        local_latencies.append((time.perf_counter() - started) * 1000)
+            finally:
+                # у каждого потока своё соединение с базой
+                connection.close()
+                with result_lock:
+                    statuses.update(local_statuses)
+                    errors.update(local_errors)
+                    latencies.extend(local_latencies)
+                    lock_waits.extend(timer.waits)
+
+        done = threading.Event()
+
+        def rebalancer():
+            # выравнивание шардов идёт одновременно с покупками, как в продакшене
+            try:
+                while not done.is_set():
+                    for product_id in sharded:
+                        rebalance_shards(product_id)
+                    done.wait(0.5)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        background = threading.Thread(target=rebalancer) if sharded else None
+        if background is not None:
+            background.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        if background is not None:
+            background.join()
+
+        return {
+            'elapsed': elapsed,
+            'statuses': statuses,
+            'errors': errors,
+            'latencies': latencies,
+            'lock_waits': lock_waits,
+        }
+
+    def print_report(self, report, workers):
+        orders = report['statuses'][201]
+        latencies, waits = report['latencies'], report['lock_waits'] or [0]
+        self.stdout.write(f"потоков:            {workers}")
+        self.stdout.write(f"заказов создано:    {orders} ({orders / report['elapsed']:.1f} в секунду)")
+        rejected = ', '.join(
+            f'{code}: {n}' for code, n in sorted(report['statuses'].items()) if code != 201
+        ) or 'нет'
+        self.stdout.write(f"отказов по статусу: {rejected}")
+        errors = ', '.join(f'{name}: {n}' for name, n in report['errors'].most_common()) or 'нет'
+        self.stdout.write(f"ошибок БД (500):    {errors}")
+        retries = ', '.join(f'{event}: {n}' for event, n in report['retries'].items())
+        self.stdout.write(f"повторы транзакций: {retries}")
+        self.stdout.write(
+            f"время ответа, ms:   p50 {percentile(latencies, 50):.1f}  p99 {percentile(latencies, 99):.1f}"
+        )
+        self.stdout.write(
+            f"ожидание FOR UPDATE, ms: p50 {percentile(waits, 50):.1f}  p99 {percentile(waits, 99):.1f}  "
+            f"всего {sum(waits):.0f}"
+        )
+
+    def check_stock(self, initial):
+        """ Инвариант: продано + осталось == было, для каждого товара """
+        sold = dict(
+            OrderItem.objects.filter(product_id__in=initial)
+            .values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+        )
+        left = dict(Product.objects.filter(pk__in=initial).values_list('pk', 'quantity'))
+        # у шардированных товаров настоящий остаток — сумма шардов
+        left.update(
+            StockShard.objects.filter(product_id__in=initial)
+            .values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+        )
+        broken = [
+            f"товар {pk}: продано {sold.get(pk, 0)} + осталось {left[pk]} != {quantity}"
+            for pk, quantity in initial.items()
+            if sold.get(pk, 0) + left[pk] != quantity
+        ]
+        if broken:
+            raise CommandError("Нарушен инвариант остатков:\n" + '\n'.join(broken))
+        self.stdout.write(self.style.SUCCESS("Инвариант остатков выполнен: продано + осталось == было"))
+
+    def cleanup(self):
+        # заказы и корзины удаляются каскадом вместе с пользователями
+        User.objects.filter(username__startswith=PREFIX).delete()
+        Category.objects.filter(slug__startswith=PREFIX).delete()
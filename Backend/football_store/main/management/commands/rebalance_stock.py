@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.inventory import rebalance_shards
+from main.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Выравнивает остатки между шардами и обновляет витринный Product.quantity "
+        "шардированных товаров. Запускайте по расписанию или с --loop"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', type=float, default=0,
+                            help='Повторять каждые N секунд (0 — один проход)')
+
+    def handle(self, *args, **options):
+        while True:
+            product_ids = list(Product.objects.filter(stock_shards__gt=0).values_list('pk', flat=True))
+            for product_id in product_ids:
+                # у каждого товара своя короткая транзакция: шарды блокируются ненадолго
+                rebalance_shards(product_id)
+            self.stdout.write(f"Выровнено товаров: {len(product_ids)}")
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
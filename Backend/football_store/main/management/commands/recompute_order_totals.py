@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from main.models import Order
+
+
+class Command(BaseCommand):
+    help = "Сверяет денормализованную Order.total_price с суммой позиций и исправляет расхождения"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только проверить: завершиться с ошибкой, если есть расхождения')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько заказов исправлять одним UPDATE')
+
+    def handle(self, *args, **options):
+        mismatched = list(
+            Order.objects.annotate(calculated=Order.calculated_total())
+            .exclude(total_price=F('calculated'))
+            .values_list('pk', flat=True)
+            .iterator()
+        )
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS("Все суммы заказов совпадают"))
+            return
+
+        if options['check']:
+            raise CommandError(
+                f"Расхождения в {len(mismatched)} заказах, например: "
+                f"{', '.join(map(str, mismatched[:10]))}"
+            )
+
+        batch_size = options['batch_size']
+        for start in range(0, len(mismatched), batch_size):
+            with transaction.atomic():
+                Order.objects.filter(pk__in=mismatched[start:start + batch_size]).update(
+                    total_price=Order.calculated_total()
+                )
+
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано заказов: {len(mismatched)}"))
@@ -0,0 +1,170 @@
+import random
+import time
+from decimal import Decimal
+from functools import partial
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from cart.models import Cart, CartItem
+from cart.resolver import forget_cart_ids
+from cart.totals import recalculate_cart_totals
+from main.cache import bump_catalog_generation, record_product_changes
+from main.models import Category, Product, Order, OrderItem
+from main.search import update_search_vectors
+from .bench_search import WORDS
+
+# Всё, что создаёт команда, помечено префиксом — так его находит --flush
+SEED_PREFIX = 'seed-'
+SEED_PASSWORD = 'seed-password'
+
+CATEGORY_TITLES = [
+    'Бутсы', 'Мячи', 'Игровая форма', 'Вратарская экипировка', 'Щитки', 'Гетры', 'Сумки и рюкзаки',
+    'Тренировочный инвентарь', 'Атрибутика болельщика', 'Куртки и костюмы', 'Обувь для зала', 'Аксессуары',
+]
+BRANDS = ['Nike', 'Adidas', 'Puma', 'Select', 'Reusch', 'Umbro', 'Joma', 'Kelme', 'Mizuno', 'Demix']
+ORDER_STATUSES = ['new', 'processing', 'shipped', 'completed', 'canceled']
+ORDER_STATUS_WEIGHTS = [10, 10, 15, 55, 10]
+
+
+def seed_store(rnd, *, categories=12, products=10_000, users=1000, carts=300, orders=5000,
+               batch_size=5000, log=None):
+    """
+    Создаёт каталог, пользователей, корзины и заказы пачками bulk_create.
+    Сигналы не срабатывают, поэтому search_vector и поколение кэша каталога обновляются в конце,
+    а pk товаров после коммита пишутся в журнал изменений — его дочитывают встроенные индексы
+    поиска и подсказок (main/search_index.py, main/suggest.py) работающих воркеров.
+    Возвращает dict с созданными пользователями (нужны бенчмаркам)
+    """
+    log = log or (lambda message: None)
+
+    titles = [CATEGORY_TITLES[number % len(CATEGORY_TITLES)] + (f' {number // len(CATEGORY_TITLES) + 1}' if number >= len(CATEGORY_TITLES) else '')
+              for number in range(categories)]
+    category_objects = Category.objects.bulk_create([
+        Category(title=title, slug=f'{SEED_PREFIX}category-{number}') for number, title in enumerate(titles)
+    ])
+    log(f"категорий: {len(category_objects)}")
+
+    prices = {}
+    for start in range(0, products, batch_size):
+        created = Product.objects.bulk_create([
+            _product(rnd, number, rnd.choice(category_objects))
+            for number in range(start, min(start + batch_size, products))
+        ])
+        prices.update((product.pk, product.price) for product in created)
+        # запись журнала на пачку, а не одна на весь каталог
+        transaction.on_commit(partial(record_product_changes, [product.pk for product in created]))
+        log(f"товаров: {len(prices)}")
+    update_search_vectors(Product.objects.filter(slug__startswith=SEED_PREFIX))
+    product_ids = list(prices)
+
+    # хэш пароля считаем один раз: make_password на каждого пользователя занял бы минуты
+    password = make_password(SEED_PASSWORD)
+    user_objects = []
+    for start in range(0, users, batch_size):
+        user_objects += User.objects.bulk_create([
+            User(username=f'{SEED_PREFIX}user-{number}', email=f'user{number}@example.com', password=password)
+            for number in range(start, min(start + batch_size, users))
+        ])
+    log(f"пользователей: {len(user_objects)}")
+
+    if user_objects and product_ids:
+        cart_objects = Cart.objects.bulk_create([Cart(user=user) for user in rnd.sample(user_objects, min(carts, users))])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_id=product_id, quantity=rnd.randint(1, 3), price=prices[product_id])
+            for cart in cart_objects
+            for product_id in rnd.sample(product_ids, min(rnd.randint(1, 8), len(product_ids)))
+        ], batch_size=batch_size)
+        # bulk_create не вызывает сигналы: итоги корзин считаем одним UPDATE,
+        # закэшированное «корзины нет» сбрасываем сами
+        recalculate_cart_totals([cart.pk for cart in cart_objects])
+        forget_cart_ids([cart.user_id for cart in cart_objects])
+        log(f"корзин: {len(cart_objects)}")
+
+        for start in range(0, orders, batch_size):
+            _seed_orders(rnd, min(batch_size, orders - start), user_objects, product_ids, prices)
+            log(f"заказов: {min(start + batch_size, orders)}")
+
+    transaction.on_commit(bump_catalog_generation)
+    return {'users': user_objects, 'categories': category_objects}
+
+
+def _product(rnd, number, category):
+    name = f"{category.title.split()[0]} {rnd.choice(BRANDS)} {' '.join(rnd.sample(WORDS, 2))}"
+    return Product(
+        name=name.capitalize(),
+        slug=f'{SEED_PREFIX}{number}',
+        description=' '.join(rnd.choices(WORDS, k=rnd.randint(20, 120))).capitalize() + '.',
+        # цены в основном в пределах нескольких тысяч, с длинным хвостом дорогих товаров
+        price=Decimal(round(rnd.lognormvariate(8, 0.8), -1) or 100),
+        quantity=0 if rnd.random() < 0.1 else rnd.randint(1, 200),
+        category=category,
+        image=f'photos/seed/{number % 500}.jpg',
+        is_published=rnd.random() > 0.05,
+    )
+
+
+def _seed_orders(rnd, count, users, product_ids, prices):
+    order_lines = []
+    orders = []
+    for _ in range(count):
+        lines = [
+            (product_id, rnd.randint(1, 3))
+            for product_id in rnd.sample(product_ids, min(rnd.randint(1, 5), len(product_ids)))
+        ]
+        order_lines.append(lines)
+        orders.append(Order(
+            user=rnd.choice(users),
+            status=rnd.choices(ORDER_STATUSES, ORDER_STATUS_WEIGHTS)[0],
+            total_price=sum(prices[product_id] * quantity for product_id, quantity in lines),
+        ))
+    Order.objects.bulk_create(orders)
+    OrderItem.objects.bulk_create([
+        OrderItem(
+            order=order, product_id=product_id, quantity=quantity,
+            price=prices[product_id], total_price=prices[product_id] * quantity,
+        )
+        for order, lines in zip(orders, order_lines)
+        for product_id, quantity in lines
+    ])
+
+
+def flush_seed():
+    """ Удаляет данные, созданные seed_store (каскадом — товары, корзины, заказы) """
+    User.objects.filter(username__startswith=SEED_PREFIX).delete()
+    Category.objects.filter(slug__startswith=SEED_PREFIX).delete()
+
+
+class Command(BaseCommand):
+    help = "Заполняет базу реалистичными тестовыми данными: категории, товары, пользователи, корзины, заказы"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--products', type=int, default=10_000)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--carts', type=int, default=300, help='Сколько пользователей получат корзину')
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--flush', action='store_true', help='Сначала удалить данные прошлого запуска')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            flush_seed()
+        elif User.objects.filter(username__startswith=SEED_PREFIX).exists():
+            raise CommandError("Данные seed_store уже есть — запустите с --flush, чтобы пересоздать их")
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            seed_store(
+                random.Random(options['seed']),
+                categories=options['categories'], products=options['products'], users=options['users'],
+                carts=options['carts'], orders=options['orders'], batch_size=options['batch_size'],
+                log=lambda message: self.stdout.write(message, ending='\r'),
+            )
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово за {time.perf_counter() - started:.1f} с. Пароль пользователей {SEED_PREFIX}user-N: {SEED_PASSWORD}"
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.inventory import DEFAULT_SHARDS, enable_sharding, disable_sharding
+from main.models import Product
+
+
+class Command(BaseCommand):
+    help = "Делит остаток популярных товаров на шарды (main/inventory.py) или возвращает его в Product.quantity"
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='+', help='slug товаров')
+        parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS, help='На сколько строк делить остаток')
+        parser.add_argument('--disable', action='store_true', help='Выключить шардирование')
+
+    def handle(self, *args, **options):
+        products = Product.objects.in_bulk(options['slugs'], field_name='slug')
+        missing = set(options['slugs']) - set(products)
+        if missing:
+            raise CommandError(f"Нет товаров: {', '.join(sorted(missing))}")
+        if options['shards'] < 1:
+            raise CommandError("--shards должно быть не меньше 1")
+
+        for slug, product in products.items():
+            if options['disable']:
+                total = disable_sharding(product)
+                self.stdout.write(f"{slug}: шардирование выключено, остаток {total}")
+            else:
+                total = enable_sharding(product, options['shards'])
+                self.stdout.write(f"{slug}: остаток {total} разделён на {options['shards']} шардов")
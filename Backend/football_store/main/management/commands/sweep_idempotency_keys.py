@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.idempotency import sweep_expired_keys
+
+
+class Command(BaseCommand):
+    help = "Удаляет просроченные ключи Idempotency-Key пачками (каждая пачка — своя транзакция)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Ключей в одной транзакции')
+        parser.add_argument('--loop', type=float, default=0, help='Повторять каждые N секунд (0 — один проход)')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            swept = sweep_expired_keys(options['batch_size'])
+            self.stdout.write(f"Удалено ключей: {swept} за {time.perf_counter() - started:.2f} с")
+            if not options['loop']:
+                return
+            time.sleep(options['loop'])
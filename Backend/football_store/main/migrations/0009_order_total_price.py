@@ -0,0 +1,39 @@
+# Generated by Django 6.0.2 on 2026-10-17 15:34
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_total_price(apps, schema_editor):
+    Order = apps.get_model('main', 'Order')
+    OrderItem = apps.get_model('main', 'OrderItem')
+    money = DecimalField(max_digits=13, decimal_places=2)
+    Order.objects.update(total_price=Coalesce(
+        Subquery(
+            OrderItem.objects.filter(order=OuterRef('pk'))
+            .values('order')
+            .annotate(total=Sum(F('price') * F('quantity')))
+            .values('total'),
+            output_field=money
+        ),
+        Value(Decimal('0.00')),
+        output_field=money
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_alter_orderitem_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=13, verbose_name='Общая цена'),
+        ),
+        migrations.RunPython(fill_total_price, migrations.RunPython.noop),
+    ]
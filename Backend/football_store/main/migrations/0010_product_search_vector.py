@@ -0,0 +1,52 @@
+# Generated by Django 6.0.2 on 2026-10-17 15:37
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+SEARCH_INDEX = django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_gin')
+
+
+def create_search_index(apps, schema_editor):
+    # GIN есть только в PostgreSQL — на других СУБД (SQLite в тестах) индекс не создаём
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.add_index(apps.get_model('main', 'Product'), SEARCH_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.remove_index(apps.get_model('main', 'Product'), SEARCH_INDEX)
+
+
+def fill_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Product = apps.get_model('main', 'Product')
+    Category = apps.get_model('main', 'Category')
+    category_title = Subquery(Category.objects.filter(pk=OuterRef('category_id')).values('title')[:1])
+    Product.objects.update(search_vector=(
+        SearchVector('name', weight='A', config='russian')
+        + SearchVector(category_title, weight='B', config='russian')
+        + SearchVector('description', weight='C', config='russian')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_order_total_price'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # Индекс не попадает в состояние моделей: иначе SQLite при пересоздании
+        # таблицы product попытается построить GIN и упадёт
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(fill_search_vector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 6.0.2 on 2026-10-17 17:14
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_product_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Сначала новые индексы, потом удаление старых — запросы не остаются без индекса
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['-created_at'], name='product_pub_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['category', '-created_at'], name='product_pub_cat_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['price'], name='product_pub_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['category', 'price'], name='product_pub_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['name'], name='product_pub_name_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='category',
+            name='category_slug_4e15ec_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_created_6dbd10_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_user_id_60f97d_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_slug_b8980b_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_name_c4c985_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_is_publ_edb21a_idx',
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='main.order', verbose_name='Заказ'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Дата создания'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='is_published',
+            field=models.BooleanField(default=True, verbose_name='Опубликовано'),
+        ),
+    ]
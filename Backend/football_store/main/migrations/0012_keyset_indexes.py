@@ -0,0 +1,73 @@
+# Generated by Django 6.0.2 on 2026-10-17 17:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_workload_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Индексы под ключ курсора (поле, id); новые создаются до удаления старых
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-created_at', '-id'], name='order_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['-created_at', '-id'], name='product_pub_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['category', '-created_at', '-id'], name='product_pub_cat_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['price', 'id'], name='product_pub_price_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['category', 'price', 'id'], name='product_pub_cat_price_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['name', 'id'], name='product_pub_name_id_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_user_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pub_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pub_cat_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pub_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pub_cat_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_pub_name_idx',
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Дата создания'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.2 on 2026-10-17 17:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='stock_shards',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Шардов остатка'),
+        ),
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField(verbose_name='Номер шарда')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='Остаток')),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='main.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Шард остатка',
+                'verbose_name_plural': 'Шарды остатков',
+                'db_table': 'stock_shard',
+                'unique_together': {('product', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 6.0.2 on 2026-10-17 17:39
+
+import django.db.models.expressions
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_stock_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В резерве'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='available',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(models.F('quantity'), '-', models.F('reserved')), output_field=models.IntegerField(verbose_name='Доступно')),
+        ),
+    ]
@@ -1,12 +1,15 @@
 from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.utils.text import slugify
 from django.urls import reverse
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
 from django.conf import settings
-from django.db.models import Sum, F, DecimalField
+from django.db.models import Sum, F, Q, DecimalField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.contrib.postgres.search import SearchVectorField
 from decimal import Decimal
 from rest_framework.exceptions import ValidationError
+from .slugs import unique_slug
 from .validators import validate_price, validate_quantity  # предполагаем, что они есть
 
 
@@ -33,15 +36,16 @@ class Category(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            base_slug = slugify(self.title, allow_unicode=True)
-            slug = base_slug
-            counter = 1
-            while Category.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            self.slug = unique_slug(Category, self.title, exclude_pk=self.pk)
         super().save(*args, **kwargs)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # нужно сигналам: при смене названия пересчитывается поиск по товарам
+        instance._saved_title = instance.__dict__.get('title')
+        return instance
+
     def get_absolute_url(self):
         return reverse('category', kwargs={'slug': self.slug})
 
@@ -53,8 +57,8 @@ class Category(models.Model):
         verbose_name_plural = "Категории"
         ordering = ["-created_at"]
         db_table = 'category'
+        # slug уже проиндексирован ограничением unique
         indexes = [
-            models.Index(fields=['slug']),
             models.Index(fields=['title']),
         ]
 
@@ -101,18 +105,40 @@ class Product(models.Model):
     )
     is_published = models.BooleanField(
         verbose_name='Опубликовано',
-        default=True,
-        db_index=True
+        default=True
+    )
+    # Сколько единиц удерживают корзины (cart.reservations) — поддерживается вместе с резервами,
+    # чтобы не суммировать их при каждом чтении товара
+    reserved = models.PositiveIntegerField(
+        verbose_name='В резерве',
+        default=0,
+        editable=False
+    )
+    # Доступно к покупке: вычисляет сама база при каждой записи строки
+    available = models.GeneratedField(
+        expression=F('quantity') - F('reserved'),
+        output_field=models.IntegerField(verbose_name='Доступно'),
+        db_persist=True
+    )
+    # 0 — остаток хранится в quantity; K > 0 — остаток разделён на K строк StockShard
+    # (main/inventory.py), а quantity — сумма шардов для витрины, её обновляет rebalance_stock
+    stock_shards = models.PositiveSmallIntegerField(
+        verbose_name='Шардов остатка',
+        default=0
     )
     created_at = models.DateTimeField(
         verbose_name='Дата создания',
-        auto_now_add=True,
-        db_index=True
+        auto_now_add=True
     )
     updated_at = models.DateTimeField(
         auto_now=True,
         verbose_name='Дата обновления'
     )
+    # Полнотекстовый индекс (только PostgreSQL), заполняется в main/search.py
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False
+    )
 
     def clean(self):
         if self.is_published and not self.image:
@@ -122,13 +148,7 @@ class Product(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.slug:
-            base_slug = slugify(self.name, allow_unicode=True)
-            slug = base_slug
-            counter = 1
-            while Product.objects.filter(slug=slug).exclude(pk=self.pk).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            self.slug = unique_slug(Product, self.name, exclude_pk=self.pk)
         super().save(*args, **kwargs)
 
     def get_absolute_url(self):
@@ -142,13 +162,87 @@ class Product(models.Model):
         verbose_name_plural = "Продукты"
         ordering = ["-created_at"]
         db_table = 'product'
+        # Каталог (ProductViewSet) читает только опубликованные товары: фильтр по категории
+        # и цене, сортировка по -created_at, price или name. Частичные индексы покрывают
+        # эти запросы и не хранят снятые с публикации товары.
+        # slug проиндексирован ограничением unique, created_at отдельно не индексируется
+        # (админка читает все товары редко); GIN-индекс по search_vector
+        # создаётся миграцией 0010 только на PostgreSQL
         indexes = [
-            models.Index(fields=['slug']),
-            models.Index(fields=['name']),
-            models.Index(fields=['is_published']),
+            # id в конце — ключ курсора KeysetCursorPagination (поле сортировки, id);
+            # обратный порядок (?ordering=-price) — тот же индекс, просмотренный с конца
+            models.Index(
+                fields=['-created_at', '-id'], name='product_pub_created_id_idx', condition=Q(is_published=True)
+            ),
+            models.Index(
+                fields=['category', '-created_at', '-id'], name='product_pub_cat_created_id_idx',
+                condition=Q(is_published=True)
+            ),
+            models.Index(fields=['price', 'id'], name='product_pub_price_id_idx', condition=Q(is_published=True)),
+            models.Index(
+                fields=['category', 'price', 'id'], name='product_pub_cat_price_id_idx',
+                condition=Q(is_published=True)
+            ),
+            models.Index(fields=['name', 'id'], name='product_pub_name_id_idx', condition=Q(is_published=True)),
         ]
 
 
+class StockShard(models.Model):
+    """
+    Часть остатка товара. Списание идёт из одного шарда, поэтому одновременные
+    покупки популярного товара блокируют разные строки, а не одну строку product
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='shards',
+        # поиск по товару покрывает unique_together (product, index)
+        db_index=False,
+        verbose_name='Товар'
+    )
+    index = models.PositiveSmallIntegerField(verbose_name='Номер шарда')
+    quantity = models.PositiveIntegerField(verbose_name='Остаток', default=0)
+
+    def __str__(self):
+        return f"{self.product_id}#{self.index}: {self.quantity}"
+
+    class Meta:
+        verbose_name = "Шард остатка"
+        verbose_name_plural = "Шарды остатков"
+        db_table = 'stock_shard'
+        unique_together = ('product', 'index')
+
+
+class IdempotencyKey(models.Model):
+    """
+    Ответ на запрос с заголовком Idempotency-Key (main/idempotency.py): повтор
+    запроса с тем же ключом получает сохранённый ответ, а не выполняется заново
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys',
+        # поиск по пользователю покрывает unique_together (user, key)
+        db_index=False,
+        verbose_name='Пользователь'
+    )
+    key = models.CharField(verbose_name='Ключ', max_length=255)
+    fingerprint = models.CharField(verbose_name='Отпечаток запроса', max_length=64)
+    status_code = models.PositiveSmallIntegerField(verbose_name='Статус ответа', null=True)
+    response = models.JSONField(verbose_name='Тело ответа', null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(verbose_name='Дата создания', auto_now_add=True)
+    expires_at = models.DateTimeField(verbose_name='Действует до', db_index=True)
+
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+        db_table = 'idempotency_key'
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return f"{self.user_id}: {self.key}"
+
+
 class Order(models.Model):
     ORDER_STATUS = (
         ('new', 'Новый'),
@@ -162,6 +256,8 @@ class Order(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         related_name='orders',
+        # поиск по пользователю покрывает индекс (user, -created_at)
+        db_index=False,
         verbose_name='Пользователь'
     )
     status = models.CharField(
@@ -172,8 +268,7 @@ class Order(models.Model):
     )
     created_at = models.DateTimeField(
         verbose_name='Дата создания',
-        auto_now_add=True,
-        db_index=True
+        auto_now_add=True
     )
 
     updated_at = models.DateTimeField(
@@ -188,15 +283,43 @@ class Order(models.Model):
         verbose_name='Товар'
     )
 
-    @property
-    def total_price(self) -> Decimal:
-        result = self.order_items.aggregate(
-            total=Sum(
-                F('price') * F('quantity'),
+    # Денормализованная сумма заказа: поддерживается позициями заказа (см. signals.py),
+    # сверяется и пересчитывается командой recompute_order_totals
+    total_price = models.DecimalField(
+        verbose_name='Общая цена',
+        max_digits=13,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False
+    )
+
+    @staticmethod
+    def calculated_total():
+        """ Выражение с суммой позиций заказа (для annotate/update) """
+        return Coalesce(
+            Subquery(
+                OrderItem.objects.filter(order=OuterRef('pk'))
+                .values('order')
+                .annotate(total=Sum(F('price') * F('quantity')))
+                .values('total'),
                 output_field=DecimalField(max_digits=13, decimal_places=2)
-            )
-        )['total']
-        return result if result is not None else Decimal('0.00')
+            ),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=13, decimal_places=2)
+        )
+
+    def save(self, *args, **kwargs):
+        # total_price меняют только позиции заказа — обычный save() его не перезаписывает,
+        # иначе устаревшее значение в памяти затрёт актуальную сумму в базе
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'total_price'
+            ]
+        elif kwargs.get('update_fields'):
+            # auto_now пишется только если updated_at в update_fields — а по нему считается ETag
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_at'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Заказ #{self.pk} — {self.user.username} ({self.get_status_display()})"
@@ -206,10 +329,12 @@ class Order(models.Model):
         verbose_name_plural = "Заказы"
         ordering = ["-created_at"]
         db_table = 'order'
+        # Заказы пользователя (OrderViewSet) — фильтр по user и сортировка -created_at;
+        # все заказы (админ) — по (-created_at, -id). id — ключ курсора пагинации
         indexes = [
             models.Index(fields=['status']),
-            models.Index(fields=['created_at']),
-            models.Index(fields=['user']),
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_id_idx'),
+            models.Index(fields=['-created_at', '-id'], name='order_created_id_idx'),
         ]
 
 
@@ -218,6 +343,8 @@ class OrderItem(models.Model):
         Order,
         on_delete=models.CASCADE,
         related_name="order_items",
+        # поиск по заказу покрывает unique_together (order, product)
+        db_index=False,
         verbose_name='Заказ'
     )
     product = models.ForeignKey(
@@ -242,12 +369,25 @@ class OrderItem(models.Model):
         verbose_name='Общая цена'
     )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_saved_state()
+        return instance
+
+    def remember_saved_state(self):
+        """ Запоминаем, в какой заказ и на какую сумму позиция записана в базе """
+        self._saved_state = (self.__dict__.get('order_id'), self.__dict__.get('total_price'))
+
     def save(self, *args, **kwargs):
         # если объект создаётся и price не указан
         if self._state.adding and (self.price is None):
             self.price = self.product.price if self.product else 0
         # считаем total_price
         self.total_price = self.price * self.quantity
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'price', 'quantity'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'total_price'}
         super().save(*args, **kwargs)
 
     def __str__(self):
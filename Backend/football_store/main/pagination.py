@@ -1,9 +1,173 @@
-from rest_framework.pagination import CursorPagination
+import json
+from datetime import date, datetime
+from decimal import Decimal
 
-class ProductPaginateCursor(CursorPagination):
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import CursorPagination, Cursor, _reverse_ordering
+
+__all__ = ['approximate_count', 'KeysetCursorPagination', 'ProductPaginateCursor']
+
+
+def approximate_count(queryset):
+    """
+    Оценка числа строк из статистики планировщика PostgreSQL (EXPLAIN, без выполнения
+    запроса). На остальных СУБД — обычный count()
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.count()
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Курсор по ключу (поле сортировки, ..., id) вместо позиции одного поля со смещением.
+
+    К любой сортировке (в том числе из OrderingFilter) добавляется tiebreaker в том же
+    направлении, что и первое поле, поэтому порядок однозначен и при одинаковых ценах
+    или названиях строки не теряются и не повторяются. Следующая страница — это
+    WHERE (price, id) > (курсор) ORDER BY price, id LIMIT n: с индексом (price, id)
+    глубокие страницы стоят столько же, сколько первая. Поля сортировки не должны быть NULL.
+
+    ?count=approx добавляет в ответ count — оценку планировщика (см. approximate_count),
+    ?count=exact — точный COUNT(*).
+    """
+    tiebreaker = 'id'
+    count_query_param = 'count'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        fields = {field.lstrip('-') for field in ordering}
+        if self.tiebreaker in fields or 'pk' in fields:
+            return ordering
+        direction = '-' if ordering[0].startswith('-') else ''
+        return (*ordering, direction + self.tiebreaker)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.count = self.get_count(queryset, request)
+
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.decode_position(self.cursor)
+
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.keyset_filter(ordering, position))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+
+        # с пустой страницы ссылки ведут туда же, откуда пришли
+        if self.page:
+            self.previous_position = self.get_position(self.page[0])
+            self.next_position = self.get_position(self.page[-1])
+        else:
+            self.previous_position = self.next_position = self.cursor.position if self.cursor else None
+
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = position is not None if not reverse else has_more
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    @staticmethod
+    def keyset_filter(ordering, position):
+        """
+        (f1, f2, ...) > (v1, v2, ...) с учётом направления каждого поля:
+        f1 >= v1 AND (f1 > v1 OR f1 = v1 AND f2 > v2 OR ...).
+        Первое условие — диапазон для индекса, остальное отсекает уже выданные строки
+        """
+        keys = [
+            (field.lstrip('-'), 'lt' if field.startswith('-') else 'gt', value)
+            for field, value in zip(ordering, position)
+        ]
+        after = Q()
+        equal = {}
+        for name, lookup, value in keys:
+            after |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        first, lookup, value = keys[0]
+        return Q(**{f'{first}__{lookup}e': value}) & after
+
+    def decode_position(self, cursor):
+        if cursor is None or cursor.position is None:
+            return None
+        try:
+            position = json.loads(cursor.position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_position(self, instance):
+        values = []
+        for field in self.ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = str(value)
+            values.append(value)
+        # ensure_ascii: DRF кодирует курсор как ASCII
+        return json.dumps(values, separators=(',', ':'))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.next_position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.previous_position))
+
+    def get_count(self, queryset, request):
+        mode = request.query_params.get(self.count_query_param)
+        if mode == 'approx':
+            return approximate_count(queryset)
+        if mode == 'exact':
+            return queryset.count()
+        return None
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data = {'count': self.count, **response.data}
+        return response
+
+
+class ProductPaginateCursor(KeysetCursorPagination):
 
     page_size = 20  # сколько объектов на страницу
     ordering = "-created_at"  # поле сортировки
     page_size_query_param = None  # можно разрешить менять размер
     max_page_size = None  # максимум объектов
-    cursor_query_param = "cursor"  # имя параметра в URL
\ No newline at end of file
+    cursor_query_param = "cursor"  # имя параметра в URL
+
+    def get_ordering(self, request, queryset, view):
+        # Полнотекстовый поиск (ProductSearchFilter) без явного ?ordering=
+        # отдаёт результаты по релевантности
+        if ('search_rank' in queryset.query.annotations
+                and not request.query_params.get(OrderingFilter.ordering_param)):
+            return ('-search_rank', '-created_at', '-id')
+        return super().get_ordering(request, queryset, view)
@@ -0,0 +1,38 @@
+"""
+Быстрый JSON-рендерер: Accept: application/json; fast=true (или ?format=fastjson).
+
+Сериализует orjson (он в requirements.txt). Без orjson быстрого пути нет: рендерер
+молча работает как обычный JSONRenderer, и fast=true ничего не ускоряет.
+Вывод совпадает с JSONRenderer байт в байт: компактные разделители, UTF-8 без
+экранирования, \\u2028/\\u2029 экранируются. Всё, чего нет в JSON (Decimal, datetime,
+ленивые строки), отдаётся кодировщику DRF, поэтому и обычные ответы рендерятся так же.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - без orjson рендерер равен JSONRenderer
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    # Параметр fast=true должен быть в Accept, поэтому обычный application/json и */*
+    # этот рендерер не выбирают, даже если он стоит в списке первым
+    media_type = 'application/json; fast=true'
+    format = 'fastjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        encoder = self.encoder_class()
+        # datetime orjson пишет по-своему — пусть его форматирует кодировщик DRF
+        ret = orjson.dumps(
+            data, default=encoder.default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        )
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
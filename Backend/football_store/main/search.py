@@ -0,0 +1,40 @@
+"""
+Полнотекстовый поиск по каталогу на PostgreSQL.
+
+Product.search_vector хранит tsvector из названия (вес A), названия категории (B)
+и описания (C). Вектор пересчитывается сигналами (см. signals.py) при сохранении
+товара и при переименовании категории; по нему построен GIN-индекс.
+На других СУБД (например, SQLite в тестах) вектор не заполняется,
+а ProductSearchFilter откатывается к обычному SearchFilter.
+"""
+from django.conf import settings
+from django.contrib.postgres.search import SearchVector
+from django.db import connections
+from django.db.models import OuterRef, Subquery
+
+from .models import Category
+
+SEARCH_CONFIG = getattr(settings, 'PRODUCT_SEARCH_CONFIG', 'russian')
+
+
+def full_text_search_supported(using='default'):
+    return connections[using].vendor == 'postgresql'
+
+
+def product_search_vector():
+    """ Выражение tsvector для Product (для update()) """
+    category_title = Subquery(
+        Category.objects.filter(pk=OuterRef('category_id')).values('title')[:1]
+    )
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(category_title, weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(queryset):
+    """ Пересчитывает search_vector одним UPDATE; возвращает число строк """
+    if not full_text_search_supported(queryset.db):
+        return 0
+    return queryset.update(search_vector=product_search_vector())
@@ -0,0 +1,502 @@
+"""
+Встроенный (in-process) поисковый индекс по каталогу — альтернатива
+полнотекстовому поиску PostgreSQL (см. search.py).
+
+Включается настройкой PRODUCT_SEARCH_BACKEND = 'inverted_index'.
+
+- документы — опубликованные товары: название, название категории, описание;
+- токены приводятся к нижнему регистру и стеммятся (русский Snowball / лёгкий английский);
+- ранжирование BM25, поля взвешены (название > категория > описание);
+- постинги лежат в array('I'), а не в списках Python-объектов;
+- снимок индекса пишется в файл и открывается через mmap без копирования,
+  поэтому воркеру не нужно перестраивать индекс при старте;
+- после загрузки снимка изменения копятся в памяти поверх него: новые
+  документы — в дельте, удалённые — в «надгробиях».
+
+Изменения доходят до индекса через журнал изменений товаров (main/cache.py):
+сигналы Product/Category пишут в него pk, а get_product_index перед каждым
+поиском дочитывает новые записи и переиндексирует эти товары из базы. Так
+индекс видит правки, сделанные в любом воркере (журнал должен лежать в общем
+кэше — см. checks.py). Снимок хранит позицию журнала, на которой он построен:
+после перезагрузки снимка (сменился файл) изменения с этой позиции применяются
+заново и не теряются.
+
+Снимок пишет только команда build_search_index. Воркер, которому журнал не
+догнать (записи истекли, снимок построен с другим кэшем), перестраивает индекс
+в фоновом потоке и до конца перестройки отдаёт прежний; в запросе индекс
+строится, только если снимка нет вовсе.
+
+В индекс попадают только опубликованные товары (product_documents).
+"""
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from array import array
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+
+from .cache import catalog_changes_version, product_changes_since
+
+MAX_HITS = getattr(settings, 'PRODUCT_SEARCH_MAX_HITS', 500)
+# сколько товаров перечитывается из базы одним запросом при доигрывании журнала
+REINDEX_CHUNK_SIZE = 2000
+
+FIELD_WEIGHTS = {'name': 3, 'category': 2, 'description': 1}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# ─── Токенизация и стемминг ─────────────────────────────────────
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'[а-я]')
+
+STOP_WORDS = frozenset(
+    'и в во на с со по для из к ко о об от до за под над не ни а но или же ли бы '
+    'the a an and or of for to in on with by at from is are'.split()
+)
+
+_RU_VOWELS = 'аеиоуыэюя'
+_RU_RV = re.compile(rf'^(.*?[{_RU_VOWELS}])(.*)$')
+_RU_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_RU_REFLEXIVE = re.compile(r'(с[яь])$')
+_RU_ADJECTIVE = re.compile(
+    r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$'
+)
+_RU_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_RU_VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+_RU_NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_RU_DERIVATIONAL = re.compile(rf'.*[^{_RU_VOWELS}]+[{_RU_VOWELS}].*ость?$')
+
+
+def stem_ru(word):
+    """ Русский стеммер Портера (Snowball) """
+    match = _RU_RV.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+
+    stripped = _RU_PERFECTIVE_GERUND.sub('', rv, 1)
+    if stripped != rv:
+        rv = stripped
+    else:
+        rv = _RU_REFLEXIVE.sub('', rv, 1)
+        stripped = _RU_ADJECTIVE.sub('', rv, 1)
+        if stripped != rv:
+            rv = _RU_PARTICIPLE.sub('', stripped, 1)
+        else:
+            stripped = _RU_VERB.sub('', rv, 1)
+            rv = _RU_NOUN.sub('', rv, 1) if stripped == rv else stripped
+
+    rv = re.sub('и$', '', rv, 1)
+    if _RU_DERIVATIONAL.match(rv):
+        rv = re.sub('ость?$', '', rv, 1)
+    stripped = re.sub('ь$', '', rv, 1)
+    if stripped != rv:
+        rv = stripped
+    else:
+        rv = re.sub('ейше?$', '', rv, 1)
+        rv = re.sub('нн$', 'н', rv, 1)
+    return prefix + rv
+
+
+def stem_en(word):
+    """ Лёгкий английский стеммер: множественное число, -ing, -ed """
+    if len(word) <= 3:
+        return word
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith('sses'):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        word = word[:-1]
+    for suffix in ('ing', 'ed'):
+        stem = word[:-len(suffix)]
+        if word.endswith(suffix) and len(stem) >= 3 and re.search('[aeiouy]', stem):
+            return stem
+    return word
+
+
+@lru_cache(maxsize=100_000)
+def stem(word):
+    # словарь каталога невелик — кэш снимает почти всю стоимость регулярных выражений
+    return stem_ru(word) if CYRILLIC_RE.search(word) else stem_en(word)
+
+
+def tokenize(text):
+    """ Текст → список стемов (стоп-слова и одиночные символы отбрасываются) """
+    return [
+        stem(word)
+        for word in TOKEN_RE.findall((text or '').lower().replace('ё', 'е'))
+        if len(word) > 1 and word not in STOP_WORDS
+    ]
+
+
+# ─── Индекс ──────────────────────────────────────────────────────
+
+MAGIC = b'FSIDX003'
+# magic, метка и версия журнала изменений, документов, термов, суммарная длина, смещение словаря
+HEADER = struct.Struct('=8s16sQQQQQ')
+TERM_ENTRY = struct.Struct('=HQI')     # длина терма в байтах, смещение постинга, df
+
+
+def _align(offset, size=8):
+    return (offset + size - 1) // size * size
+
+
+class InvertedIndex:
+    """
+    Инвертированный индекс: терм → (возрастающие id документов, веса tf).
+
+    Внутренние id документов выдаются по возрастанию и не переиспользуются,
+    поэтому добавление в конец постинга сохраняет его отсортированным.
+    Удалённые документы помечаются в _deleted и вычищаются при compact().
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # базовый сегмент (из снимка через mmap) — только чтение
+        self._mmap = None
+        self._view = None
+        self._base_terms = {}          # терм → (смещение в _base_postings, df)
+        self._base_postings = None     # memoryview('I')
+        # дельта — изменения после загрузки снимка
+        self._postings = {}            # терм → (array('I') id документов, array('I') tf)
+        self._doc_pk = array('q')      # id документа → pk товара (базовые + дельта)
+        self._doc_len = array('I')
+        self._pk_to_doc = {}
+        self._deleted = set()
+        self._total_len = 0
+        self.mtime = None
+        # позиция журнала изменений (main/cache.py), до которой индекс актуален; None — неизвестна
+        self.version = None
+
+    # ── изменение ──
+
+    def __len__(self):
+        return len(self._pk_to_doc)
+
+    def add(self, pk, name='', category='', description=''):
+        """ Добавляет (или заменяет) документ товара """
+        fields = {'name': name, 'category': category, 'description': description}
+        frequencies = {}
+        length = 0
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(text):
+                frequencies[token] = frequencies.get(token, 0) + weight
+                length += weight
+
+        with self._lock:
+            self.remove(pk)
+            doc = len(self._doc_pk)
+            self._doc_pk.append(pk)
+            self._doc_len.append(length)
+            self._pk_to_doc[pk] = doc
+            self._total_len += length
+            for token, tf in frequencies.items():
+                docs, tfs = self._postings.setdefault(token, (array('I'), array('I')))
+                docs.append(doc)
+                tfs.append(tf)
+
+    def remove(self, pk):
+        with self._lock:
+            doc = self._pk_to_doc.pop(pk, None)
+            if doc is None:
+                return
+            self._deleted.add(doc)
+            self._total_len -= self._doc_len[doc]
+            if len(self._deleted) > max(1000, len(self._doc_pk) // 4):
+                self.compact()
+
+    def compact(self):
+        """ Переписывает все постинги в память без удалённых документов """
+        with self._lock:
+            remap = array('I', [0]) * len(self._doc_pk)
+            doc_pk, doc_len = array('q'), array('I')
+            for doc, pk in enumerate(self._doc_pk):
+                if doc not in self._deleted:
+                    remap[doc] = len(doc_pk)
+                    doc_pk.append(pk)
+                    doc_len.append(self._doc_len[doc])
+
+            postings = {}
+            for term in self._terms():
+                new_docs, new_tfs = array('I'), array('I')
+                for docs, tfs in self._term_postings(term):
+                    for doc, tf in zip(docs, tfs):
+                        if doc not in self._deleted:
+                            new_docs.append(remap[doc])
+                            new_tfs.append(tf)
+                if new_docs:
+                    postings[term] = (new_docs, new_tfs)
+
+            self._release_mmap()
+            self._postings = postings
+            self._doc_pk, self._doc_len = doc_pk, doc_len
+            self._pk_to_doc = {pk: doc for doc, pk in enumerate(doc_pk)}
+            self._deleted = set()
+
+    # ── поиск ──
+
+    def _terms(self):
+        return self._base_terms.keys() | self._postings.keys()
+
+    def _term_postings(self, term):
+        """ Куски постинга терма: сначала из снимка, затем из дельты """
+        pieces = []
+        base = self._base_terms.get(term)
+        if base is not None:
+            offset, df = base
+            pieces.append((self._base_postings[offset:offset + df],
+                           self._base_postings[offset + df:offset + 2 * df]))
+        if term in self._postings:
+            pieces.append(self._postings[term])
+        return pieces
+
+    def search(self, query, limit=MAX_HITS):
+        """
+        Возвращает [(pk, score)] по убыванию BM25 (limit=None — все совпадения).
+        Документ должен содержать все термы запроса.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        with self._lock:
+            live_docs = len(self._pk_to_doc)
+            if not live_docs:
+                return []
+            avg_len = self._total_len / live_docs or 1
+            postings = [(term, self._term_postings(term)) for term in terms]
+            # начинаем с самого редкого терма — кандидатов меньше всего
+            postings.sort(key=lambda item: sum(len(docs) for docs, _ in item[1]))
+
+            scores = None
+            for term, pieces in postings:
+                df = sum(len(docs) for docs, _ in pieces)
+                if not df:
+                    return []
+                idf = math.log(1 + (live_docs - df + 0.5) / (df + 0.5))
+                term_scores = {}
+                for docs, tfs in pieces:
+                    for doc, tf in zip(docs, tfs):
+                        if doc in self._deleted or (scores is not None and doc not in scores):
+                            continue
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_len[doc] / avg_len)
+                        term_scores[doc] = idf * tf * (BM25_K1 + 1) / (tf + norm)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {doc: scores[doc] + score for doc, score in term_scores.items()}
+                if not scores:
+                    return []
+
+            best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+            return [(self._doc_pk[doc], score) for doc, score in best]
+
+    # ── снимок на диске ──
+
+    def _header(self, n_docs, n_terms, terms_offset):
+        epoch, version = self.version or (None, 0)
+        epoch = bytes.fromhex(epoch) if epoch else bytes(16)
+        return HEADER.pack(MAGIC, epoch, version, n_docs, n_terms, self._total_len, terms_offset)
+
+    def save(self, path):
+        """ Записывает компактный снимок индекса (атомарно, через временный файл) """
+        with self._lock:
+            if self._deleted:
+                self.compact()
+            terms = sorted(self._terms())
+            n_docs = len(self._doc_pk)
+            # у каждого писателя свой временный файл: os.replace публикует только целый снимок
+            directory, name = os.path.split(os.path.abspath(path))
+            f = tempfile.NamedTemporaryFile(dir=directory, prefix=f'{name}.', suffix='.tmp', delete=False)
+            try:
+                with f:
+                    self._write_snapshot(f, terms, n_docs)
+                os.chmod(f.name, 0o644)
+                os.replace(f.name, path)
+            except BaseException:
+                os.unlink(f.name)
+                raise
+
+    def _write_snapshot(self, f, terms, n_docs):
+        f.write(self._header(n_docs, len(terms), 0))
+        f.write(self._doc_pk.tobytes())
+        f.write(self._doc_len.tobytes())
+        postings_start = _align(f.tell())
+        f.write(b'\0' * (postings_start - f.tell()))
+
+        entries = []
+        offset = 0
+        for term in terms:
+            docs, tfs = array('I'), array('I')
+            for piece_docs, piece_tfs in self._term_postings(term):
+                docs.extend(piece_docs)
+                tfs.extend(piece_tfs)
+            f.write(docs.tobytes())
+            f.write(tfs.tobytes())
+            entries.append((term, offset, len(docs)))
+            offset += 2 * len(docs)
+
+        terms_offset = f.tell()
+        for term, term_offset, df in entries:
+            encoded = term.encode()
+            f.write(TERM_ENTRY.pack(len(encoded), term_offset, df))
+            f.write(encoded)
+        f.seek(0)
+        f.write(self._header(n_docs, len(terms), terms_offset))
+
+    @classmethod
+    def load(cls, path):
+        """ Открывает снимок через mmap; постинги читаются прямо из файла """
+        index = cls()
+        with open(path, 'rb') as f:
+            index._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            index.mtime = os.fstat(f.fileno()).st_mtime
+        view = index._view = memoryview(index._mmap)
+        magic, epoch, version, n_docs, n_terms, total_len, terms_offset = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            index._release_mmap()
+            raise ValueError(f'{path}: не снимок поискового индекса')
+        index.version = (epoch.hex(), version) if any(epoch) else None
+
+        position = HEADER.size
+        index._doc_pk = array('q', view[position:position + 8 * n_docs].cast('q'))
+        position += 8 * n_docs
+        index._doc_len = array('I', view[position:position + 4 * n_docs].cast('I'))
+        postings_start = _align(position + 4 * n_docs)
+        index._base_postings = view[postings_start:terms_offset].cast('I')
+        index._pk_to_doc = {pk: doc for doc, pk in enumerate(index._doc_pk)}
+        index._total_len = total_len
+
+        position = terms_offset
+        base_terms = {}
+        for _ in range(n_terms):
+            size, offset, df = TERM_ENTRY.unpack_from(view, position)
+            position += TERM_ENTRY.size
+            base_terms[bytes(view[position:position + size]).decode()] = (offset, df)
+            position += size
+        index._base_terms = base_terms
+        return index
+
+    def _release_mmap(self):
+        self._base_terms = {}
+        for view in (self._base_postings, self._view):
+            if view is not None:
+                view.release()
+        self._base_postings = self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # кто-то ещё держит срез — файл закроется вместе с ним
+                pass
+            self._mmap = None
+
+
+# ─── Индекс процесса ─────────────────────────────────────────────
+
+_index = None
+_index_lock = threading.Lock()
+_snapshot_mtime = None   # mtime последнего загруженного снимка
+_rebuild = None          # поток фоновой перестройки, пока он идёт
+
+
+def product_documents(queryset):
+    """ (pk, name, category, description) опубликованных товаров """
+    return queryset.filter(is_published=True).values_list(
+        'pk', 'name', 'category__title', 'description'
+    ).iterator(chunk_size=2000)
+
+
+def build_product_index():
+    from .models import Product
+
+    index = InvertedIndex()
+    # позицию берём до чтения базы: изменения, записанные во время построения, применятся повторно
+    index.version = catalog_changes_version()
+    for pk, name, category, description in product_documents(Product.objects.all()):
+        index.add(pk, name, category, description)
+    return index
+
+
+def _rebuild_index():
+    global _index, _rebuild
+    try:
+        index = build_product_index()
+        with _index_lock:
+            _index = index
+    finally:
+        with _index_lock:
+            _rebuild = None
+        # у потока своё соединение с базой
+        connection.close()
+
+
+def get_product_index():
+    """
+    Индекс текущего процесса: загружается из снимка PRODUCT_SEARCH_INDEX_PATH
+    (и перечитывается, если снимок обновили), а без снимка строится из базы.
+    Перед возвратом догоняет журнал изменений товаров
+    """
+    global _index, _snapshot_mtime, _rebuild
+    path = getattr(settings, 'PRODUCT_SEARCH_INDEX_PATH', None)
+    with _index_lock:
+        mtime = os.path.getmtime(path) if path and os.path.exists(path) else None
+        if mtime is not None and (_index is None or mtime != _snapshot_mtime):
+            _index = InvertedIndex.load(path)
+            _snapshot_mtime = mtime
+        elif _index is None:
+            # отдать пока нечего — единственный случай, когда индекс строится в запросе
+            _index = build_product_index()
+
+        if _rebuild is not None:
+            return _index
+        position, changed = product_changes_since(_index.version)
+        if changed is None:
+            # журнал не догнать — перестраиваем в фоне, а пока отвечаем прежним индексом
+            _rebuild = threading.Thread(target=_rebuild_index, name='product-index-rebuild', daemon=True)
+            _rebuild.start()
+        elif changed:
+            reindex_products(_index, changed)
+            _index.version = position
+        return _index
+
+
+def search_backend():
+    return getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'database')
+
+
+def reindex_products(index, pks):
+    """
+    Перечитывает из базы документы товаров pks; снятые с публикации
+    и удалённые товары убирает из index
+    """
+    from .models import Product
+
+    removed = set(pks)
+    for chunk in pk_chunks(removed):
+        for pk, name, category, description in product_documents(Product.objects.filter(pk__in=chunk)):
+            index.add(pk, name, category, description)
+            removed.discard(pk)
+    for pk in removed:
+        index.remove(pk)
+
+
+def pk_chunks(pks, size=REINDEX_CHUNK_SIZE):
+    """ pk порциями по size: столько параметров уходит в один pk__in """
+    pks = sorted(pks)
+    for start in range(0, len(pks), size):
+        yield pks[start:start + size]
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from django.db import transaction
+from .fieldsets import SparseFieldsetSerializerMixin
 from .models import Category, Product, Order, OrderItem
 from cart.models import Cart, CartItem
 
@@ -11,18 +12,20 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'slug', 'created_at', 'updated_at']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     # Добавляем slug категории
     category_slug = serializers.SlugRelatedField(
         source='category',
         read_only=True,
         slug_field='slug'
     )
+    # quantity минус резервы корзин (cart/reservations.py); колонку считает база
+    available = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Product
         fields = [
-            'id', 'name', 'slug', 'description', 'price', 'quantity',
+            'id', 'name', 'slug', 'description', 'price', 'quantity', 'available',
             'category', 'category_slug', 'image', 'is_published', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'slug', 'created_at', 'updated_at']
@@ -30,7 +33,7 @@ class ProductSerializer(serializers.ModelSerializer):
 
 # ─── Order ──────────────────────────────────────────────────────
 
-class OrderItemReadSerializer(serializers.ModelSerializer):
+class OrderItemReadSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_slug = serializers.CharField(source='product.slug', read_only=True)
     product_image = serializers.ImageField(source='product.image', read_only=True)
@@ -50,7 +53,7 @@ class OrderItemReadSerializer(serializers.ModelSerializer):
 
 
 
-class OrderReadSerializer(serializers.ModelSerializer):
+class OrderReadSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     items = OrderItemReadSerializer(
         source='order_items',   # 👈 ВАЖНО
         many=True,
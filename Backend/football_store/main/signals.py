@@ -0,0 +1,96 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import bump_catalog_generation, record_product_changes
+from .models import Category, Product, Order, OrderItem
+from .search import update_search_vectors
+
+SEARCHABLE_PRODUCT_FIELDS = {'name', 'description', 'category', 'category_id'}
+# поля, которые читают индексы в памяти процесса (search_index.py, suggest.py)
+INDEXED_PRODUCT_FIELDS = SEARCHABLE_PRODUCT_FIELDS | {'slug', 'is_published'}
+
+
+def _shift_order_total(order_id, delta):
+    if order_id is not None and delta:
+        Order.objects.filter(pk=order_id).update(
+            total_price=F('total_price') + delta, updated_at=timezone.now()
+        )
+
+
+def _recalculate_order_total(order_id):
+    Order.objects.filter(pk=order_id).update(
+        total_price=Order.calculated_total(), updated_at=timezone.now()
+    )
+
+
+@receiver(post_save, sender=OrderItem)
+def order_item_saved(sender, instance, created, raw=False, **kwargs):
+    """ Инкрементально переносим изменение суммы позиции в Order.total_price """
+    if raw:
+        return
+    old_order_id, old_total = getattr(instance, '_saved_state', (None, None))
+
+    if created:
+        _shift_order_total(instance.order_id, instance.total_price)
+    elif old_total is None:
+        # объект собран вручную, прежняя сумма неизвестна — пересчитываем целиком
+        _recalculate_order_total(instance.order_id)
+    elif old_order_id == instance.order_id:
+        _shift_order_total(instance.order_id, instance.total_price - old_total)
+    else:
+        # позицию перенесли в другой заказ
+        _shift_order_total(old_order_id, -old_total)
+        _shift_order_total(instance.order_id, instance.total_price)
+
+    instance.remember_saved_state()
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_deleted(sender, instance, **kwargs):
+    old_order_id, old_total = getattr(instance, '_saved_state', (None, None))
+    if old_total is None:
+        _recalculate_order_total(instance.order_id)
+    else:
+        _shift_order_total(old_order_id, -old_total)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is None or (SEARCHABLE_PRODUCT_FIELDS | {'is_published'}) & set(update_fields):
+        update_search_vectors(Product.objects.filter(pk=instance.pk))
+    if update_fields is None or INDEXED_PRODUCT_FIELDS & set(update_fields):
+        # индексы в памяти дочитают журнал; пишем после коммита, чтобы они не видели откатанные данные
+        pk = instance.pk
+        transaction.on_commit(lambda: record_product_changes([pk]))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: record_product_changes([pk]))
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    if getattr(instance, '_saved_title', None) != instance.title:
+        update_search_vectors(Product.objects.filter(category=instance))
+        pks = list(Product.objects.filter(category=instance).values_list('pk', flat=True))
+        transaction.on_commit(lambda: record_product_changes(pks))
+    instance._saved_title = instance.title
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, raw=False, **kwargs):
+    """ Любое изменение каталога делает закэшированные ответы устаревшими """
+    if not raw:
+        transaction.on_commit(bump_catalog_generation)
@@ -0,0 +1,48 @@
+"""
+Подбор уникального slug без запроса к базе на каждый вариант.
+
+SlugAllocator получает множество занятых slug один раз и выдаёт новые по той же схеме,
+что и Product.save()/Category.save(): «base», «base-1», «base-2», ... Для каждой основы
+помнит следующий свободный номер, поэтому тысяча товаров с одинаковым названием
+обходится без квадратичного перебора.
+"""
+from django.utils.text import slugify
+
+MAX_SLUG_LENGTH = 255
+
+
+class SlugAllocator:
+    def __init__(self, taken=()):
+        self.taken = set(taken)
+        self.counters = {}
+
+    def base(self, text):
+        # запас под суффикс «-N», чтобы slug влез в SlugField(max_length=255)
+        return slugify(text, allow_unicode=True)[:MAX_SLUG_LENGTH - 8]
+
+    def allocate(self, text):
+        """ Новый свободный slug для text; сразу помечается занятым """
+        base = self.base(text)
+        slug = base
+        if slug in self.taken:
+            counter = self.counters.get(base, 1)
+            while f'{base}-{counter}' in self.taken:
+                counter += 1
+            slug = f'{base}-{counter}'
+            self.counters[base] = counter + 1
+        self.taken.add(slug)
+        return slug
+
+    def claim(self, slug):
+        """ Отмечает slug, пришедший извне (например, из файла импорта), как занятый """
+        self.taken.add(slug)
+
+
+def unique_slug(model, text, exclude_pk=None):
+    """ Уникальный slug для одной записи: все занятые варианты — одним запросом """
+    allocator = SlugAllocator()
+    base = allocator.base(text)
+    allocator.taken = set(
+        model.objects.filter(slug__startswith=base).exclude(pk=exclude_pk).values_list('slug', flat=True)
+    )
+    return allocator.allocate(text)
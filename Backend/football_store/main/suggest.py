@@ -0,0 +1,149 @@
+"""
+Префиксный индекс названий товаров для подсказок (/api/v1/product/suggest/).
+
+Ключи — нормализованные слова названия и название целиком, отсортированные
+для поиска бисекцией. Индекс строится из базы при первом запросе и дальше
+догоняет журнал изменений товаров (main/cache.py), который пишут сигналы любого
+воркера: опубликованный товар добавляется, снятый с публикации или удалённый —
+убирается. Если журнал не восстановить, индекс строится заново.
+"""
+import threading
+from bisect import bisect_left, insort
+
+from .cache import catalog_changes_version, product_changes_since
+from .search_index import TOKEN_RE, pk_chunks
+
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 20
+# Короткие префиксы («б», «бу») совпадают с тысячами ключей — их ответы запоминаем
+CACHED_RESULTS = 1024
+
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = []           # отсортированные (ключ, pk)
+        self._products = {}       # pk → (название, slug, слова названия)
+        self._results = {}        # (запрос, limit) → ответ; сбрасывается при любом изменении
+        self.version = None       # позиция журнала изменений, до которой индекс актуален
+
+    def __len__(self):
+        return len(self._products)
+
+    @staticmethod
+    def _make_keys(pk, name):
+        normalized = normalize(name)
+        words = TOKEN_RE.findall(normalized)
+        return {(normalized, pk), *((word, pk) for word in words)}, words
+
+    @classmethod
+    def build(cls, products):
+        """ Индекс из (pk, название, slug) — одна сортировка вместо вставок по одному """
+        index = cls()
+        for pk, name, slug in products:
+            keys, words = cls._make_keys(pk, name)
+            index._keys.extend(keys)
+            index._products[pk] = (name, slug, words)
+        index._keys.sort()
+        return index
+
+    def add(self, pk, name, slug):
+        with self._lock:
+            self.remove(pk)
+            keys, words = self._make_keys(pk, name)
+            for key in keys:
+                insort(self._keys, key)
+            self._products[pk] = (name, slug, words)
+            self._results.clear()
+
+    def remove(self, pk):
+        with self._lock:
+            product = self._products.pop(pk, None)
+            if product is None:
+                return
+            self._results.clear()
+            for key in self._make_keys(pk, product[0])[0]:
+                position = bisect_left(self._keys, key)
+                if position < len(self._keys) and self._keys[position] == key:
+                    del self._keys[position]
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        """
+        Товары, у которых последнее слово запроса — префикс какого-либо слова
+        названия, а остальные слова запроса — префиксы других слов.
+        Совпадения с началом названия идут первыми, затем более короткие названия.
+        """
+        normalized = normalize(query).strip()
+        words = TOKEN_RE.findall(normalized)
+        if not words:
+            return []
+        *leading, prefix = words
+
+        with self._lock:
+            cached = self._results.get((normalized, limit))
+            if cached is not None:
+                return cached
+
+            matches = {}
+            position = bisect_left(self._keys, (prefix,))
+            while position < len(self._keys) and self._keys[position][0].startswith(prefix):
+                pk = self._keys[position][1]
+                position += 1
+                name, slug, name_words = self._products[pk]
+                if all(any(word.startswith(lead) for word in name_words) for lead in leading):
+                    matches[pk] = (not normalize(name).startswith(normalized), len(name), name, slug)
+
+            best = sorted(matches.values())[:limit]
+            result = [{'name': name, 'slug': slug} for _, _, name, slug in best]
+            if len(self._results) >= CACHED_RESULTS:
+                self._results.clear()
+            self._results[(normalized, limit)] = result
+            return result
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def build_suggest_index():
+    from .models import Product
+
+    # позицию берём до чтения базы: изменения, записанные во время построения, применятся повторно
+    version = catalog_changes_version()
+    products = Product.objects.filter(is_published=True).values_list('pk', 'name', 'slug')
+    index = SuggestIndex.build(products.iterator(chunk_size=2000))
+    index.version = version
+    return index
+
+
+def update_suggestions(index, pks):
+    """ Перечитывает товары pks: опубликованные добавляет в index, остальные убирает """
+    from .models import Product
+
+    removed = set(pks)
+    for chunk in pk_chunks(removed):
+        products = Product.objects.filter(pk__in=chunk, is_published=True).values_list('pk', 'name', 'slug')
+        for pk, name, slug in products:
+            index.add(pk, name, slug)
+            removed.discard(pk)
+    for pk in removed:
+        index.remove(pk)
+
+
+def get_suggest_index():
+    """ Индекс процесса: строится при первом запросе и перед возвратом догоняет журнал изменений """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = build_suggest_index()
+        version, changed = product_changes_since(_index.version)
+        if changed is None:
+            _index = build_suggest_index()
+        elif changed:
+            update_suggestions(_index, changed)
+            _index.version = version
+        return _index
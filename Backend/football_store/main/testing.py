@@ -0,0 +1,56 @@
+"""
+Помощники для тестов.
+
+QueryBudgetMixin проверяет, что число SQL-запросов эндпоинта не растёт
+вместе с количеством строк в ответе (защита от N+1 в CI).
+"""
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# Точки сохранения ставит ATOMIC_REQUESTS, в бюджет их не считаем
+SERVICE_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class QueryBudgetMixin:
+    """
+    Примесь к TestCase.
+
+    assertQueryBudget(url, add_rows) дважды запрашивает url: после add_rows(small)
+    и после ещё одного add_rows(large - small). Тест падает, если число запросов
+    изменилось или превысило budget.
+    """
+    query_budget_sizes = (1, 5)
+
+    def count_queries(self, url, client=None, **extra):
+        client = client or self.client
+        # бюджет считаем для некэшированного ответа (см. main.cache.CachedResponseMixin)
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(url, **extra)
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', response))
+        queries = [
+            query for query in ctx.captured_queries
+            if not query['sql'].upper().startswith(SERVICE_STATEMENTS)
+        ]
+        return len(queries), queries
+
+    def assertQueryBudget(self, url, add_rows, budget=None, client=None, **extra):
+        small, large = self.query_budget_sizes
+        add_rows(small)
+        small_count, _ = self.count_queries(url, client, **extra)
+        add_rows(large - small)
+        large_count, queries = self.count_queries(url, client, **extra)
+
+        if small_count != large_count:
+            self.fail(
+                f"{url}: число запросов растёт вместе с данными "
+                f"({small} стр. → {small_count}, {large} стр. → {large_count}):\n"
+                + "\n".join(query['sql'] for query in queries)
+            )
+        if budget is not None and large_count > budget:
+            self.fail(
+                f"{url}: {large_count} запросов при бюджете {budget}:\n"
+                + "\n".join(query['sql'] for query in queries)
+            )
+        return large_count
@@ -1,3 +1,1255 @@
-from django.test import TestCase
+import json
+import os
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from itertools import count
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from unittest import skipUnless
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from cart.models import Cart, CartItem
+from .cache import bump_catalog_generation, catalog_changes_version, catalog_generation, record_product_changes
+from .catalog_io import CatalogImporter
+from .checks import check_search_index_cache
+from .compiled import compile_serializer
+from .fieldsets import parse_fieldset
+from .idempotency import sweep_expired_keys
+from .inventory import available_stock, disable_sharding, enable_sharding, rebalance_shards, take_stock
+from .models import Category, Product, Order, OrderItem, StockShard, IdempotencyKey
+from . import search_index, suggest
+from .search import full_text_search_supported
+from .search_index import InvertedIndex, tokenize
+from .testing import QueryBudgetMixin
+from .transactions import DEADLOCK, retry_counters, retry_transaction
+from .serializers import ProductSerializer
+from .views import ProductViewSet
+
+
+class CreateFromCartTests(TestCase):
+    url = '/api/v1/order/create-from-cart/'
+    slugs = count()
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass')
+        self.category = Category.objects.create(title='Мячи')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fill_cart(self, lines, quantity=2, stock=10):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        products = Product.objects.bulk_create([
+            Product(
+                name=f'Товар {i}',
+                slug=f'tovar-{next(self.slugs)}',
+                price=Decimal('100.00') + i,
+                quantity=stock,
+                category=self.category,
+            )
+            for i in range(lines)
+        ])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=quantity, price=product.price)
+            for product in products
+        ])
+        return products
+
+    def checkout_queries(self, lines):
+        self.fill_cart(lines)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 201, response.data)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        self.assertEqual(self.checkout_queries(1), self.checkout_queries(10))
+
+    def test_order_created_and_stock_decremented(self):
+        products = self.fill_cart(3, quantity=2, stock=5)
+
+        response = self.client.post(self.url)
+
+        self.assertEqual(response.status_code, 201, response.data)
+        order = Order.objects.get(pk=response.data['id'])
+        self.assertEqual(order.order_items.count(), 3)
+        for product in products:
+            product.refresh_from_db()
+            self.assertEqual(product.quantity, 3)
+            item = OrderItem.objects.get(order=order, product=product)
+            self.assertEqual(item.price, product.price)
+            self.assertEqual(item.total_price, product.price * 2)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+    def test_insufficient_stock_rolls_back(self):
+        products = self.fill_cart(2, quantity=4, stock=3)
+
+        response = self.client.post(self.url)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        for product in products:
+            product.refresh_from_db()
+            self.assertEqual(product.quantity, 3)
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 2)
+
+
+class OrderTotalPriceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass')
+        category = Category.objects.create(title='Форма')
+        self.shirt = Product.objects.create(name='Футболка', price=Decimal('1500.00'), category=category)
+        self.socks = Product.objects.create(name='Гетры', price=Decimal('300.00'), category=category)
+        self.order = Order.objects.create(user=self.user)
+
+    def assertTotal(self, order, expected):
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal(expected))
+
+    def test_total_follows_item_changes(self):
+        shirt = OrderItem.objects.create(order=self.order, product=self.shirt, quantity=2)
+        OrderItem.objects.create(order=self.order, product=self.socks, quantity=3)
+        self.assertTotal(self.order, '3900.00')
+
+        shirt = OrderItem.objects.get(pk=shirt.pk)
+        shirt.quantity = 1
+        shirt.save()
+        self.assertTotal(self.order, '2400.00')
+
+        shirt.delete()
+        self.assertTotal(self.order, '900.00')
+
+    def test_moving_item_updates_both_orders(self):
+        item = OrderItem.objects.create(order=self.order, product=self.shirt, quantity=1)
+        other = Order.objects.create(user=self.user)
+
+        item.order = other
+        item.save()
+
+        self.assertTotal(self.order, '0.00')
+        self.assertTotal(other, '1500.00')
+
+    def test_order_save_keeps_stored_total(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        OrderItem.objects.create(order=self.order, product=self.shirt, quantity=1)
+
+        stale.status = 'processing'
+        stale.save()
+
+        self.assertTotal(self.order, '1500.00')
+
+    def test_recompute_command_fixes_drift(self):
+        OrderItem.objects.create(order=self.order, product=self.shirt, quantity=1)
+        Order.objects.filter(pk=self.order.pk).update(total_price=Decimal('1.00'))
+
+        with self.assertRaises(CommandError):
+            call_command('recompute_order_totals', '--check', stdout=StringIO())
+        call_command('recompute_order_totals', stdout=StringIO())
+
+        self.assertTotal(self.order, '1500.00')
+        call_command('recompute_order_totals', '--check', stdout=StringIO())
+
+    def test_order_list_reads_stored_total(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        OrderItem.objects.create(order=self.order, product=self.shirt, quantity=2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get('/api/v1/order/')
+
+        self.assertEqual(response.data['results'][0]['total_price'], '3000.00')
+        self.assertFalse([q for q in ctx.captured_queries if 'SUM(' in q['sql'].upper()])
+
+
+class MainQueryBudgetTests(QueryBudgetMixin, TestCase):
+    slugs = count()
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass')
+        self.staff = User.objects.create_user(username='staff', password='pass', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_products(self, n):
+        products = []
+        for _ in range(n):
+            # у каждого товара своя категория, чтобы N+1 по категориям был виден
+            category = Category.objects.create(title=f'Категория {next(self.slugs)}')
+            products.append(Product.objects.create(
+                name=f'Товар {next(self.slugs)}', price=Decimal('10.00'), quantity=5, category=category
+            ))
+        return products
+
+    def add_orders(self, n, user=None):
+        for product in self.add_products(n):
+            order = Order.objects.create(user=user or User.objects.create_user(username=f'u{next(self.slugs)}'))
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+
+    # у заказов +1 в бюджете — агрегат для ETag/Last-Modified (ConditionalGetMixin);
+    # ETag каталога считается из поколения, без запроса
+
+    def test_category_list(self):
+        self.assertQueryBudget('/api/v1/category/', self.add_products, budget=1)
+
+    def test_product_list(self):
+        self.assertQueryBudget('/api/v1/product/', self.add_products, budget=1)
+
+    def test_product_retrieve(self):
+        product = self.add_products(1)[0]
+        queries, _ = self.count_queries(f'/api/v1/product/{product.slug}/')
+        self.assertLessEqual(queries, 1)
+
+    def test_order_list(self):
+        add_own_orders = lambda n: self.add_orders(n, user=self.user)
+        self.assertQueryBudget('/api/v1/order/', add_own_orders, budget=4)
+
+    def test_order_list_for_staff(self):
+        self.client.force_authenticate(self.staff)
+        self.assertQueryBudget('/api/v1/order/', self.add_orders, budget=4)
+
+    def test_order_retrieve(self):
+        self.add_orders(1, user=self.user)
+        order = Order.objects.get(user=self.user)
+        queries, _ = self.count_queries(f'/api/v1/order/{order.pk}/')
+        self.assertLessEqual(queries, 4)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.boots = Category.objects.create(title='Бутсы')
+        self.balls = Category.objects.create(title='Мячи')
+        Product.objects.create(name='Nike Mercurial', description='Лёгкие бутсы', price=1, category=self.boots)
+        Product.objects.create(name='Adidas Predator', description='', price=1, category=self.boots)
+        Product.objects.create(name='Мяч Select', description='Подходит под любые бутсы', price=1, category=self.balls)
+        Product.objects.create(name='Мяч Nike', description='', price=1, category=self.balls)
+
+    def search(self, term):
+        response = self.client.get('/api/v1/product/', {'search': term})
+        self.assertEqual(response.status_code, 200)
+        return [product['name'] for product in response.data['results']]
+
+    def test_search_by_name_description_and_category(self):
+        self.assertCountEqual(self.search('Predator'), ['Adidas Predator'])
+        self.assertCountEqual(self.search('Nike'), ['Nike Mercurial', 'Мяч Nike'])
+        self.assertIn('Adidas Predator', self.search('Бутсы'))
+
+    @skipUnless(full_text_search_supported(), 'полнотекстовый поиск есть только в PostgreSQL')
+    def test_results_ranked_and_follow_category_rename(self):
+        # Совпадение в названии (вес A) выше совпадения в категории (B) и описании (C)
+        Product.objects.create(name='Бутсы Puma Future', description='', price=1, category=self.balls)
+        self.assertEqual(self.search('бутсы')[0], 'Бутсы Puma Future')
+
+        self.assertEqual(self.search('перчатки'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.balls.title = 'Вратарские перчатки'
+            self.balls.save()
+        self.assertCountEqual(self.search('перчатки'), ['Мяч Select', 'Мяч Nike', 'Бутсы Puma Future'])
+
+
+class InvertedIndexTests(TestCase):
+    def make_index(self):
+        index = InvertedIndex()
+        index.add(1, 'Вратарские перчатки Reusch', 'Перчатки', 'Для игры на искусственном газоне')
+        index.add(2, 'Бутсы Nike Mercurial', 'Бутсы', 'Лёгкие бутсы для быстрых игроков')
+        index.add(3, 'Мяч Adidas', 'Мячи', 'Подходит для игры в перчатках')
+        return index
+
+    def test_tokenize_stems_russian_and_english(self):
+        self.assertEqual(tokenize('Вратарские перчатки'), tokenize('вратарская перчатка'))
+        self.assertEqual(tokenize('Football boots'), ['football', 'boot'])
+
+    def test_bm25_ranking_prefers_name_matches(self):
+        index = self.make_index()
+        self.assertEqual([pk for pk, _ in index.search('перчатки')], [1, 3])
+        self.assertEqual([pk for pk, _ in index.search('перчатки reusch')], [1])
+        self.assertEqual(index.search('шорты'), [])
+
+    def test_incremental_update_and_remove(self):
+        index = self.make_index()
+        index.add(3, 'Мяч Adidas', 'Мячи', '')
+        index.remove(2)
+
+        self.assertEqual([pk for pk, _ in index.search('перчатки')], [1])
+        self.assertEqual(index.search('бутсы'), [])
+        index.compact()
+        self.assertEqual([pk for pk, _ in index.search('мяч')], [3])
+
+    def test_snapshot_roundtrip_through_mmap(self):
+        index = self.make_index()
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.bin')
+            index.save(path)
+            loaded = InvertedIndex.load(path)
+
+            self.assertEqual(loaded.search('перчатки'), index.search('перчатки'))
+            # изменения после загрузки ложатся поверх снимка
+            loaded.add(4, 'Перчатки полевые', '', '')
+            loaded.remove(1)
+            self.assertEqual(sorted(pk for pk, _ in loaded.search('перчатки')), [3, 4])
+            loaded.compact()
+
+    @override_settings(PRODUCT_SEARCH_BACKEND='inverted_index', PRODUCT_SEARCH_INDEX_PATH=None)
+    def test_product_endpoint_uses_index(self):
+        category = Category.objects.create(title='Перчатки')
+        Product.objects.create(name='Перчатки Reusch', price=1, category=category)
+        Product.objects.create(
+            name='Мяч Select', description='Подойдут любые перчатки', price=1,
+            category=Category.objects.create(title='Мячи')
+        )
+        search_index._index = None
+        self.addCleanup(setattr, search_index, '_index', None)
+
+        response = self.client.get('/api/v1/product/', {'search': 'перчатка'})
+        self.assertEqual([p['name'] for p in response.data['results']], ['Перчатки Reusch', 'Мяч Select'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(name='Мяч Select').get().delete()
+        response = self.client.get('/api/v1/product/', {'search': 'перчатка'})
+        self.assertEqual([p['name'] for p in response.data['results']], ['Перчатки Reusch'])
+
+    def test_process_local_cache_warns(self):
+        with override_settings(PRODUCT_SEARCH_BACKEND='inverted_index'):
+            self.assertEqual([warning.id for warning in check_search_index_cache(None)], ['main.W001'])
+        with override_settings(PRODUCT_SEARCH_BACKEND='database'):
+            self.assertEqual(check_search_index_cache(None), [])
+
+    @override_settings(PRODUCT_SEARCH_BACKEND='inverted_index', PRODUCT_SEARCH_INDEX_PATH=None)
+    def test_filters_apply_before_hit_limit(self):
+        gloves = Category.objects.create(title='Перчатки', slug='gloves')
+        balls = Category.objects.create(title='Мячи', slug='balls')
+        Product.objects.create(name='Перчатки Reusch', price=1, category=gloves)
+        Product.objects.create(name='Мяч Select', description='Перчатки в комплект не входят', price=1, category=balls)
+        search_index._index = None
+        self.addCleanup(setattr, search_index, '_index', None)
+
+        # лучшее совпадение — в другой категории; отсечение до фильтра вернуло бы пустую выдачу
+        with patch('main.filters.MAX_HITS', 1):
+            response = self.client.get('/api/v1/product/', {'search': 'перчатки', 'category': 'balls'})
+        self.assertEqual([p['name'] for p in response.data['results']], ['Мяч Select'])
+
+
+@override_settings(PRODUCT_SEARCH_BACKEND='inverted_index', PRODUCT_SEARCH_INDEX_PATH=None)
+class ProductIndexChangesTests(TestCase):
+    """ Изменения товаров доходят до индекса процесса через журнал (main/cache.py) """
+
+    def setUp(self):
+        cache.clear()
+        search_index._index = None
+        self.addCleanup(setattr, search_index, '_index', None)
+        self.category = Category.objects.create(title='Перчатки')
+        self.product = Product.objects.create(name='Перчатки Reusch', price=1, category=self.category)
+
+    def search(self, query):
+        return [pk for pk, _ in search_index.get_product_index().search(query)]
+
+    def test_changes_from_another_worker_reach_index(self):
+        self.assertEqual(self.search('reusch'), [self.product.pk])
+
+        # другой воркер: его сигналы записали журнал, но индекс этого процесса не трогали
+        Product.objects.filter(pk=self.product.pk).update(name='Перчатки Uhlsport')
+        record_product_changes([self.product.pk])
+        self.assertEqual(self.search('reusch'), [])
+        self.assertEqual(self.search('uhlsport'), [self.product.pk])
+
+        Product.objects.filter(pk=self.product.pk).update(is_published=False)
+        record_product_changes([self.product.pk])
+        self.assertEqual(self.search('uhlsport'), [])
+
+    def test_signals_record_changes(self):
+        self.assertEqual(self.search('reusch'), [self.product.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.title = 'Вратарские'
+            self.category.save()
+        self.assertEqual(self.search('вратарские'), [self.product.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertEqual(self.search('reusch'), [])
+
+    def test_reloaded_snapshot_replays_later_changes(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.bin')
+            with override_settings(PRODUCT_SEARCH_INDEX_PATH=path):
+                self.assertEqual(self.search('reusch'), [self.product.pk])
+                position = catalog_changes_version()
+
+                Product.objects.filter(pk=self.product.pk).update(name='Перчатки Uhlsport')
+                record_product_changes([self.product.pk])
+                self.assertEqual(self.search('uhlsport'), [self.product.pk])
+
+                # снимок обновили (build_search_index) по состоянию до изменения — оно применяется заново
+                stale = search_index.InvertedIndex()
+                stale.add(self.product.pk, 'Перчатки Reusch', 'Перчатки', '')
+                stale.version = position
+                stale.save(path)
+                os.utime(path, (0, 0))
+                self.assertEqual(self.search('reusch'), [])
+                self.assertEqual(self.search('uhlsport'), [self.product.pk])
+
+
+
+@override_settings(PRODUCT_SEARCH_BACKEND='inverted_index', PRODUCT_SEARCH_INDEX_PATH=None)
+class ProductIndexRebuildTests(TransactionTestCase):
+    """ Индекс, которому не догнать журнал, перестраивается в фоновом потоке — ему нужны закоммиченные данные """
+
+    def setUp(self):
+        cache.clear()
+        search_index._index = None
+        self.addCleanup(setattr, search_index, '_index', None)
+        self.addCleanup(self.wait_for_rebuild)
+        category = Category.objects.create(title='Перчатки')
+        self.product = Product.objects.create(name='Перчатки Reusch', price=1, category=category)
+
+    def search(self, query):
+        return [pk for pk, _ in search_index.get_product_index().search(query)]
+
+    def wait_for_rebuild(self):
+        thread = search_index._rebuild
+        if thread is not None:
+            thread.join(10)
+
+    def test_lost_journal_rebuilds_in_background(self):
+        self.assertEqual(self.search('reusch'), [self.product.pk])
+        Product.objects.filter(pk=self.product.pk).update(name='Перчатки Uhlsport')
+        record_product_changes([self.product.pk])
+        # запись журнала истекла или вытеснена
+        cache.delete(f'catalog:changes:{catalog_changes_version()[1]}')
+
+        release = Event()
+        build = search_index.build_product_index
+
+        def slow_build():
+            release.wait(10)
+            return build()
+
+        with patch.object(search_index, 'build_product_index', slow_build):
+            # пока индекс перестраивается, запросы получают прежний, а не ждут
+            self.assertEqual(self.search('reusch'), [self.product.pk])
+            self.assertEqual(self.search('reusch'), [self.product.pk])
+            release.set()
+            self.wait_for_rebuild()
+        self.assertEqual(self.search('uhlsport'), [self.product.pk])
+
+    def test_snapshot_from_another_cache_is_rebuilt_not_rewritten(self):
+        Product.objects.filter(pk=self.product.pk).update(name='Перчатки Uhlsport')
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.bin')
+            # снимок построен процессом с другим кэшем: его версия журнала здесь ничего не значит
+            foreign = InvertedIndex()
+            foreign.add(self.product.pk, 'Перчатки Reusch', 'Перчатки', '')
+            foreign.version = ('f' * 32, 5)
+            foreign.save(path)
+            mtime = os.path.getmtime(path)
+
+            with override_settings(PRODUCT_SEARCH_INDEX_PATH=path):
+                self.assertEqual(self.search('reusch'), [self.product.pk])
+                self.wait_for_rebuild()
+                self.assertEqual(self.search('uhlsport'), [self.product.pk])
+                self.assertEqual(self.search('reusch'), [])
+
+            self.assertEqual(os.path.getmtime(path), mtime)
+            self.assertEqual(os.listdir(tmp), ['index.bin'])
+
+
+class ProductSuggestTests(TestCase):
+    url = '/api/v1/product/suggest/'
+
+    def setUp(self):
+        category = Category.objects.create(title='Бутсы')
+        self.mercurial = Product.objects.create(name='Бутсы Nike Mercurial', price=1, category=category)
+        Product.objects.create(name='Детские бутсы Puma', price=1, category=category)
+        Product.objects.create(name='Бутылка для воды', price=1, category=category)
+        Product.objects.create(name='Бутсы Adidas', price=1, category=category, is_published=False)
+        cache.clear()
+        suggest._index = None
+        self.addCleanup(setattr, suggest, '_index', None)
+
+    def names(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data]
+
+    def test_prefix_suggestions_ranked_with_cache_headers(self):
+        response = self.client.get(self.url, {'q': 'бут'})
+
+        self.assertEqual(self.names(response), ['Бутылка для воды', 'Бутсы Nike Mercurial', 'Детские бутсы Puma'])
+        self.assertEqual(response.data[1]['slug'], self.mercurial.slug)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertEqual(self.names(self.client.get(self.url, {'q': 'бутсы me'})), ['Бутсы Nike Mercurial'])
+        self.assertEqual(self.names(self.client.get(self.url, {'q': 'бут', 'limit': 1})), ['Бутылка для воды'])
+
+    def test_publish_and_unpublish_update_index(self):
+        self.client.get(self.url, {'q': 'бут'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            adidas = Product.objects.get(name='Бутсы Adidas')
+            adidas.is_published = True
+            adidas.save()
+            self.mercurial.is_published = False
+            self.mercurial.save(update_fields=['is_published'])
+
+        self.assertEqual(
+            self.names(self.client.get(self.url, {'q': 'бутсы'})),
+            ['Бутсы Adidas', 'Детские бутсы Puma']
+        )
+
+    def test_changes_from_another_worker_reach_index(self):
+        self.client.get(self.url, {'q': 'бут'})
+
+        # другой воркер: сигналы записали журнал, индекс этого процесса не трогали
+        Product.objects.filter(pk=self.mercurial.pk).update(name='Бутсы Nike Phantom')
+        Product.objects.filter(name='Бутылка для воды').update(is_published=False)
+        record_product_changes(Product.objects.filter(name__in=['Бутсы Nike Phantom', 'Бутылка для воды'])
+                               .values_list('pk', flat=True))
+
+        self.assertEqual(
+            self.names(self.client.get(self.url, {'q': 'бут'})),
+            ['Бутсы Nike Phantom', 'Детские бутсы Puma']
+        )
+
+
+@override_settings(CATALOG_PRICE_BUCKETS=[1000, 5000])
+class ProductFacetsTests(TestCase):
+    url = '/api/v1/product/facets/'
+
+    def setUp(self):
+        cache.clear()
+        boots = Category.objects.create(title='Бутсы')
+        balls = Category.objects.create(title='Мячи')
+        Product.objects.create(name='Бутсы Nike', price=Decimal('7000'), category=boots)
+        Product.objects.create(name='Бутсы Puma', price=Decimal('4000'), category=boots)
+        Product.objects.create(name='Мяч Select', price=Decimal('900'), category=balls)
+        Product.objects.create(name='Мяч Nike', price=Decimal('1500'), category=balls, is_published=False)
+
+    def test_counts_in_single_query(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('SELECT')]), 1)
+        self.assertEqual(response.data['total'], 3)
+        self.assertEqual(
+            [(c['title'], c['count']) for c in response.data['categories']],
+            [('Бутсы', 2), ('Мячи', 1)]
+        )
+        self.assertEqual(
+            [(b['min'], b['max'], b['count']) for b in response.data['price']],
+            [(0, 1000, 1), (1000, 5000, 1), (5000, None, 1)]
+        )
+
+    def test_filters_apply_to_counts(self):
+        response = self.client.get(self.url, {'search': 'Nike', 'min_price': '1000'})
+        self.assertEqual(response.data['total'], 1)
+        self.assertEqual(response.data['categories'][0]['title'], 'Бутсы')
+
+    def test_cached_until_catalog_changes(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url)
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(name='Мяч Nike').update(is_published=True)
+            Product.objects.get(name='Мяч Nike').save()
+        self.assertEqual(self.client.get(self.url).data['total'], 4)
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=60, CATALOG_CACHE_STALE_TIMEOUT=30)
+class ConditionalGetTests(TestCase):
+    url = '/api/v1/product/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(title='Мячи')
+        self.product = Product.objects.create(name='Мяч Select', price=1, quantity=5, category=self.category)
+
+    def test_not_modified_before_serialization(self):
+        response = self.client.get(self.url)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertTrue(response.has_header('ETag'))
+
+        with CaptureQueriesContext(connection) as ctx:
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        # ETag каталога — из поколения, база не читается
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT')])
+
+    def test_changes_and_deletes_change_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 2
+            self.product.save()
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Product.objects.create(name='Мяч Nike', price=1, category=self.category)
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_order_etag_private_and_follows_status(self):
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=self.product, quantity=1)
+        url = f'/api/v1/order/{order.pk}/'
+
+        response = self.client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Authorization', response['Vary'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        self.client.post(f'{url}cancel/')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_missing_object_still_404(self):
+        response = self.client.get(f'{self.url}no-such-product/', HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 404)
+
+
+class FastJSONTests(TestCase):
+    url = '/api/v1/product/'
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(title='Мячи')
+        for number in range(25):
+            Product.objects.create(
+                name=f'Мяч «{number}»\u2028', description='Кожа\n"размер 5"', price=Decimal('1999.5') + number,
+                quantity=number, category=category, image=f'products/мяч {number}.jpg' if number % 2 else ''
+            )
+
+    def assertSameBody(self, params):
+        expected = self.client.get(self.url, params)
+        fast = self.client.get(self.url, params, HTTP_ACCEPT='application/json; fast=true')
+        self.assertEqual(fast.status_code, 200)
+        self.assertIn('fast=true', fast['Content-Type'])
+        self.assertEqual(fast.content, expected.content)
+        return fast
+
+    def test_byte_for_byte_with_serializer(self):
+        # иначе список молча отдаётся обычным путём и сравнение ничего не проверяет
+        self.assertIsNotNone(compile_serializer(ProductSerializer))
+        first = self.assertSameBody({})
+        self.assertSameBody({'ordering': 'price'})
+        self.assertSameBody({'search': 'мяч', 'category': 'мячи'})
+        # курсор следующей страницы, построенный по dict-строкам, тоже совпадает
+        cursor = parse_qs(urlsplit(first.json()['next']).query)['cursor'][0]
+        self.assertSameBody({'cursor': cursor})
+
+    def test_only_explicit_accept_selects_fast_path(self):
+        for accept in ('application/json', '*/*'):
+            response = self.client.get(self.url, HTTP_ACCEPT=accept)
+            self.assertEqual(response['Content-Type'], 'application/json')
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(self.url, {'format': 'fastjson'})
+        # values() не тянет несериализуемые колонки (search_vector)
+        self.assertFalse([q for q in ctx.captured_queries if 'search_vector' in q['sql']])
+
+
+class CatalogResponseCacheTests(TestCase):
+    url = '/api/v1/product/'
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(title='Мячи')
+        self.product = Product.objects.create(name='Мяч Select', price=1, category=self.category)
+
+    def test_hit_skips_database(self):
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.data['results'][0]['name'], 'Мяч Select')
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('SELECT')])
+        # другие параметры — другой ключ
+        self.assertEqual(self.client.get(self.url, {'ordering': 'price'})['X-Cache'], 'MISS')
+
+    def test_catalog_change_invalidates(self):
+        self.client.get(f'/api/v1/category/{self.category.slug}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.title = 'Футбольные мячи'
+            self.category.save()
+
+        response = self.client.get(f'/api/v1/category/{self.category.slug}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['title'], 'Футбольные мячи')
+
+    def test_concurrent_miss_serves_stale_while_one_request_rebuilds(self):
+        self.client.get(self.url)
+        bump_catalog_generation()
+        # блокировку пересборки держит «другой» запрос
+        key = ProductViewSet().response_cache_key(self.request_for(self.url))
+        cache.add(f'{key}:lock', 1)
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response['X-Cache'], 'STALE')
+        self.assertEqual(response.data['results'][0]['name'], 'Мяч Select')
+
+    def request_for(self, url):
+        request = Request(RequestFactory().get(url))
+        request.accepted_renderer = JSONRenderer()
+        return request
+
+
+class SparseFieldsetTests(TestCase):
+    url = '/api/v1/product/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='pass')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(title='Мячи')
+        for number in range(25):
+            Product.objects.create(
+                name=f'Мяч {number}', description='Очень длинное описание', price=Decimal('100') + number,
+                quantity=number, category=category
+            )
+
+    def get(self, params, **extra):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, params, **extra)
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', response))
+        return response, [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+
+    def test_fields_prune_payload_and_columns(self):
+        response, selects = self.get({'fields': 'name,slug,price'})
+        self.assertEqual(set(response.data['results'][0]), {'name', 'slug', 'price'})
+        self.assertFalse([sql for sql in selects if '"description"' in sql or 'search_vector' in sql])
+
+        # курсор строится по created_at, которого нет в ответе
+        cursor = parse_qs(urlsplit(response.data['next']).query)['cursor'][0]
+        response, _ = self.get({'fields': 'name,slug,price', 'cursor': cursor})
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_omit_and_fast_path(self):
+        response, _ = self.get({'omit': 'description,created_at'})
+        self.assertNotIn('description', response.data['results'][0])
+        self.assertIn('category_slug', response.data['results'][0])
+
+        params = {'fields': 'name,price', 'ordering': 'price'}
+        fast, selects = self.get(params, HTTP_ACCEPT='application/json; fast=true')
+        self.assertEqual(fast.content, self.get(params)[0].content)
+        self.assertFalse([sql for sql in selects if '"description"' in sql])
+
+    def test_invalid_fields_rejected(self):
+        for params in ({'fields': 'name,secret'}, {'omit': 'name.slug'}, {'fields': 'name..slug'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn(next(iter(params)), response.data)
+
+    def test_parsed_fieldset_is_cached(self):
+        self.assertIs(
+            parse_fieldset(ProductSerializer, 'name,price', ''),
+            parse_fieldset(ProductSerializer, 'name,price', '')
+        )
+
+    def test_order_items_omitted_without_prefetch(self):
+        order = Order.objects.create(user=self.user)
+        OrderItem.objects.create(order=order, product=Product.objects.get(name='Мяч 0'), quantity=1)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/v1/order/', {'omit': 'items,username'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'status', 'total_price', 'created_at', 'updated_at'})
+        self.assertFalse([q for q in ctx.captured_queries if 'order_item' in q['sql']])
+
+        response = self.client.get('/api/v1/order/', {'fields': 'id,items.product_name'})
+        self.assertEqual(response.data['results'][0]['items'], [{'product_name': 'Мяч 0'}])
+
+
+@skipUnless(full_text_search_supported(), 'планы запросов проверяются только на PostgreSQL')
+class IndexUsageTests(TestCase):
+    """ Горячие запросы каталога и заказов идут по индексам из Meta.indexes """
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = Category.objects.bulk_create([
+            Category(title=f'Категория {number}', slug=f'kategoriya-{number}') for number in range(50)
+        ])
+        Product.objects.bulk_create([
+            Product(
+                name=f'Товар {number}', slug=f'tovar-{number}', price=Decimal(number % 997),
+                category=categories[number % 50], is_published=number % 10 != 0
+            )
+            for number in range(10000)
+        ])
+        cls.user = User.objects.create_user(username='buyer', password='pass')
+        users = [cls.user, *(User.objects.create_user(username=f'u{number}') for number in range(49))]
+        Order.objects.bulk_create([Order(user=users[number % 50]) for number in range(5000)])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertUsesIndex(self, url, params, table, index):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        # запрос страницы, а не агрегат для ETag
+        sql = next(
+            query['sql'] for query in ctx.captured_queries
+            if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql'] and 'MAX(' not in query['sql']
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}')
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+        self.assertIn(index, plan, plan)
+        self.assertIn('Index', plan)
+        return plan
+
+    def test_product_list(self):
+        url = '/api/v1/product/'
+        self.assertUsesIndex(url, {}, 'product', 'product_pub_created_id_idx')
+        self.assertUsesIndex(url, {'category': 'kategoriya-7'}, 'product', 'product_pub_cat_created_id_idx')
+        self.assertUsesIndex(url, {'ordering': 'price', 'min_price': 500}, 'product', 'product_pub_price_id_idx')
+        self.assertUsesIndex(url, {'category': 'kategoriya-7', 'ordering': 'price'}, 'product', 'product_pub_cat_price_id_idx')
+        self.assertUsesIndex(url, {'ordering': 'name'}, 'product', 'product_pub_name_id_idx')
+
+    def test_deep_page_is_index_range(self):
+        response = self.client.get('/api/v1/product/', {'ordering': '-price'})
+        for _ in range(50):
+            response = self.client.get(response.data['next'])
+        cursor = parse_qs(urlsplit(response.data['next']).query)['cursor'][0]
+        plan = self.assertUsesIndex('/api/v1/product/', {'ordering': '-price', 'cursor': cursor}, 'product', 'product_pub_price_id_idx')
+        # курсор — условие индекса, а не OFFSET
+        self.assertIn('Index Cond', plan)
+        self.assertNotIn('OFFSET', plan.upper())
+
+    def test_order_list(self):
+        self.assertUsesIndex('/api/v1/order/', {}, 'order', 'order_user_created_id_idx')
+
+
+class KeysetPaginationTests(TestCase):
+    url = '/api/v1/product/'
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(title='Мячи')
+        # одинаковые цены и названия на границах страниц (по 20 товаров)
+        Product.objects.bulk_create([
+            Product(
+                name=f'Мяч {number % 3}', slug=f'myach-{number}', price=Decimal(number % 4),
+                category=category
+            )
+            for number in range(45)
+        ])
+
+    def walk(self, params):
+        response = self.client.get(self.url, params)
+        pages = [response.data]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append(response.data)
+        return pages
+
+    def test_ties_neither_skipped_nor_duplicated(self):
+        for ordering in ('price', '-price', 'name', '-name', 'created_at'):
+            pages = self.walk({'ordering': ordering})
+            ids = [product['id'] for page in pages for product in page['results']]
+            self.assertEqual(len(ids), 45, ordering)
+            self.assertEqual(len(set(ids)), 45, ordering)
+
+            # назад с последней страницы — те же строки в том же порядке
+            back = pages[-1]
+            previous_ids = []
+            while back['previous']:
+                back = self.client.get(back['previous']).data
+                previous_ids = [product['id'] for product in back['results']] + previous_ids
+            self.assertEqual(previous_ids, ids[:len(previous_ids)], ordering)
+            self.assertEqual(len(previous_ids), 40, ordering)
+
+    def test_counts_and_invalid_cursor(self):
+        self.assertNotIn('count', self.client.get(self.url).data)
+        self.assertEqual(self.client.get(self.url, {'count': 'exact'}).data['count'], 45)
+        self.assertGreater(self.client.get(self.url, {'count': 'approx'}).data['count'], 0)
+
+        self.assertEqual(self.client.get(self.url, {'cursor': 'cD1bMV0='}).status_code, 404)
+
+
+class CatalogImportExportTests(TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.balls = Category.objects.create(title='Мячи')
+        Product.objects.create(name='Мяч Select', price=Decimal('10.00'), category=self.balls)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        return path
+
+    def test_import_allocates_slugs_in_memory_and_upserts(self):
+        rows = ''.join(
+            f'{{"name": "Мяч Select", "price": "{number}.5", "category": "{self.balls.slug}"}}\n'
+            for number in range(30)
+        )
+        rows += '{"name": "Новый мяч", "slug": "мяч-select", "price": 99, "category_title": "Новинки", "is_published": false}\n'
+        path = self.write('catalog.jsonl', rows)
+
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('import_catalog', path, '--batch-size', '10', stdout=StringIO())
+        # запросы на пачку, а не на строку: 30 одинаковых названий без перебора slug в базе
+        self.assertLess(len(ctx.captured_queries), 30)
+
+        slugs = set(Product.objects.filter(name='Мяч Select').values_list('slug', flat=True))
+        self.assertEqual(len(slugs), 30)
+        self.assertIn('мяч-select-30', slugs)
+        updated = Product.objects.get(slug='мяч-select')
+        self.assertEqual((updated.name, updated.price, updated.is_published), ('Новый мяч', Decimal('99.00'), False))
+        self.assertEqual(updated.category.title, 'Новинки')
+
+    def test_export_import_roundtrip_csv(self):
+        Product.objects.create(
+            name='Бутсы', description='Кожа, "размер 42"\nвторая строка', price=Decimal('4999.90'),
+            quantity=3, category=Category.objects.create(title='Бутсы'), is_published=False
+        )
+        path = os.path.join(self.tmp, 'catalog.csv')
+        call_command('export_catalog', '--output', path, stdout=StringIO())
+        exported = list(Product.objects.order_by('pk').values('name', 'slug', 'description', 'price', 'quantity', 'is_published'))
+
+        Product.objects.update(price=1, description='')
+        call_command('import_catalog', path, stdout=StringIO())
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values('name', 'slug', 'description', 'price', 'quantity', 'is_published')),
+            exported
+        )
+
+        call_command('import_catalog', path, '--on-conflict', 'skip', stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_invalid_row_reports_line(self):
+        path = self.write('bad.csv', 'name,price,category\nМяч,10,мячи\nМяч,-1,мячи\n')
+        generation = catalog_generation()
+        with self.assertRaisesMessage(CommandError, 'строка 3'):
+            call_command('import_catalog', path, '--batch-size', '1', stdout=StringIO())
+        # первая пачка уже записана — кэш каталога сброшен и после ошибки
+        self.assertTrue(Product.objects.filter(name='Мяч', category__slug='мячи').exists())
+        self.assertNotEqual(catalog_generation(), generation)
+
+    def test_allocated_slug_taken_during_import_is_not_overwritten(self):
+        importer = CatalogImporter()
+        # товар создан другим процессом после того, как импорт загрузил занятые slug
+        Product.objects.create(name='Мяч Select', slug='мяч-select-1', price=Decimal('5.00'), category=self.balls)
+
+        importer.run([(1, {'name': 'Мяч Select', 'price': '20', 'category': self.balls.slug})])
+
+        self.assertEqual(Product.objects.get(slug='мяч-select-1').price, Decimal('5.00'))
+        self.assertEqual(Product.objects.get(slug='мяч-select-2').price, Decimal('20.00'))
+
+
+class SeedAndEndpointBenchTests(TestCase):
+    def test_seed_store_creates_consistent_data(self):
+        call_command(
+            'seed_store', '--products', '40', '--users', '5', '--carts', '3', '--orders', '10',
+            '--batch-size', '16', stdout=StringIO()
+        )
+        self.assertEqual(Product.objects.filter(slug__startswith='seed-').count(), 40)
+        self.assertEqual(Cart.objects.filter(user__username__startswith='seed-').count(), 3)
+        self.assertEqual(Order.objects.count(), 10)
+        for order in Order.objects.prefetch_related('order_items'):
+            self.assertEqual(order.total_price, sum(item.total_price for item in order.order_items.all()))
+
+        with self.assertRaises(CommandError):
+            call_command('seed_store', '--products', '1', stdout=StringIO())
+        call_command('seed_store', '--flush', '--products', '5', '--users', '1', '--orders', '1', stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 5)
+
+    @override_settings(PRODUCT_SEARCH_BACKEND='inverted_index', PRODUCT_SEARCH_INDEX_PATH=None)
+    def test_seeded_products_reach_running_indexes(self):
+        cache.clear()
+        for module in (search_index, suggest):
+            module._index = None
+            self.addCleanup(setattr, module, '_index', None)
+        # индексы воркера построены до заполнения базы
+        self.assertEqual(len(search_index.get_product_index()), 0)
+        self.assertEqual(len(suggest.get_suggest_index()), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                'seed_store', '--products', '40', '--users', '2', '--carts', '1', '--orders', '1',
+                '--batch-size', '16', stdout=StringIO()
+            )
+        published = Product.objects.filter(is_published=True).count()
+        self.assertEqual(len(search_index.get_product_index()), published)
+        self.assertEqual(len(suggest.get_suggest_index()), published)
+
+    def test_bench_covers_every_route_and_writes_json(self):
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.json')
+            stderr = StringIO()
+            call_command(
+                'bench_endpoints', '--repeat', '1', '--products', '30', '--orders', '5',
+                '--json', path, stdout=StringIO(), stderr=stderr
+            )
+            with open(path, encoding='utf-8') as file:
+                report = json.load(file)
+
+        self.assertEqual(stderr.getvalue(), '')
+        routes = {result['route'] for result in report['results'].values()}
+        self.assertIn('order-create-from-cart', routes)
+        self.assertIn('cart_item-add', routes)
+        for result in report['results'].values():
+            self.assertGreater(result['p50_ms'], 0)
+        # бенчмарк ничего не оставляет в базе
+        self.assertFalse(Product.objects.exists())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'конкурентное оформление заказов проверяется только на PostgreSQL')
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """ Потоки коммитят свои транзакции, поэтому TransactionTestCase, а не TestCase """
+
+    def test_concurrent_checkouts_do_not_oversell(self):
+        stdout = StringIO()
+        call_command(
+            'load_checkout', '--workers', '6', '--users', '40', '--hot', '2', '--hot-stock', '15',
+            '--cold', '5', '--lines', '3', stdout=stdout
+        )
+        self.assertIn('Инвариант остатков выполнен', stdout.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='load-checkout-').exists())
+
+    def test_concurrent_checkouts_with_sharded_stock_do_not_oversell(self):
+        stdout = StringIO()
+        call_command(
+            'load_checkout', '--workers', '6', '--users', '40', '--hot', '2', '--hot-stock', '15',
+            '--cold', '5', '--lines', '3', '--shards', '4', stdout=stdout
+        )
+        self.assertIn('Инвариант остатков выполнен', stdout.getvalue())
+
+    def test_concurrent_adds_of_sharded_product_keep_every_increment(self):
+        user = User.objects.create_user(username='buyer')
+        product = Product.objects.create(
+            name='Форма сборной', price=Decimal('100.00'), quantity=100, category=Category.objects.create(title='Форма')
+        )
+        enable_sharding(product, 4)
+        CartItem.objects.create(cart=Cart.objects.create(user=user), product=product, quantity=1)
+
+        def add():
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                for _ in range(5):
+                    client.post('/api/cart/item/add/', {'product': product.slug, 'quantity': 1})
+            finally:
+                connection.close()
+
+        threads = [Thread(target=add) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(CartItem.objects.get().quantity, 21)
+        self.assertEqual(Cart.objects.get().total_price, Decimal('2100.00'))
+
+
+class DriverError(Exception):
+    """ Ошибка драйвера с SQLSTATE, как у psycopg """
+    def __init__(self, sqlstate):
+        super().__init__(sqlstate)
+        self.sqlstate = sqlstate
+
+
+def transient_error(sqlstate):
+    try:
+        raise DriverError(sqlstate)
+    except DriverError as cause:
+        error = OperationalError(sqlstate)
+        error.__cause__ = cause
+        return error
+
+
+@override_settings(TRANSACTION_RETRY_BASE_DELAY=0, TRANSACTION_RETRY_MAX_DELAY=0)
+class TransactionRetryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_deadlock_is_retried_and_counted(self):
+        calls = []
+
+        @retry_transaction('test')
+        def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise transient_error(DEADLOCK)
+            return 'ok'
+
+        self.assertEqual(flaky(), 'ok')
+        self.assertEqual(retry_counters('test'), {'deadlock': 2, 'serialization': 0, 'retries': 2, 'exhausted': 0})
+
+    def test_other_errors_are_not_retried(self):
+        calls = []
+
+        @retry_transaction('test')
+        def broken():
+            calls.append(1)
+            raise transient_error('23505')
+
+        with self.assertRaises(OperationalError):
+            broken()
+        self.assertEqual(len(calls), 1)
+
+    def test_checkout_answers_503_when_retries_are_exhausted(self):
+        user = User.objects.create_user(username='buyer')
+        product = Product.objects.create(
+            name='Мяч', price=Decimal('10.00'), quantity=5, category=Category.objects.create(title='Мячи')
+        )
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=product, quantity=1, price=product.price)
+        client = APIClient()
+        client.force_authenticate(user)
+
+        with patch('main.views.lock_products', side_effect=transient_error(DEADLOCK)):
+            response = client.post('/api/v1/order/create-from-cart/')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(retry_counters('checkout')['exhausted'], 1)
+        self.assertEqual(retry_counters('checkout')['retries'], 2)
+        self.assertFalse(Order.objects.exists())
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 5)
+
+
+class ShardedStockTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer')
+        self.product = Product.objects.create(
+            name='Форма сборной', price=Decimal('100.00'), quantity=10,
+            category=Category.objects.create(title='Форма')
+        )
+        enable_sharding(self.product, 4)
+        self.product.refresh_from_db()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def shards(self):
+        return list(StockShard.objects.filter(product=self.product).order_by('index').values_list('quantity', flat=True))
+
+    def test_enable_splits_stock_evenly(self):
+        self.assertEqual(self.product.stock_shards, 4)
+        self.assertEqual(self.shards(), [3, 3, 2, 2])
+        self.assertEqual(available_stock(self.product), 10)
+
+    def test_take_stock_spills_over_shards_and_never_oversells(self):
+        with transaction.atomic():
+            self.assertTrue(take_stock(self.product.pk, 7))
+        self.assertEqual(sum(self.shards()), 3)
+        with transaction.atomic():
+            self.assertFalse(take_stock(self.product.pk, 4))
+        self.assertEqual(sum(self.shards()), 3)
+
+    def test_checkout_takes_from_shards_and_rebalance_publishes_total(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=6, price=self.product.price)
+
+        response = self.client.post('/api/v1/order/create-from-cart/')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(sum(self.shards()), 4)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 10)  # витринная копия до выравнивания
+
+        self.assertEqual(rebalance_shards(self.product.pk), 4)
+        self.assertEqual(sorted(self.shards()), [1, 1, 1, 1])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 4)
+
+    def test_cart_add_checks_sharded_stock(self):
+        response = self.client.post('/api/cart/item/add/', {'product': self.product.slug, 'quantity': 11})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/cart/item/add/', {'product': self.product.slug, 'quantity': 10})
+        self.assertEqual(response.status_code, 201)
+
+    def test_disable_returns_stock_to_product(self):
+        with transaction.atomic():
+            take_stock(self.product.pk, 2)
+        self.assertEqual(disable_sharding(self.product), 8)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock_shards, self.product.quantity), (0, 8))
+        self.assertFalse(StockShard.objects.exists())
+
+
+class IdempotencyKeyTests(TestCase):
+    url = '/api/v1/order/create-from-cart/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer')
+        self.product = Product.objects.create(
+            name='Мяч', price=Decimal('100.00'), quantity=10, category=Category.objects.create(title='Мячи')
+        )
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2, price=self.product.price)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_retried_checkout_replays_order_without_locks(self):
+        first = self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual(first.status_code, 201, first.data)
+
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1, price=self.product.price)
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='order-1')
+
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertFalse([query for query in ctx.captured_queries if 'FOR UPDATE' in query['sql']])
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 8)
+
+        # новый ключ — новый заказ
+        self.assertEqual(self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='order-2').status_code, 201)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_for_other_request_is_rejected(self):
+        self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='key')
+        response = self.client.post(
+            '/api/cart/item/add/', {'product': self.product.slug, 'quantity': 1}, HTTP_IDEMPOTENCY_KEY='key'
+        )
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_failed_request_does_not_keep_the_key(self):
+        Product.objects.filter(pk=self.product.pk).update(quantity=1)
+        self.assertEqual(self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='order').status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        Product.objects.filter(pk=self.product.pk).update(quantity=10)
+        self.assertEqual(self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='order').status_code, 201)
+
+    def test_keys_are_per_user_and_expire(self):
+        self.client.post(self.url, HTTP_IDEMPOTENCY_KEY='order')
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other'))
+        # у другого пользователя тот же ключ — другой запрос: его корзины нет
+        self.assertEqual(other.post(self.url, HTTP_IDEMPOTENCY_KEY='order').status_code, 400)
+        self.assertEqual(IdempotencyKey.objects.count(), 2)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(sweep_expired_keys(batch_size=1), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
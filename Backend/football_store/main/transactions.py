@@ -0,0 +1,113 @@
+"""
+Транзакции, которые блокируют строки товаров: единый порядок блокировок и повтор
+при взаимоблокировке (deadlock) или ошибке сериализации.
+
+Две транзакции, которые блокируют одни и те же товары в разном порядке, могут
+взаимно заблокироваться; PostgreSQL обрывает одну из них с SQLSTATE 40P01.
+lock_products() всегда блокирует строки по возрастанию pk, так что checkout и
+добавление в корзину берут блокировки в одном порядке. Если транзакция всё же
+оборвалась (40P01, 40001), retry_transaction повторяет её с экспоненциальной
+задержкой со случайным разбросом, а после TRANSACTION_RETRY_ATTEMPTS попыток
+отвечает 503 с Retry-After вместо 500.
+
+Счётчики повторов лежат в общем кэше (как поколение каталога), так что
+retry_counters() показывает сумму по всем воркерам.
+"""
+import logging
+import random
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connection, transaction
+from rest_framework.exceptions import APIException
+
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+DEADLOCK = '40P01'
+SERIALIZATION_FAILURE = '40001'
+TRANSIENT_SQLSTATES = {DEADLOCK: 'deadlock', SERIALIZATION_FAILURE: 'serialization'}
+RETRY_EVENTS = ('deadlock', 'serialization', 'retries', 'exhausted')
+
+
+class TransactionConflict(APIException):
+    status_code = 503
+    default_detail = 'Не удалось выполнить операцию из-за конкурентных изменений, повторите запрос'
+    default_code = 'transaction_conflict'
+
+    def __init__(self, detail=None, code=None):
+        super().__init__(detail, code)
+        # exception_handler DRF превращает wait в заголовок Retry-After
+        self.wait = 1
+
+
+def sqlstate(error):
+    """ SQLSTATE исходной ошибки драйвера (psycopg 3 — sqlstate, psycopg2 — pgcode) """
+    cause = error.__cause__
+    return getattr(cause, 'sqlstate', None) or getattr(cause, 'pgcode', None)
+
+
+def lock_products(product_ids, **filters):
+    """ SELECT ... FOR UPDATE товаров в порядке pk; dict pk -> Product """
+    queryset = Product.objects.select_for_update().filter(pk__in=product_ids, **filters).order_by('pk')
+    return {product.pk: product for product in queryset}
+
+
+def _counter_key(name, event):
+    return f'transactions:retry:{name}:{event}'
+
+
+def _count(name, event):
+    key = _counter_key(name, event)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def retry_counters(name):
+    """ Сколько раз транзакция name обрывалась (по причинам), повторялась и сдавалась """
+    return {event: cache.get(_counter_key(name, event), 0) for event in RETRY_EVENTS}
+
+
+def retry_delay(attempt):
+    """ Полный разброс (full jitter): случайная пауза от 0 до base * 2^(attempt-1), не больше max """
+    cap = min(settings.TRANSACTION_RETRY_MAX_DELAY, settings.TRANSACTION_RETRY_BASE_DELAY * 2 ** (attempt - 1))
+    return random.uniform(0, cap)
+
+
+def retry_transaction(name):
+    """
+    Выполняет функцию в transaction.atomic() и повторяет её при deadlock / serialization failure.
+
+    Внутри внешней транзакции (ATOMIC_REQUESTS) попытка — это точка сохранения: откат
+    к ней снимает блокировки, взятые попыткой, и deadlock лечится повтором. Ошибку
+    сериализации так не исправить (снимок внешней транзакции тот же), поэтому в этом
+    случае сразу отвечаем 503
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            nested = connection.in_atomic_block
+            attempts = settings.TRANSACTION_RETRY_ATTEMPTS
+            for attempt in range(1, attempts + 1):
+                try:
+                    with transaction.atomic():
+                        return func(*args, **kwargs)
+                except DatabaseError as error:
+                    code = sqlstate(error)
+                    if code not in TRANSIENT_SQLSTATES:
+                        raise
+                    _count(name, TRANSIENT_SQLSTATES[code])
+                    if attempt == attempts or (nested and code == SERIALIZATION_FAILURE):
+                        _count(name, 'exhausted')
+                        logger.warning('%s: %s после %d попыток', name, TRANSIENT_SQLSTATES[code], attempt)
+                        raise TransactionConflict() from error
+                    _count(name, 'retries')
+                    time.sleep(retry_delay(attempt))
+        return wrapper
+    return decorator
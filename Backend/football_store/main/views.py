@@ -1,24 +1,45 @@
+from collections import Counter
+
 from rest_framework import status, serializers, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.viewsets import ReadOnlyModelViewSet, ModelViewSet
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework.settings import api_settings
 from .pagination import *
 from django.db import transaction
-from django.db.models import F, Q
-
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Q, Case, When, Value, Count, IntegerField, PositiveIntegerField, Prefetch
+
+from .cache import CachedResponseMixin, catalog_cache_key, bump_catalog_generation
+from .compiled import CompiledListMixin
+from .conditional import ConditionalGetMixin
+from .fieldsets import SparseFieldsetMixin
+from .renderers import FastJSONRenderer
+from .filters import ProductSearchFilter
+from .inventory import take_stock
+from .idempotency import idempotent
+from .transactions import lock_products, retry_transaction
+from .suggest import get_suggest_index, SUGGEST_LIMIT, SUGGEST_MAX_LIMIT
 from .models import Category, Product, Order, OrderItem
 from .serializers import (
     CategorySerializer, ProductSerializer,
     OrderReadSerializer, OrderAdminUpdateSerializer
 )
 from cart.models import Cart
+from cart.reservations import take_holds, unreserved, update_reserved
+from cart.totals import empty_cart
 
 
-class CategoryViewSet(ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, CachedResponseMixin, ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     lookup_field = 'slug'
+    # ETag из поколения каталога: 304 и попадание в кэш ответов не ходят в базу
+    conditional_generation = True
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
@@ -26,23 +47,34 @@ class CategoryViewSet(ModelViewSet):
         return [IsAdminUser()]
 
 
-class ProductViewSet(ModelViewSet):
+# Сколько секунд браузер/CDN может кэшировать подсказки
+SUGGEST_MAX_AGE = 300
+
+
+class ProductViewSet(ConditionalGetMixin, CachedResponseMixin, SparseFieldsetMixin, CompiledListMixin, ModelViewSet):
     serializer_class = ProductSerializer
+    # Accept: application/json; fast=true — тот же ответ без ModelSerializer (см. compiled.py)
+    renderer_classes = [FastJSONRenderer, *api_settings.DEFAULT_RENDERER_CLASSES]
     lookup_field = 'slug'
     pagination_class = ProductPaginateCursor
+    # ETag из поколения каталога (его сдвигают и товары, и категории, и остатки)
+    conditional_generation = True
 
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [ProductSearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description', 'category__title']
     ordering_fields = ['price', 'created_at', 'name']
     ordering = ['-created_at']
 
     def get_queryset(self):
-        qs = Product.objects.filter(is_published=True)
+        # category нужна ProductSerializer.category_slug — забираем одним JOIN
+        qs = Product.objects.filter(is_published=True).select_related('category')
 
         # пример простого фильтра по категории через query param ?category=slug
         category_slug = self.request.query_params.get('category')
         if category_slug:
-            qs = qs.filter(category__slug=category_slug)
+            # category_id = (SELECT id ...), а не JOIN по slug: так PostgreSQL идёт по индексу
+            # (category, -created_at) / (category, price) и сразу получает нужный порядок
+            qs = qs.filter(category=Category.objects.filter(slug=category_slug).values('pk')[:1])
 
         # можно ещё ?min_price=... &max_price=...
         min_price = self.request.query_params.get('min_price')
@@ -54,8 +86,79 @@ class ProductViewSet(ModelViewSet):
 
         return qs
 
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Счётчики по категориям и ценовым диапазонам для текущих фильтров
+        (category, min_price, max_price, search) — одним GROUP BY-запросом.
+        Ответ кэшируется до следующего изменения каталога.
+        """
+        params = {
+            'category': request.query_params.get('category', '').strip(),
+            'min_price': request.query_params.get('min_price', '').strip(),
+            'max_price': request.query_params.get('max_price', '').strip(),
+            'search': ' '.join(ProductSearchFilter().get_search_terms(request)).lower(),
+        }
+        cache_key = catalog_cache_key('facets', params)
+        data = cache.get(cache_key)
+        if data is None:
+            data = self.count_facets(self.filter_queryset(self.get_queryset()))
+            cache.set(cache_key, data, settings.CATALOG_FACETS_TIMEOUT)
+        return Response(data)
+
+    @staticmethod
+    def count_facets(queryset):
+        bounds = settings.CATALOG_PRICE_BUCKETS
+        price_bucket = Case(
+            *[When(price__lt=bound, then=Value(number)) for number, bound in enumerate(bounds)],
+            default=Value(len(bounds)),
+            output_field=IntegerField()
+        )
+        rows = (
+            queryset.order_by()
+            .annotate(price_bucket=price_bucket)
+            .values('category__slug', 'category__title', 'price_bucket')
+            .annotate(count=Count('pk'))
+        )
+
+        categories = {}
+        buckets = [0] * (len(bounds) + 1)
+        for row in rows:
+            category = categories.setdefault(row['category__slug'], {
+                'slug': row['category__slug'], 'title': row['category__title'], 'count': 0
+            })
+            category['count'] += row['count']
+            buckets[row['price_bucket']] += row['count']
+
+        edges = [0, *bounds, None]
+        return {
+            'total': sum(buckets),
+            'categories': sorted(categories.values(), key=lambda c: (-c['count'], c['title'])),
+            'price': [
+                {'min': edges[number], 'max': edges[number + 1], 'count': count}
+                for number, count in enumerate(buckets)
+            ],
+        }
+
+    @action(detail=False, methods=['get'], url_path='suggest')
+    def suggest(self, request):
+        """
+        Подсказки по началу названия: ?q=бут&limit=10 → [{name, slug}, ...]
+        Отвечает из префиксного индекса в памяти, без запроса к базе
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', SUGGEST_LIMIT)), SUGGEST_MAX_LIMIT)
+        except ValueError:
+            return Response({"detail": "limit должен быть числом"}, status=status.HTTP_400_BAD_REQUEST)
+
+        suggestions = get_suggest_index().suggest(request.query_params.get('q', ''), max(limit, 1))
+        response = Response(suggestions)
+        patch_cache_control(response, public=True, max_age=SUGGEST_MAX_AGE,
+                            stale_while_revalidate=SUGGEST_MAX_AGE)
+        return response
+
 
-class OrderViewSet(ReadOnlyModelViewSet):
+class OrderViewSet(ConditionalGetMixin, SparseFieldsetMixin, ReadOnlyModelViewSet):
     """
     Просмотр своих заказов + создание заказа из корзины + отмена заказа пользователем
     + изменение статуса (только администратор)
@@ -63,14 +166,27 @@ class OrderViewSet(ReadOnlyModelViewSet):
     serializer_class = OrderReadSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = ProductPaginateCursor
+    conditional_private = True
 
     def get_queryset(self):
         """
-        Админ видит все заказы, пользователь — только свои
+        Админ видит все заказы, пользователь — только свои.
+        Связи, которых нет в ?fields= / ?omit=, не подгружаются
         """
+        qs = Order.objects.all()
+        fieldset = self.fieldset
+        if fieldset is None or fieldset.includes('username'):
+            qs = qs.select_related('user')
+        if fieldset is None or fieldset.includes('items'):
+            items = fieldset.nested.get('items') if fieldset is not None else None
+            if items is not None:
+                qs = qs.prefetch_related(
+                    Prefetch('order_items', queryset=OrderItem.objects.defer(*items.deferred))
+                )
+            qs = qs.prefetch_related('order_items__product')
         if self.request.user.is_staff:
-            return Order.objects.all().prefetch_related('order_items__product')
-        return Order.objects.filter(user=self.request.user).prefetch_related('order_items__product')
+            return qs
+        return qs.filter(user=self.request.user)
 
     def get_serializer_class(self):
         """
@@ -90,7 +206,8 @@ class OrderViewSet(ReadOnlyModelViewSet):
         return [IsAuthenticated()]
 
     @action(detail=False, methods=['post'], url_path='create-from-cart')
-    @transaction.atomic
+    @idempotent
+    @retry_transaction('checkout')
     def create_from_cart(self, request):
         """
         Создание заказа из корзины с проверкой остатков и атомарным уменьшением количества
@@ -102,50 +219,106 @@ class OrderViewSet(ReadOnlyModelViewSet):
         except Cart.DoesNotExist:
             return Response({"detail": "У вас нет корзины"}, status=400)
 
-        if not cart.items.exists():
+        # Одним запросом забираем все позиции корзины
+        cart_items = list(cart.items.select_related('product'))
+        if not cart_items:
             return Response({"detail": "Корзина пуста"}, status=400)
 
-        # Получаем ID товаров и лочим их
-        product_ids = cart.items.values_list('product_id', flat=True)
-        locked_products = {
-            p.id: p
-            for p in Product.objects.select_for_update().filter(
-                id__in=product_ids,
-                is_published=True
-            )
+        # Лочим товары корзины одним запросом, всегда в порядке pk —
+        # иначе два заказа с общими товарами могут взаимно заблокироваться.
+        # Товары с шардированным остатком строку product не блокируют: остаток
+        # списывается из шардов (main/inventory.py)
+        locked_products = lock_products(
+            [cart_item.product_id for cart_item in cart_items if not cart_item.product.stock_shards],
+            is_published=True
+        )
+        products = {
+            cart_item.product_id: cart_item.product
+            for cart_item in cart_items
+            if cart_item.product.stock_shards and cart_item.product.is_published
         }
+        products.update(locked_products)
+        # резервы позиций (cart/reservations.py) переходят в заказ: их единицы доступны этой корзине
+        held = take_holds([cart_item.pk for cart_item in cart_items])
 
-        order = Order.objects.create(user=user, status='new')
-
-        for cart_item in cart.items.select_related('product'):
-            product = locked_products.get(cart_item.product_id)
+        # шарды тоже списываем в порядке товаров
+        for cart_item in sorted(cart_items, key=lambda cart_item: cart_item.product_id):
+            product = products.get(cart_item.product_id)
 
             if not product:
                 raise serializers.ValidationError(
                     f"Товар '{cart_item.product.name}' больше недоступен или снят с публикации"
                 )
 
-            if product.quantity < cart_item.quantity:
+            if product.stock_shards:
+                # шардирование могли включить, пока мы ждали блокировку строки товара
+                if not take_stock(product.pk, cart_item.quantity):
+                    raise serializers.ValidationError(
+                        f"Недостаточно товара '{product.name}' (требуется: {cart_item.quantity})"
+                    )
+            elif product.quantity - product.reserved + held.get(cart_item.pk, 0) < cart_item.quantity:
                 raise serializers.ValidationError(
                     f"Недостаточно товара '{product.name}' "
-                    f"(в наличии: {product.quantity}, требуется: {cart_item.quantity})"
+                    f"(в наличии: {product.quantity - product.reserved}, требуется: {cart_item.quantity})"
                 )
 
-            OrderItem.objects.create(
-                order=order,
+        # bulk_create не вызывает OrderItem.save() и сигналы,
+        # поэтому цены позиций и сумму заказа считаем здесь
+        order_items = []
+        for cart_item in cart_items:
+            product = products[cart_item.product_id]
+            order_items.append(OrderItem(
                 product=product,
                 quantity=cart_item.quantity,
-                # price берётся автоматически в модели OrderItem.save()
+                price=product.price,
+                total_price=product.price * cart_item.quantity,
+            ))
+
+        order = Order.objects.create(
+            user=user,
+            status='new',
+            total_price=sum(item.total_price for item in order_items)
+        )
+        for order_item in order_items:
+            order_item.order = order
+        OrderItem.objects.bulk_create(order_items)
+
+        # Атомарное уменьшение остатков всех товаров одним UPDATE
+        # (витринный остаток шардированных товаров обновит rebalance_stock)
+        unsharded = [cart_item for cart_item in cart_items if not products[cart_item.product_id].stock_shards]
+        if unsharded:
+            released = {
+                cart_item.product_id: held[cart_item.pk] for cart_item in unsharded if held.get(cart_item.pk)
+            }
+            Product.objects.filter(pk__in=[cart_item.product_id for cart_item in unsharded]).update(
+                quantity=Case(
+                    *[
+                        When(pk=cart_item.product_id, then=F('quantity') - cart_item.quantity)
+                        for cart_item in unsharded
+                    ],
+                    output_field=PositiveIntegerField()
+                ),
+                **({'reserved': unreserved(released)} if released else {}),
+                # update() не трогает auto_now — без этого не сменятся ETag и кэш каталога
+                updated_at=timezone.now()
             )
+            transaction.on_commit(bump_catalog_generation)
 
-            # Атомарное уменьшение остатка
-            Product.objects.filter(pk=product.pk).update(
-                quantity=F('quantity') - cart_item.quantity
-            )
+        # резерв, взятый до включения шардирования (enable_sharding его не трогает), take_holds
+        # уже удалил — снимаем и его единицы с Product.reserved, иначе available занижен навсегда
+        sharded_released = Counter()
+        for cart_item in cart_items:
+            if products[cart_item.product_id].stock_shards and held.get(cart_item.pk):
+                sharded_released[cart_item.product_id] += held[cart_item.pk]
+        if sharded_released:
+            update_reserved(Product.objects.filter(pk__in=sharded_released), unreserved(sharded_released))
 
         # Успешно → чистим корзину
-        cart.items.all().delete()
+        empty_cart(cart)
 
+        order = Order.objects.select_related('user').prefetch_related(
+            'order_items__product'
+        ).get(pk=order.pk)
         serializer = OrderReadSerializer(order, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -13,15 +13,7 @@ document.addEventListener('alpine:init', () => {
             try {
                 const cartData = await getCart();
                 if (cartData && cartData.items) {
-                    this.items = cartData.items.map(item => ({
-                        id: item.id,
-                        name: item.product_name,
-                        slug: item.product_slug,
-                        price: parseFloat(item.price),
-                        quantity: item.quantity,
-                        total: parseFloat(item.total_price)
-                    }));
-                    this.updateStats();
+                    this.setItems(cartData.items);
                 }
             } catch (err) {
                 console.warn('Не удалось загрузить корзину с сервера', err);
@@ -38,11 +30,57 @@ document.addEventListener('alpine:init', () => {
             }
         },
 
+        setItems(items) {
+            this.items = items.map(item => ({
+                id: item.id,
+                name: item.product_name,
+                slug: item.product_slug,
+                price: parseFloat(item.price),
+                quantity: item.quantity,
+                total: parseFloat(item.total_price)
+            }));
+            this.updateStats();
+        },
+
         updateStats() {
             this.count = this.items.reduce((sum, item) => sum + item.quantity, 0);
             this.total = this.items.reduce((sum, item) => sum + item.total, 0);
         },
 
-        // можно добавить позже: remove, update quantity и т.д.
+        // Idempotency-Key пакета, на который не пришёл ответ: повтор того же пакета уйдёт с тем же ключом
+        pendingBatchKeys: {},
+
+        // Несколько изменений одним запросом: [{op: 'add' | 'set' | 'remove', product: slug, quantity}].
+        // Сервер применяет их целиком или никак и возвращает корзину — перезагружать её не нужно.
+        // Пользователя определяет токен, гостя — заголовок X-Guest-Cart (куки не нужны)
+        async applyBatch(operations) {
+            const token = localStorage.getItem('authToken');
+            const guestCart = localStorage.getItem('guestCart');
+            const body = JSON.stringify({ operations });
+            const res = await fetch(`${backendUrl}/api/cart/item/batch/`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': this.pendingBatchKeys[body] ??= crypto.randomUUID(),
+                    ...(token ? { 'Authorization': `Token ${token}` } : guestCart && { 'X-Guest-Cart': guestCart })
+                },
+                body
+            });
+            delete this.pendingBatchKeys[body];
+            if (!token && res.headers.get('X-Guest-Cart')) {
+                localStorage.setItem('guestCart', res.headers.get('X-Guest-Cart'));
+            }
+            const cart = await res.json();
+            if (!res.ok) throw cart;
+            this.setItems(cart.items);
+        },
+
+        setQuantity(slug, quantity) {
+            return this.applyBatch([{ op: 'set', product: slug, quantity }]);
+        },
+
+        remove(slug) {
+            return this.applyBatch([{ op: 'remove', product: slug }]);
+        },
     });
 });
\ No newline at end of file
@@ -25,7 +25,9 @@ let allProducts = [];
 
 async function loadProducts() {
     try {
-        const res = await fetch(`${backendUrl}/api/v1/product/`);
+        // карточкам не нужны description, quantity и даты — не тянем их ни из базы, ни по сети
+        const fields = "name,slug,price,image,category_slug,is_published";
+        const res = await fetch(`${backendUrl}/api/v1/product/?fields=${fields}`);
         if (!res.ok) throw new Error(`Товары: ${res.status}`);
 
         const data = await res.json();
@@ -80,6 +82,10 @@ function openProduct(slug) {
 }
 
 // ─── Добавить в корзину ───────────────────────────
+// Idempotency-Key запроса, на который не пришёл ответ: повторное нажатие после
+// сетевой ошибки отправит тот же ключ, и сервер не добавит товар второй раз
+const pendingAddKeys = {};
+
 async function addToCart(slug) {
     try {
         const token = localStorage.getItem("authToken") || "";
@@ -94,10 +100,12 @@ async function addToCart(slug) {
             method: "POST",
             headers: {
                 "Content-Type": "application/json",
-                "Authorization": `Token ${token}`
+                "Authorization": `Token ${token}`,
+                "Idempotency-Key": pendingAddKeys[slug] ??= crypto.randomUUID()
             },
             body: JSON.stringify({ product: slug, quantity: 1 })
         });
+        delete pendingAddKeys[slug];
 
         if (res.ok) {
             alert("Товар добавлен в корзину!");